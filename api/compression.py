@@ -0,0 +1,140 @@
+import zlib
+from typing import Optional
+
+import brotli
+from starlette.datastructures import Headers
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp
+from starlette.types import Message
+from starlette.types import Receive
+from starlette.types import Scope
+from starlette.types import Send
+
+######################################
+# BLOCK FOR COMPRESSION OF RESPONSES #
+######################################
+
+
+def choose_encoding(accept_encoding: str) -> Optional[str]:
+    """br or gzip, whichever the client accepts with a higher q (br on a tie)"""
+    qualities = {}
+    for part in accept_encoding.lower().split(","):
+        coding, _, params = part.strip().partition(";")
+        quality = 1.0
+        name, _, value = params.strip().partition("=")
+        if name == "q":
+            try:
+                quality = float(value)
+            except ValueError:
+                quality = 0.0
+        qualities[coding.strip()] = quality
+
+    wildcard = qualities.get("*", 0.0)
+    best = max(("br", "gzip"), key=lambda coding: qualities.get(coding, wildcard))
+    if qualities.get(best, wildcard) > 0:
+        return best
+
+
+class _Compressor:
+    def __init__(self, encoding: str, gzip_level: int, brotli_quality: int):
+        if encoding == "br":
+            self._brotli = brotli.Compressor(quality=brotli_quality)
+        else:
+            self._brotli = None
+            # wbits=31 writes the gzip header and trailer
+            self._zlib = zlib.compressobj(gzip_level, zlib.DEFLATED, 31)
+
+    def compress(self, chunk: bytes) -> bytes:
+        """Compressed data that the client can decode right away"""
+        if self._brotli is not None:
+            return self._brotli.process(chunk) + self._brotli.flush()
+        return self._zlib.compress(chunk) + self._zlib.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self) -> bytes:
+        if self._brotli is not None:
+            return self._brotli.finish()
+        return self._zlib.flush(zlib.Z_FINISH)
+
+
+class CompressionMiddleware:
+    """
+    Compresses responses of at least `minimum_size` bytes with brotli or gzip.
+    Streaming responses are compressed chunk by chunk as they are sent.
+    """
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        minimum_size: int = 1024,
+        gzip_level: int = 6,
+        brotli_quality: int = 4,
+    ):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] == "http":
+            encoding = choose_encoding(Headers(scope=scope).get("accept-encoding", ""))
+            if encoding is not None:
+                responder = _CompressingResponder(self, encoding, send)
+                await self.app(scope, receive, responder.send)
+                return
+
+        await self.app(scope, receive, send)
+
+
+class _CompressingResponder:
+    def __init__(self, middleware: CompressionMiddleware, encoding: str, send: Send):
+        self.middleware = middleware
+        self.encoding = encoding
+        self.downstream_send = send
+        self.start_message: Optional[Message] = None
+        self.compressor: Optional[_Compressor] = None
+        self.passthrough = False
+
+    async def send(self, message: Message) -> None:
+        if message["type"] == "http.response.start":
+            # headers are sent with the first body chunk, when we know its size
+            self.start_message = message
+            return
+        if message["type"] != "http.response.body" or self.passthrough:
+            await self.downstream_send(message)
+            return
+
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+        if self.start_message is not None:
+            start_message, self.start_message = self.start_message, None
+            headers = Headers(raw=start_message["headers"])
+            if "content-encoding" in headers or (
+                not more_body and len(body) < self.middleware.minimum_size
+            ):
+                self.passthrough = True
+                await self.downstream_send(start_message)
+                await self.downstream_send(message)
+                return
+
+            self.compressor = _Compressor(
+                self.encoding,
+                self.middleware.gzip_level,
+                self.middleware.brotli_quality,
+            )
+            headers = MutableHeaders(raw=start_message["headers"])
+            headers["Content-Encoding"] = self.encoding
+            headers.add_vary_header("Accept-Encoding")
+            if more_body:
+                del headers["Content-Length"]
+            else:
+                body = self.compressor.compress(body) + self.compressor.finish()
+                headers["Content-Length"] = str(len(body))
+                await self.downstream_send(start_message)
+                await self.downstream_send({**message, "body": body})
+                return
+            await self.downstream_send(start_message)
+
+        body = self.compressor.compress(body)
+        if not more_body:
+            body += self.compressor.finish()
+        await self.downstream_send({**message, "body": body})
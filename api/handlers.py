@@ -1,21 +1,50 @@
+import base64
+import time
 from logging import getLogger
+from typing import Dict
+from typing import Iterator
+from typing import List
 from typing import Optional
+from typing import Tuple
 from uuid import UUID
 
 from fastapi import Depends
+from fastapi import Query
 from fastapi.exceptions import HTTPException
 from fastapi.routing import APIRouter
 from sqlalchemy.exc import IntegrityError
-from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.exc import SQLAlchemyError
 
+import settings
+from .models import BulkDeactivateRequest
+from .models import BulkUpdateBody
+from .models import BulkUpdateRequest
+from .models import BulkUserResponse
+from .models import BulkUserResult
 from .models import DeleteUserResponse
+from .models import SearchUsersResponse
 from .models import ShowUser
 from .models import UpdateUserRequest
 from .models import UpdateUserResponse
+from .models import UserChange
+from .models import UserChangesResponse
 from .models import UserCreate
+from .models import UserStatsResponse
+from .negotiation import NegotiatedRoute
+from .validation import bulk_user_update
 from db.dals import UserDAL
+from db.deadlines import DeadlineExceeded
+from db.loaders import user_loader
+from db.models import User
+from db.notifications import user_caches
 from db.session import get_db
+from db.session import UnitOfWork
+from db.sharding import get_sharded_user_dal
+from db.sharding import ShardedUserDAL
+from db.single_flight import user_lookups
+from db.write_batcher import user_write_batcher
 from hashing import Hasher
+from hashing import hashing_pool
 
 logger = getLogger(__name__)
 
@@ -23,63 +52,378 @@ logger = getLogger(__name__)
 # BLOCK WITH API ROUTES #
 #########################
 
-user_router = APIRouter()
+# user data can be sent as MessagePack, see api.negotiation
+user_router = APIRouter(route_class=NegotiatedRoute)
 
 
-async def _create_new_user(body: UserCreate, db) -> ShowUser:
-    async with db as session:
-        async with session.begin():
+class UserStatsCache:
+    """Stats shared by all requests of this worker for USER_STATS_CACHE_SECONDS"""
+
+    def __init__(self):
+        self._fetched_at = 0.0
+        self._stats: Optional[UserStatsResponse] = None
+
+    def get(self) -> Optional[UserStatsResponse]:
+        if (
+            self._stats is not None
+            and time.monotonic() - self._fetched_at < settings.USER_STATS_CACHE_SECONDS
+        ):
+            return self._stats
+
+    def put(self, stats: UserStatsResponse) -> None:
+        self._fetched_at, self._stats = time.monotonic(), stats
+
+    def clear(self, *_) -> None:
+        self._fetched_at, self._stats = 0.0, None
+
+
+user_stats_cache = UserStatsCache()
+# a deactivation on any worker changes the counts
+user_caches.register(evict=user_stats_cache.clear, clear=user_stats_cache.clear)
+
+
+async def _create_new_user(body: UserCreate, db: UnitOfWork) -> ShowUser:
+    hashed_password = await hashing_pool.run(Hasher.get_password_hash, body.password)
+    sharded_user_dal = get_sharded_user_dal()
+    if sharded_user_dal is not None:
+        user = await sharded_user_dal.create_user(
+            name=body.name,
+            surname=body.surname,
+            email=body.email,
+            hashed_password=hashed_password,
+        )
+    elif settings.USER_WRITE_BATCHER_ENABLED:
+        # written together with the concurrent registrations, in the batcher's session
+        user = await user_write_batcher.create_user(
+            name=body.name,
+            surname=body.surname,
+            email=body.email,
+            hashed_password=hashed_password,
+        )
+    else:
+        async with db.transaction() as session:
             user_dal = UserDAL(session)
             user = await user_dal.create_user(
                 name=body.name,
                 surname=body.surname,
                 email=body.email,
-                hashed_password=Hasher.get_password_hash(body.password),
+                hashed_password=hashed_password,
             )
-            return ShowUser(
+
+    return ShowUser(
+        user_id=user.user_id,
+        name=user.name,
+        surname=user.surname,
+        email=user.email,
+        is_active=user.is_active,
+    )
+
+
+async def _get_user_by_id(user_id: UUID, db: UnitOfWork) -> Optional[ShowUser]:
+    # concurrent requests for the same user share one query
+    return await user_lookups.do(
+        ("id", user_id), lambda: _fetch_user_by_id(user_id, db)
+    )
+
+
+async def _fetch_user_by_id(user_id: UUID, db: UnitOfWork) -> Optional[ShowUser]:
+    sharded_user_dal = get_sharded_user_dal()
+    if sharded_user_dal is not None:
+        user = await sharded_user_dal.get_user_by_id(user_id=user_id)
+    elif settings.USER_LOADER_ENABLED:
+        # batched with lookups of other requests, runs in the loader's own session
+        user = await user_loader.by_id.load(user_id)
+    else:
+        async with db.transaction() as session:
+            user_dal = UserDAL(session)
+            user = await user_dal.get_user_by_id(user_id=user_id)
+
+    if user is not None:
+        return ShowUser(
+            user_id=user.user_id,
+            name=user.name,
+            surname=user.surname,
+            email=user.email,
+            is_active=user.is_active,
+        )
+
+
+def _encode_search_cursor(rank: float, user_id: UUID) -> str:
+    return base64.urlsafe_b64encode(f"{rank!r}:{user_id}".encode()).decode()
+
+
+def _decode_search_cursor(cursor: str) -> Tuple[float, UUID]:
+    try:
+        rank, user_id = base64.urlsafe_b64decode(cursor.encode()).decode().split(":")
+        return float(rank), UUID(user_id)
+    except ValueError:
+        raise HTTPException(status_code=422, detail="Invalid search cursor")
+
+
+async def _search_users(
+    text: str, limit: int, cursor: Optional[str], db: UnitOfWork
+) -> SearchUsersResponse:
+    after = _decode_search_cursor(cursor) if cursor is not None else None
+    sharded_user_dal = get_sharded_user_dal()
+    if sharded_user_dal is not None:
+        found = await sharded_user_dal.search_users(text=text, limit=limit, after=after)
+    else:
+        async with db.transaction() as session:
+            user_dal = UserDAL(session)
+            found = await user_dal.search_users(text=text, limit=limit, after=after)
+
+    next_cursor = None
+    if len(found) == limit:
+        last_user, last_rank = found[-1]
+        next_cursor = _encode_search_cursor(last_rank, last_user.user_id)
+
+    return SearchUsersResponse(
+        users=[
+            ShowUser(
                 user_id=user.user_id,
                 name=user.name,
                 surname=user.surname,
                 email=user.email,
                 is_active=user.is_active,
             )
+            for user, _ in found
+        ],
+        next_cursor=next_cursor,
+    )
 
 
-async def _get_user_by_id(user_id: UUID, db: AsyncSession) -> Optional[ShowUser]:
-    async with db as session:
-        async with session.begin():
-            user_dal = UserDAL(session)
-            user = await user_dal.get_user_by_id(user_id=user_id)
-            if user is not None:
-                return ShowUser(
-                    user_id=user.user_id,
-                    name=user.name,
-                    surname=user.surname,
-                    email=user.email,
-                    is_active=user.is_active,
-                )
+def _encode_shard_cursor(read_up_to: List[int]) -> str:
+    return base64.urlsafe_b64encode(":".join(map(str, read_up_to)).encode()).decode()
+
+
+def _decode_shard_cursor(cursor: str, shard_count: int) -> List[int]:
+    try:
+        read_up_to = [
+            int(change_seq)
+            for change_seq in base64.urlsafe_b64decode(cursor.encode())
+            .decode()
+            .split(":")
+        ]
+    except ValueError:
+        read_up_to = []
+    if len(read_up_to) != shard_count or min(read_up_to) < 0:
+        raise HTTPException(status_code=422, detail="Invalid shard cursor")
+    return read_up_to
 
 
-async def _delete_user_by_id(user_id: UUID, db: AsyncSession) -> Optional[UUID]:
-    async with db as session:
-        async with session.begin():
+def _user_change(user: User) -> UserChange:
+    return UserChange(
+        user_id=user.user_id,
+        name=user.name,
+        surname=user.surname,
+        email=user.email,
+        is_active=user.is_active,
+        change_seq=user.change_seq,
+        updated_at=user.updated_at,
+    )
+
+
+async def _get_user_changes(
+    since: int, cursor: Optional[str], limit: int, db: UnitOfWork
+) -> UserChangesResponse:
+    sharded_user_dal = get_sharded_user_dal()
+    if sharded_user_dal is not None:
+        shard_count = len(sharded_user_dal.shards)
+        read_up_to = (
+            _decode_shard_cursor(cursor, shard_count)
+            if cursor is not None
+            else [0] * shard_count
+        )
+        users, read_up_to, stalled = await sharded_user_dal.get_user_changes(
+            since=read_up_to, limit=limit
+        )
+        return UserChangesResponse(
+            changes=[_user_change(user) for user in users],
+            next_cursor=None,
+            next_shard_cursor=_encode_shard_cursor(read_up_to),
+            stalled=stalled,
+            retry_after=settings.USER_CHANGES_RETRY_AFTER_SECONDS if stalled else None,
+        )
+
+    async with db.transaction() as session:
+        user_dal = UserDAL(session)
+        users, stalled = await user_dal.get_user_changes(since=since, limit=limit)
+
+    return UserChangesResponse(
+        changes=[_user_change(user) for user in users],
+        next_cursor=users[-1].change_seq if users else since,
+        stalled=stalled,
+        retry_after=settings.USER_CHANGES_RETRY_AFTER_SECONDS if stalled else None,
+    )
+
+
+async def _get_user_stats(db: UnitOfWork) -> UserStatsResponse:
+    stats = user_stats_cache.get()
+    if stats is not None:
+        return stats
+
+    sharded_user_dal = get_sharded_user_dal()
+    if sharded_user_dal is not None:
+        total, active = await sharded_user_dal.get_user_stats()
+    else:
+        async with db.transaction() as session:
             user_dal = UserDAL(session)
-            deleted_user_id = await user_dal.delete_user_by_id(user_id=user_id)
+            total, active = await user_dal.get_user_stats()
+
+    stats = UserStatsResponse(total=total, active=active, deactivated=total - active)
+    user_stats_cache.put(stats)
+    return stats
 
-            return deleted_user_id
+
+async def _delete_user_by_id(user_id: UUID, db: UnitOfWork) -> Optional[UUID]:
+    sharded_user_dal = get_sharded_user_dal()
+    if sharded_user_dal is not None:
+        return await sharded_user_dal.delete_user_by_id(user_id=user_id)
+
+    async with db.transaction() as session:
+        user_dal = UserDAL(session)
+        deleted_user_id = await user_dal.delete_user_by_id(user_id=user_id)
+
+        return deleted_user_id
 
 
 async def _update_user_by_id(
-    user_id: UUID, updated_user_params: dict, db: AsyncSession
+    user_id: UUID, updated_user_params: dict, db: UnitOfWork
 ) -> Optional[UUID]:
-    async with db as session:
-        async with session.begin():
+    sharded_user_dal = get_sharded_user_dal()
+    if sharded_user_dal is not None:
+        return await sharded_user_dal.update_user_by_id(
+            user_id=user_id, **updated_user_params
+        )
+
+    async with db.transaction() as session:
+        user_dal = UserDAL(session)
+        updated_user_id = await user_dal.update_user_by_id(
+            user_id=user_id, **updated_user_params
+        )
+
+        return updated_user_id
+
+
+def _chunks(user_ids: List[UUID]) -> Iterator[List[UUID]]:
+    """Bulk changes commit per chunk, so huge requests don't hold one long transaction"""
+    for start in range(0, len(user_ids), settings.USER_BULK_CHUNK_SIZE):
+        yield user_ids[start : start + settings.USER_BULK_CHUNK_SIZE]
+
+
+async def _deactivate_users(user_ids: List[UUID], db: UnitOfWork) -> Dict[UUID, str]:
+    sharded_user_dal = get_sharded_user_dal()
+    statuses = {}
+    for chunk in _chunks(user_ids):
+        try:
+            if sharded_user_dal is not None:
+                deactivated_user_ids = await sharded_user_dal.deactivate_users(chunk)
+            else:
+                async with db.transaction() as session:
+                    user_dal = UserDAL(session)
+                    deactivated_user_ids = await user_dal.deactivate_users(chunk)
+        except (SQLAlchemyError, DeadlineExceeded) as err:
+            logger.error(err)
+            break
+
+        deactivated_user_ids = set(deactivated_user_ids)
+        statuses.update(
+            (user_id, "deactivated" if user_id in deactivated_user_ids else "not_found")
+            for user_id in chunk
+        )
+    # earlier chunks stay committed, the ids from the failed one on are not applied
+    return {user_id: statuses.get(user_id, "error") for user_id in user_ids}
+
+
+async def _update_users(changes: Dict[UUID, dict], db: UnitOfWork) -> Dict[UUID, str]:
+    sharded_user_dal = get_sharded_user_dal()
+    statuses = {}
+    for chunk in _chunks(list(changes)):
+        chunk_changes = {user_id: changes[user_id] for user_id in chunk}
+        try:
+            if sharded_user_dal is not None:
+                statuses.update(
+                    await _update_sharded_users(chunk_changes, sharded_user_dal)
+                )
+            else:
+                statuses.update(await _update_users_chunk(chunk_changes, db))
+        except (SQLAlchemyError, DeadlineExceeded) as err:
+            logger.error(err)
+            break
+    # earlier chunks stay committed, the ids from the failed one on are not applied
+    return {user_id: statuses.get(user_id, "error") for user_id in changes}
+
+
+async def _update_users_chunk(
+    changes: Dict[UUID, dict], db: UnitOfWork
+) -> Dict[UUID, str]:
+    try:
+        async with db.transaction() as session:
             user_dal = UserDAL(session)
-            updated_user_id = await user_dal.update_user_by_id(
-                user_id=user_id, **updated_user_params
+            updated_user_ids = set(await user_dal.update_users(changes))
+    except IntegrityError:
+        # some new email of the chunk is taken, only single updates tell which
+        return await _update_users_one_by_one(changes, db)
+
+    return {
+        user_id: "updated" if user_id in updated_user_ids else "not_found"
+        for user_id in changes
+    }
+
+
+async def _update_users_one_by_one(
+    changes: Dict[UUID, dict], db: UnitOfWork
+) -> Dict[UUID, str]:
+    statuses = {}
+    async with db.transaction() as session:
+        user_dal = UserDAL(session)
+        for user_id, fields in changes.items():
+            try:
+                async with session.begin_nested():
+                    updated_user_id = await user_dal.update_user_by_id(
+                        user_id, **fields
+                    )
+            except IntegrityError:
+                statuses[user_id] = "email_taken"
+                continue
+            statuses[user_id] = "updated" if updated_user_id else "not_found"
+    return statuses
+
+
+async def _update_sharded_users(
+    changes: Dict[UUID, dict], sharded_user_dal: ShardedUserDAL
+) -> Dict[UUID, str]:
+    statuses = {}
+    # new emails are claimed in the email index one by one
+    name_changes = {}
+    for user_id, fields in changes.items():
+        if "email" not in fields:
+            name_changes[user_id] = fields
+            continue
+        try:
+            updated_user_id = await sharded_user_dal.update_user_by_id(
+                user_id, **fields
             )
+        except IntegrityError:
+            statuses[user_id] = "email_taken"
+            continue
+        statuses[user_id] = "updated" if updated_user_id else "not_found"
+
+    if name_changes:
+        updated_user_ids = set(await sharded_user_dal.update_users(name_changes))
+        statuses.update(
+            (user_id, "updated" if user_id in updated_user_ids else "not_found")
+            for user_id in name_changes
+        )
+    return statuses
 
-            return updated_user_id
+
+async def _validate_bulk_update(body: BulkUpdateBody) -> BulkUpdateRequest:
+    """One pass over all items, the errors of every item are reported at once"""
+    cleaned, errors = bulk_user_update.validate_items(body.users, loc=["body", "users"])
+    if errors:
+        raise HTTPException(status_code=422, detail=errors)
+    return BulkUpdateRequest.from_cleaned(cleaned)
 
 
 #########################
@@ -88,7 +432,7 @@ async def _update_user_by_id(
 
 
 @user_router.post("/", response_model=ShowUser)
-async def create_user(body: UserCreate, db: AsyncSession = Depends(get_db)) -> ShowUser:
+async def create_user(body: UserCreate, db: UnitOfWork = Depends(get_db)) -> ShowUser:
     try:
         return await _create_new_user(body, db)
     except IntegrityError as err:
@@ -97,7 +441,7 @@ async def create_user(body: UserCreate, db: AsyncSession = Depends(get_db)) -> S
 
 
 @user_router.get("/", response_model=ShowUser)
-async def get_user_by_id(user_id: UUID, db: AsyncSession = Depends(get_db)) -> ShowUser:
+async def get_user_by_id(user_id: UUID, db: UnitOfWork = Depends(get_db)) -> ShowUser:
     user = await _get_user_by_id(user_id, db)
     if user is None:
         raise HTTPException(status_code=404, detail=f"User with id {user_id} not found")
@@ -105,9 +449,34 @@ async def get_user_by_id(user_id: UUID, db: AsyncSession = Depends(get_db)) -> S
     return user
 
 
+@user_router.get("/search", response_model=SearchUsersResponse)
+async def search_users(
+    q: str = Query(min_length=3),
+    limit: int = Query(default=20, ge=1, le=100),
+    cursor: Optional[str] = None,
+    db: UnitOfWork = Depends(get_db),
+) -> SearchUsersResponse:
+    return await _search_users(q, limit, cursor, db)
+
+
+@user_router.get("/changes", response_model=UserChangesResponse)
+async def get_user_changes(
+    since: int = Query(default=0, ge=0),
+    cursor: Optional[str] = None,
+    limit: int = Query(default=100, ge=1, le=1000),
+    db: UnitOfWork = Depends(get_db),
+) -> UserChangesResponse:
+    return await _get_user_changes(since, cursor, limit, db)
+
+
+@user_router.get("/stats", response_model=UserStatsResponse)
+async def get_user_stats(db: UnitOfWork = Depends(get_db)) -> UserStatsResponse:
+    return await _get_user_stats(db)
+
+
 @user_router.delete("/", response_model=DeleteUserResponse)
 async def delete_user_by_id(
-    user_id: UUID, db: AsyncSession = Depends(get_db)
+    user_id: UUID, db: UnitOfWork = Depends(get_db)
 ) -> DeleteUserResponse:
     deleted_user_id = await _delete_user_by_id(user_id, db)
     if deleted_user_id is None:
@@ -118,7 +487,7 @@ async def delete_user_by_id(
 
 @user_router.patch("/", response_model=UpdateUserResponse)
 async def update_user_by_id(
-    user_id: UUID, body: UpdateUserRequest, db: AsyncSession = Depends(get_db)
+    user_id: UUID, body: UpdateUserRequest, db: UnitOfWork = Depends(get_db)
 ) -> UpdateUserResponse:
 
     updated_user_params = body.dict(
@@ -130,14 +499,58 @@ async def update_user_by_id(
             detail="At least one parameter for user update info should be provided",
         )
 
-    user = await _get_user_by_id(user_id, db)
-    if user is None:
-        raise HTTPException(status_code=404, detail=f"User with id {user_id} not found")
-
     try:
-        updated_user_id = await _update_user_by_id(user_id, updated_user_params, db)
+        # the existence check and the update share one transaction and connection
+        async with db.transaction():
+            user = await _get_user_by_id(user_id, db)
+            if user is None:
+                raise HTTPException(
+                    status_code=404, detail=f"User with id {user_id} not found"
+                )
+
+            updated_user_id = await _update_user_by_id(user_id, updated_user_params, db)
     except IntegrityError as err:
         logger.error(err)
         raise HTTPException(status_code=503, detail=f"Database error: {err}")
 
     return UpdateUserResponse(updated_user_id=updated_user_id)
+
+
+@user_router.post("/bulk-deactivate", response_model=BulkUserResponse)
+async def deactivate_users(
+    body: BulkDeactivateRequest, db: UnitOfWork = Depends(get_db)
+) -> BulkUserResponse:
+    user_ids = list(dict.fromkeys(body.user_ids))
+    statuses = await _deactivate_users(user_ids, db)
+    return BulkUserResponse(
+        results=[
+            BulkUserResult(user_id=user_id, status=statuses[user_id])
+            for user_id in user_ids
+        ]
+    )
+
+
+@user_router.patch("/bulk", response_model=BulkUserResponse)
+async def update_users(
+    body: BulkUpdateRequest = Depends(_validate_bulk_update),
+    db: UnitOfWork = Depends(get_db),
+) -> BulkUserResponse:
+    changes = {}
+    for user in body.users:
+        fields = user.dict(exclude_none=True, exclude={"user_id"})
+        if fields == {}:
+            raise HTTPException(
+                status_code=422,
+                detail=f"At least one parameter for update of user {user.user_id}"
+                " should be provided",
+            )
+        # a user listed twice gets the fields of all its items, the last one wins
+        changes.setdefault(user.user_id, {}).update(fields)
+
+    statuses = await _update_users(changes, db)
+    return BulkUserResponse(
+        results=[
+            BulkUserResult(user_id=user_id, status=statuses[user_id])
+            for user_id in changes
+        ]
+    )
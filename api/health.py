@@ -0,0 +1,134 @@
+import asyncio
+import time
+from logging import getLogger
+from typing import Optional
+
+from fastapi import Depends
+from fastapi import Request
+from fastapi import Response
+from fastapi.routing import APIRouter
+from sqlalchemy import text
+from sqlalchemy.pool import Pool
+
+import settings
+from api.models import PoolStats
+from api.models import ReadinessResponse
+from db.session import engine
+from db.session import get_db
+from db.session import UnitOfWork
+from db.sharding import get_sharded_user_dal
+from db.single_flight import SingleFlight
+from hashing import hashing_pool
+
+logger = getLogger(__name__)
+
+###########################################
+# BLOCK FOR LIVENESS AND READINESS PROBES #
+###########################################
+
+health_router = APIRouter()
+
+
+class DatabasePingCache:
+    """Result of the last database ping of this worker, kept HEALTH_DB_PING_CACHE_SECONDS"""
+
+    def __init__(self):
+        self._checked_at = 0.0
+        self._ok = False
+
+    def get(self) -> Optional[bool]:
+        if time.monotonic() - self._checked_at < settings.HEALTH_DB_PING_CACHE_SECONDS:
+            return self._ok
+
+    def put(self, ok: bool) -> None:
+        self._checked_at, self._ok = time.monotonic(), ok
+
+    def clear(self) -> None:
+        self._checked_at, self._ok = 0.0, False
+
+
+db_ping_cache = DatabasePingCache()
+# concurrent probes wait for one ping instead of taking a connection each
+_db_pings = SingleFlight(max_tracked_keys=1)
+
+
+async def _ping_database(db: UnitOfWork) -> bool:
+    try:
+        async with db.transaction() as session:
+            await asyncio.wait_for(
+                session.execute(text("SELECT 1")),
+                settings.HEALTH_DB_PING_TIMEOUT_SECONDS,
+            )
+    except Exception:
+        logger.warning("Database ping failed", exc_info=True)
+        return False
+    return True
+
+
+async def _is_database_available(db: UnitOfWork) -> bool:
+    ok = db_ping_cache.get()
+    if ok is not None:
+        return ok
+
+    ok = await _db_pings.do("ping", lambda: _ping_database(db))
+    db_ping_cache.put(ok)
+    return ok
+
+
+def _get_pool_stats(pool: Pool) -> PoolStats:
+    # QueuePool counts overflow from -pool_size until the pool is full
+    overflow = max(pool.overflow(), 0)
+    capacity = settings.DB_POOL_SIZE + max(settings.DB_MAX_OVERFLOW, 0)
+    return PoolStats(
+        size=pool.size(),
+        checked_out=pool.checkedout(),
+        overflow=overflow,
+        saturation=pool.checkedout() / capacity if capacity else 0.0,
+    )
+
+
+@health_router.get("/live")
+async def live() -> dict:
+    """The event loop answers, the worker should not be restarted"""
+    return {"live": True}
+
+
+@health_router.get("/ready", response_model=ReadinessResponse)
+async def ready(
+    request: Request, response: Response, db: UnitOfWork = Depends(get_db)
+) -> ReadinessResponse:
+    """The worker can take traffic: started, database reachable, not saturated"""
+    pool = _get_pool_stats(engine.pool)
+    sharded_user_dal = get_sharded_user_dal()
+    sharded_pools = (
+        [
+            _get_pool_stats(shard_engine.pool)
+            for shard_engine in sharded_user_dal.shards.engines
+        ]
+        if sharded_user_dal is not None
+        else []
+    )
+    database = await _is_database_available(db)
+    hashing_queue = hashing_pool.queue_depth
+
+    reasons = []
+    if not request.app.state.ready:
+        reasons.append("starting or shutting down")
+    if not database:
+        reasons.append("database is not available")
+    saturation = max(stats.saturation for stats in [pool, *sharded_pools])
+    if saturation >= settings.HEALTH_MAX_POOL_SATURATION:
+        reasons.append("connection pool is saturated")
+    if hashing_queue > settings.HEALTH_MAX_HASHING_QUEUE:
+        reasons.append("hashing queue is too long")
+
+    if reasons:
+        response.status_code = 503
+    return ReadinessResponse(
+        ready=not reasons,
+        reasons=reasons,
+        database=database,
+        pool=pool,
+        sharded_pools=sharded_pools,
+        hashing_queue=hashing_queue,
+    )
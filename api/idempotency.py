@@ -0,0 +1,268 @@
+import asyncio
+import hashlib
+import json
+import time
+from abc import ABC
+from abc import abstractmethod
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+from starlette.datastructures import Headers
+from starlette.types import ASGIApp
+from starlette.types import Message
+from starlette.types import Receive
+from starlette.types import Scope
+from starlette.types import Send
+
+#############################################
+# BLOCK FOR IDEMPOTENT RETRIES OF MUTATIONS #
+#############################################
+
+IDEMPOTENCY_HEADER = "idempotency-key"
+MUTATION_METHODS = ("POST", "PUT", "PATCH", "DELETE")
+
+
+@dataclass
+class StoredResponse:
+    status: int
+    headers: List[Tuple[bytes, bytes]]
+    body: bytes
+
+
+@dataclass
+class IdempotencyRecord:
+    # hash of the request the key was first used with
+    fingerprint: str
+    # None while the first request is still running
+    response: Optional[StoredResponse] = None
+
+
+class IdempotencyStore(ABC):
+    """
+    Where the first response of every Idempotency-Key is kept.
+    A shared backend (redis, a database table) lets all workers see the keys.
+    """
+
+    @abstractmethod
+    async def start(
+        self, key: str, fingerprint: str, ttl: float
+    ) -> Optional[IdempotencyRecord]:
+        """Marks the key as in progress and returns None, or returns its record"""
+
+    @abstractmethod
+    async def finish(self, key: str, record: IdempotencyRecord, ttl: float) -> None:
+        """Keeps the response of the first request for `ttl` seconds"""
+
+    @abstractmethod
+    async def abandon(self, key: str) -> None:
+        """The first request failed, a retry may run it again"""
+
+    @abstractmethod
+    async def get(self, key: str) -> Optional[IdempotencyRecord]:
+        """Record of the key, None if it is unknown or expired"""
+
+    async def wait(self, key: str, timeout: float) -> Optional[IdempotencyRecord]:
+        """Record once it has a response, None if abandoned, or as is on timeout"""
+        deadline = time.monotonic() + timeout
+        while True:
+            record = await self.get(key)
+            if record is None or record.response is not None:
+                return record
+            if time.monotonic() >= deadline:
+                return record
+            await asyncio.sleep(min(0.05, deadline - time.monotonic()))
+
+
+class InMemoryIdempotencyStore(IdempotencyStore):
+    """Keys of this worker only, the oldest are dropped above `max_keys`"""
+
+    def __init__(self, max_keys: int = 100_000):
+        self._max_keys = max_keys
+        self._records: "OrderedDict[str, Tuple[float, IdempotencyRecord]]" = (
+            OrderedDict()
+        )
+        self._done: Dict[str, asyncio.Event] = {}
+
+    async def start(
+        self, key: str, fingerprint: str, ttl: float
+    ) -> Optional[IdempotencyRecord]:
+        record = await self.get(key)
+        if record is not None:
+            return record
+
+        self._put(key, IdempotencyRecord(fingerprint=fingerprint), ttl)
+        self._done[key] = asyncio.Event()
+
+    async def finish(self, key: str, record: IdempotencyRecord, ttl: float) -> None:
+        self._put(key, record, ttl)
+        self._set_done(key)
+
+    async def abandon(self, key: str) -> None:
+        self._records.pop(key, None)
+        self._set_done(key)
+
+    async def get(self, key: str) -> Optional[IdempotencyRecord]:
+        expires_at, record = self._records.get(key, (0.0, None))
+        if record is not None and time.monotonic() >= expires_at:
+            del self._records[key]
+            return
+        return record
+
+    async def wait(self, key: str, timeout: float) -> Optional[IdempotencyRecord]:
+        done = self._done.get(key)
+        if done is not None:
+            try:
+                await asyncio.wait_for(done.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return await self.get(key)
+
+    def _put(self, key: str, record: IdempotencyRecord, ttl: float) -> None:
+        self._records[key] = (time.monotonic() + ttl, record)
+        self._records.move_to_end(key)
+        while len(self._records) > self._max_keys:
+            self._records.popitem(last=False)
+
+    def _set_done(self, key: str) -> None:
+        done = self._done.pop(key, None)
+        if done is not None:
+            done.set()
+
+
+class IdempotencyMiddleware:
+    """
+    Mutations sent with an Idempotency-Key header run once per key:
+    retries get the stored first response without reaching the handlers,
+    concurrent duplicates wait for the first request to finish.
+    5xx responses are not stored, so a retry may succeed later.
+    """
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        store: IdempotencyStore,
+        ttl_seconds: float = 24 * 60 * 60,
+        wait_seconds: float = 30,
+    ):
+        self.app = app
+        self.store = store
+        self.ttl_seconds = ttl_seconds
+        self.wait_seconds = wait_seconds
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or scope["method"] not in MUTATION_METHODS:
+            await self.app(scope, receive, send)
+            return
+
+        headers = Headers(scope=scope)
+        idempotency_key = headers.get(IDEMPOTENCY_HEADER)
+        if idempotency_key is None:
+            await self.app(scope, receive, send)
+            return
+
+        body = await _read_body(receive)
+        # a key belongs to one client and one endpoint
+        key = _sha256(
+            scope["method"],
+            scope["path"],
+            headers.get("authorization", ""),
+            idempotency_key,
+        )
+        fingerprint = _sha256(scope["query_string"].decode(), body.decode("latin-1"))
+
+        deadline = time.monotonic() + self.wait_seconds
+        record = await self.store.start(key, fingerprint, self.ttl_seconds)
+        while record is not None:
+            if record.fingerprint != fingerprint:
+                await _send_error(
+                    send, 422, "Idempotency-Key was already used with another request"
+                )
+                return
+            if record.response is not None:
+                await _replay(send, record.response)
+                return
+            if time.monotonic() >= deadline:
+                await _send_error(
+                    send, 409, "Request with this Idempotency-Key is still in progress"
+                )
+                return
+
+            record = await self.store.wait(key, deadline - time.monotonic())
+            if record is None:
+                # the first request failed, this one takes over
+                record = await self.store.start(key, fingerprint, self.ttl_seconds)
+
+        response = StoredResponse(status=500, headers=[], body=b"")
+
+        async def replay_receive() -> Message:
+            nonlocal body
+            if body is None:
+                return await receive()
+            message = {"type": "http.request", "body": body, "more_body": False}
+            body = None
+            return message
+
+        async def capturing_send(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                response.status = message["status"]
+                response.headers = list(message.get("headers", []))
+            elif message["type"] == "http.response.body":
+                response.body += message.get("body", b"")
+            await send(message)
+
+        try:
+            await self.app(scope, replay_receive, capturing_send)
+        except BaseException:
+            await self.store.abandon(key)
+            raise
+
+        if response.status >= 500:
+            await self.store.abandon(key)
+        else:
+            await self.store.finish(
+                key, IdempotencyRecord(fingerprint, response), self.ttl_seconds
+            )
+
+
+async def _read_body(receive: Receive) -> bytes:
+    body = b""
+    more_body = True
+    while more_body:
+        message = await receive()
+        body += message.get("body", b"")
+        more_body = message.get("more_body", False)
+    return body
+
+
+def _sha256(*parts: str) -> str:
+    return hashlib.sha256("\0".join(parts).encode()).hexdigest()
+
+
+async def _replay(send: Send, response: StoredResponse) -> None:
+    await send(
+        {
+            "type": "http.response.start",
+            "status": response.status,
+            "headers": response.headers + [(b"idempotent-replayed", b"true")],
+        }
+    )
+    await send({"type": "http.response.body", "body": response.body})
+
+
+async def _send_error(send: Send, status: int, detail: str) -> None:
+    body = json.dumps({"detail": detail}).encode()
+    await send(
+        {
+            "type": "http.response.start",
+            "status": status,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+            ],
+        }
+    )
+    await send({"type": "http.response.body", "body": body})
@@ -1,4 +1,5 @@
 from datetime import timedelta
+from logging import getLogger
 from typing import Optional
 
 from fastapi import Depends
@@ -7,52 +8,99 @@ from fastapi.exceptions import HTTPException
 from fastapi.routing import APIRouter
 from fastapi.security import OAuth2PasswordBearer
 from fastapi.security import OAuth2PasswordRequestForm
-from jose import jwt
-from jose import JWTError
-from sqlalchemy.ext.asyncio import AsyncSession
 
 import settings
 from .models import ShowUser
 from .models import Token
 from db.dals import UserDAL
+from db.loaders import user_loader
 from db.models import User
 from db.session import get_db
+from db.session import UnitOfWork
+from db.sharding import get_sharded_user_dal
+from db.single_flight import user_lookups
 from hashing import Hasher
+from hashing import hashing_pool
 from security import create_access_token
+from security import decode_access_token
+from security import TokenError
 
+logger = getLogger(__name__)
 
 #########################
 # BLOCK WITH API ROUTES #
 #########################
 
 
-async def _get_user_by_email_for_auth(email: str, db: AsyncSession) -> Optional[User]:
+async def _get_user_by_email_for_auth(email: str, db: UnitOfWork) -> Optional[User]:
+    """Одновременные запросы с одним email получают результат одного запроса к БД."""
+    return await user_lookups.do(
+        ("email", email), lambda: _fetch_user_by_email(email, db)
+    )
+
+
+async def _fetch_user_by_email(email: str, db: UnitOfWork) -> Optional[User]:
     """Открывает сессию с БД. Передает email для поиска юзера."""
-    async with db as session:
-        async with session.begin():
-            user_dal = UserDAL(session)
-            return await user_dal.get_user_by_email(email=email)
+    sharded_user_dal = get_sharded_user_dal()
+    if sharded_user_dal is not None:
+        # шард юзера находится по глобальному индексу email
+        return await sharded_user_dal.get_user_by_email(email=email)
+
+    if settings.USER_LOADER_ENABLED:
+        # поиск объединяется с запросами других юзеров в один запрос к БД
+        return await user_loader.by_email.load(email)
+
+    async with db.transaction() as session:
+        user_dal = UserDAL(session)
+        return await user_dal.get_user_by_email(email=email)
 
 
 async def authenticate_user(
-    email: str, password: str, db: AsyncSession
+    email: str, password: str, db: UnitOfWork
 ) -> Optional[User]:
     """Проверка на наличие юзера и на правильность пароля."""
     user = await _get_user_by_email_for_auth(email=email, db=db)
     if user is None:
         return
 
-    if not Hasher.verify_password(password, user.hashed_password):
+    verified, new_hash = await hashing_pool.run(
+        Hasher.verify_and_update, password, user.hashed_password
+    )
+    if not verified:
         return
 
+    if new_hash is not None:
+        await _save_rehashed_password(user, new_hash, db)
     return user
 
 
+async def _save_rehashed_password(user: User, new_hash: str, db: UnitOfWork) -> None:
+    """
+    Сохраняет хэш с текущими параметрами вместо устаревшего.
+    Ошибка не мешает логину: хэш обновится при следующем.
+    """
+    try:
+        sharded_user_dal = get_sharded_user_dal()
+        if sharded_user_dal is not None:
+            await sharded_user_dal.replace_password_hash(
+                user.user_id, user.hashed_password, new_hash
+            )
+            return
+
+        async with db.transaction() as session:
+            user_dal = UserDAL(session)
+            await user_dal.replace_password_hash(
+                user.user_id, user.hashed_password, new_hash
+            )
+    except Exception as err:
+        logger.warning("Rehashed password of %s is not saved: %s", user.user_id, err)
+
+
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/login/token")
 
 
 async def get_current_user_from_token(
-    token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_db)
+    token: str = Depends(oauth2_scheme), db: UnitOfWork = Depends(get_db)
 ) -> Optional[ShowUser]:
     """Получение юзера из токена"""
     credentials_exception = HTTPException(
@@ -61,11 +109,11 @@ async def get_current_user_from_token(
     )
 
     try:
-        payload = jwt.decode(token, settings.SECRET_KEY, settings.ALGORITHM)
-        email: str = payload.get("sub")
-        if email is None:
-            raise credentials_exception
-    except JWTError:
+        payload = decode_access_token(token)
+    except TokenError:
+        raise credentials_exception
+    email: str = payload.get("sub")
+    if email is None:
         raise credentials_exception
 
     user = await _get_user_by_email_for_auth(email=email, db=db)
@@ -90,7 +138,7 @@ login_router = APIRouter()
 
 @login_router.post("/token", response_model=Token)
 async def login_for_access_token(
-    form_data: OAuth2PasswordRequestForm = Depends(), db: AsyncSession = Depends(get_db)
+    form_data: OAuth2PasswordRequestForm = Depends(), db: UnitOfWork = Depends(get_db)
 ):
     """
     Отвечает за аутентификацию юзера.
@@ -1,20 +1,23 @@
-import re
 import uuid
+from datetime import datetime
+from typing import List
 from typing import Optional
 
 from fastapi import HTTPException
 from pydantic import BaseModel
+from pydantic import conlist
 from pydantic import constr
-from pydantic import EmailStr
 from pydantic import validator
 
+import settings
+from .validation import FastEmailStr
+from .validation import LETTER_MATCH_PATTERN
+
 #########################
 # BLOCK WITH API MODELS #
 #########################
 
 
-LETTER_MATCH_PATTERN = re.compile(r"^[а-яА-Яa-zA-Z\-]+$")
-
 #########################
 # INPUT MODELS #
 #########################
@@ -25,7 +28,7 @@ class UserCreate(BaseModel):
 
     name: str
     surname: str
-    email: EmailStr
+    email: FastEmailStr
     password: str
 
     @validator("name")
@@ -48,7 +51,7 @@ class UserCreate(BaseModel):
 class UpdateUserRequest(BaseModel):
     name: Optional[constr(min_length=1)]
     surname: Optional[constr(min_length=1)]
-    email: Optional[EmailStr]
+    email: Optional[FastEmailStr]
 
     @validator("name")
     def validator_name(cls, value):
@@ -69,6 +72,37 @@ class UpdateUserRequest(BaseModel):
         return value
 
 
+class BulkDeactivateRequest(BaseModel):
+    user_ids: conlist(uuid.UUID, min_items=1, max_items=settings.USER_BULK_MAX_ITEMS)
+
+
+class BulkUpdateUser(UpdateUserRequest):
+    user_id: uuid.UUID
+
+
+class BulkUpdateBody(BaseModel):
+    """Body of user.patch bulk method, its items are checked by bulk_user_update"""
+
+    users: conlist(dict, min_items=1, max_items=settings.USER_BULK_MAX_ITEMS)
+
+    class Config:
+        @staticmethod
+        def schema_extra(schema: dict, model: type) -> None:
+            # the docs show the fields of the items all the same
+            schema["properties"]["users"]["items"] = BulkUpdateUser.schema()
+
+
+class BulkUpdateRequest(BaseModel):
+    users: List[BulkUpdateUser]
+
+    @classmethod
+    def from_cleaned(cls, cleaned: List[dict]) -> "BulkUpdateRequest":
+        """Items cleaned by bulk_user_update are valid, they are not validated again"""
+        return cls.construct(
+            users=[BulkUpdateUser.construct(**fields) for fields in cleaned]
+        )
+
+
 #########################
 # OUTPUT MODELS #
 #########################
@@ -83,10 +117,71 @@ class ShowUser(TunedModel):
     user_id: uuid.UUID
     name: str
     surname: str
-    email: EmailStr
+    email: FastEmailStr
     is_active: bool
 
 
+class SearchUsersResponse(BaseModel):
+    users: List[ShowUser]
+    # pass it as `cursor` to get the next page, None on the last page
+    next_cursor: Optional[str]
+
+
+class UserChange(ShowUser):
+    change_seq: int
+    updated_at: datetime
+
+
+class UserChangesResponse(BaseModel):
+    # deactivated users come with is_active=False
+    changes: List[UserChange]
+    # pass it as `since` in the next request, None with sharded users
+    next_cursor: Optional[int]
+    # with sharded users: pass it as `cursor` in the next request, `since` is ignored
+    next_shard_cursor: Optional[str] = None
+    # the page ends early at a change of a still running transaction: the rest
+    # comes once it finishes, ask again after `retry_after` seconds
+    stalled: bool = False
+    retry_after: Optional[float] = None
+
+
+class UserStatsResponse(BaseModel):
+    total: int
+    active: int
+    deactivated: int
+
+
+class PoolStats(BaseModel):
+    size: int
+    checked_out: int
+    overflow: int
+    # checked out / (pool size + max overflow)
+    saturation: float
+
+
+class ReadinessResponse(BaseModel):
+    ready: bool
+    # why the worker is not ready, empty when it is
+    reasons: List[str]
+    database: bool
+    pool: PoolStats
+    # with sharded users: the pools of every shard and of the email index
+    sharded_pools: List[PoolStats] = []
+    hashing_queue: int
+
+
+class BulkUserResult(BaseModel):
+    user_id: uuid.UUID
+    # deactivated / updated, not_found (no active user with this id), email_taken,
+    # error (a database error stopped the request before this user, retry it)
+    status: str
+
+
+class BulkUserResponse(BaseModel):
+    # one result per distinct id, in the order of the request
+    results: List[BulkUserResult]
+
+
 class DeleteUserResponse(BaseModel):
     deleted_user_id: uuid.UUID
 
@@ -0,0 +1,78 @@
+from typing import Any
+from typing import Callable
+from typing import Coroutine
+from typing import Dict
+
+import msgpack
+from fastapi.routing import APIRoute
+from starlette.requests import Request
+from starlette.responses import Response
+
+############################################
+# BLOCK FOR NEGOTIATION OF RESPONSE FORMAT #
+############################################
+
+MSGPACK_MEDIA_TYPES = ("application/msgpack", "application/x-msgpack")
+
+
+class MsgPackResponse(Response):
+    media_type = MSGPACK_MEDIA_TYPES[0]
+
+    def render(self, content: Any) -> bytes:
+        # FastAPI passes the content through jsonable_encoder already
+        return msgpack.packb(content)
+
+
+def _accept_quality(accept: str) -> Dict[str, float]:
+    """Media type -> q value of an Accept header"""
+    qualities = {}
+    for part in accept.split(","):
+        media_type, *params = part.strip().split(";")
+        quality = 1.0
+        for param in params:
+            name, _, value = param.strip().partition("=")
+            if name == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        qualities[media_type.strip().lower()] = quality
+    return qualities
+
+
+def prefers_msgpack(accept: str) -> bool:
+    if "msgpack" not in accept:
+        return False
+
+    qualities = _accept_quality(accept)
+    msgpack_quality = max(
+        qualities.get(media_type, 0.0) for media_type in MSGPACK_MEDIA_TYPES
+    )
+    json_quality = max(
+        qualities.get("application/json", 0.0),
+        qualities.get("application/*", 0.0),
+        qualities.get("*/*", 0.0),
+    )
+    return msgpack_quality > 0 and msgpack_quality >= json_quality
+
+
+class NegotiatedRoute(APIRoute):
+    """Answers with MessagePack instead of JSON when the Accept header asks for it"""
+
+    def get_route_handler(self) -> Callable[[Request], Coroutine[Any, Any, Response]]:
+        json_handler = super().get_route_handler()
+        response_class, self.response_class = self.response_class, MsgPackResponse
+        try:
+            msgpack_handler = super().get_route_handler()
+        finally:
+            self.response_class = response_class
+
+        async def route_handler(request: Request) -> Response:
+            if prefers_msgpack(request.headers.get("accept", "")):
+                response = await msgpack_handler(request)
+            else:
+                response = await json_handler(request)
+            response.headers.add_vary_header("Accept")
+            return response
+
+        return route_handler
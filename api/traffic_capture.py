@@ -0,0 +1,196 @@
+import json
+import queue
+import random
+import threading
+import time
+from typing import Iterator
+from typing import Optional
+from urllib.parse import parse_qsl
+from urllib.parse import urlencode
+
+import msgpack
+from starlette.datastructures import Headers
+from starlette.types import ASGIApp
+from starlette.types import Message
+from starlette.types import Receive
+from starlette.types import Scope
+from starlette.types import Send
+
+########################################
+# BLOCK FOR CAPTURE OF SAMPLED TRAFFIC #
+########################################
+
+REDACTED = "***"
+# values of these fields never reach the capture file
+SECRET_FIELDS = frozenset(
+    (
+        "password",
+        "hashed_password",
+        "token",
+        "access_token",
+        "refresh_token",
+        "client_secret",
+    )
+)
+# headers kept for replay, credentials are only marked as present
+CAPTURED_HEADERS = (
+    "content-type",
+    "accept",
+    "accept-encoding",
+    "idempotency-key",
+    "x-request-timeout-ms",
+)
+
+
+def redact_json(value):
+    if isinstance(value, dict):
+        return {
+            key: REDACTED if key in SECRET_FIELDS else redact_json(item)
+            for key, item in value.items()
+        }
+    if isinstance(value, list):
+        return [redact_json(item) for item in value]
+    return value
+
+
+def redact_query(query: str) -> str:
+    """Also used for form bodies, they are encoded the same way"""
+    return urlencode(
+        [
+            (key, REDACTED if key in SECRET_FIELDS else value)
+            for key, value in parse_qsl(query, keep_blank_values=True)
+        ]
+    )
+
+
+def redact_body(body: bytes, content_type: str) -> Optional[bytes]:
+    """Body without secrets, None when it can't be parsed to redact them"""
+    if not body:
+        return body
+    try:
+        if content_type.startswith("application/x-www-form-urlencoded"):
+            return redact_query(body.decode()).encode()
+        return json.dumps(redact_json(json.loads(body))).encode()
+    except ValueError:
+        return
+
+
+class TrafficRecorder:
+    """
+    Appends captured requests to a file of MessagePack records.
+    Requests only enqueue them, a background thread writes; records that
+    don't fit into the queue are dropped.
+    """
+
+    def __init__(self, path: str, queue_size: int = 10_000):
+        self.path = path
+        self.dropped = 0
+        self._queue: queue.Queue = queue.Queue(maxsize=queue_size)
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        if self._thread is None:
+            self._thread = threading.Thread(
+                target=self._write, name="traffic-capture", daemon=True
+            )
+            self._thread.start()
+
+    def stop(self) -> None:
+        """Writes out the queued records"""
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+
+    def record(self, entry: dict) -> None:
+        try:
+            self._queue.put_nowait(entry)
+        except queue.Full:
+            self.dropped += 1
+
+    def _write(self) -> None:
+        packer = msgpack.Packer()
+        with open(self.path, "ab") as capture_file:
+            while True:
+                entry = self._queue.get()
+                if entry is None:
+                    return
+                capture_file.write(packer.pack(entry))
+                if self._queue.empty():
+                    capture_file.flush()
+
+
+def read_traffic(path: str) -> Iterator[dict]:
+    with open(path, "rb") as capture_file:
+        yield from msgpack.Unpacker(capture_file, raw=False)
+
+
+class TrafficCaptureMiddleware:
+    """
+    Records `sample_rate` of requests for replay: arrival time, method, path,
+    query, a few headers and the body with secrets redacted, plus the status
+    and duration of the response. Response bodies are never recorded.
+    """
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        recorder: TrafficRecorder,
+        sample_rate: float,
+        max_body_bytes: int = 64 * 1024,
+    ):
+        self.app = app
+        self.recorder = recorder
+        self.sample_rate = sample_rate
+        self.max_body_bytes = max_body_bytes
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or random.random() >= self.sample_rate:
+            await self.app(scope, receive, send)
+            return
+
+        started_at = time.time()
+        started = time.perf_counter()
+        body = b""
+        body_complete = True
+        status = 0
+
+        async def capturing_receive() -> Message:
+            nonlocal body, body_complete
+            message = await receive()
+            if message["type"] == "http.request" and body_complete:
+                body += message.get("body", b"")
+                if len(body) > self.max_body_bytes:
+                    body, body_complete = b"", False
+            return message
+
+        async def capturing_send(message: Message) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, capturing_receive, capturing_send)
+        finally:
+            headers = Headers(scope=scope)
+            self.recorder.record(
+                {
+                    "time": started_at,
+                    "method": scope["method"],
+                    "path": scope["path"],
+                    "query": redact_query(scope["query_string"].decode("latin-1")),
+                    "headers": {
+                        name: headers[name]
+                        for name in CAPTURED_HEADERS
+                        if name in headers
+                    },
+                    "auth": "authorization" in headers,
+                    # None: too large or not parseable, replayed without a body
+                    "body": redact_body(body, headers.get("content-type", ""))
+                    if body_complete
+                    else None,
+                    "status": status,
+                    "duration_ms": (time.perf_counter() - started) * 1000,
+                }
+            )
@@ -0,0 +1,200 @@
+import re
+import uuid
+from typing import Any
+from typing import Callable
+from typing import Dict
+from typing import Iterable
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+from pydantic.errors import EmailError
+from pydantic.networks import validate_email
+from pydantic.validators import str_validator
+
+############################################
+# BLOCK FOR SINGLE-PASS PAYLOAD VALIDATION #
+############################################
+
+LETTER_MATCH_PATTERN = re.compile(r"^[а-яА-Яa-zA-Z\-]+$")
+
+# addresses the full validator accepts as is, anything else goes through it
+_SIMPLE_EMAIL = re.compile(
+    r"^[A-Za-z0-9!#$%&'*+/=?^_`{|}~-]+(?:\.[A-Za-z0-9!#$%&'*+/=?^_`{|}~-]+)*"
+    r"@(?:[A-Za-z0-9](?:[A-Za-z0-9-]{0,61}[A-Za-z0-9])?\.)+[A-Za-z]{2,63}$"
+)
+_MAX_EMAIL_LENGTH = 254
+_MAX_LOCAL_PART_LENGTH = 64
+# email-validator rejects these domains and their subdomains
+_SPECIAL_USE_DOMAINS = frozenset(
+    ("arpa", "invalid", "local", "localhost", "onion", "test")
+)
+
+
+class FieldError(ValueError):
+    def __init__(self, msg: str, error_type: str, ctx: Optional[dict] = None):
+        super().__init__(msg)
+        self.msg = msg
+        self.error_type = error_type
+        self.ctx = ctx
+
+    def to_dict(self, loc: List) -> dict:
+        error = {"loc": loc, "msg": self.msg, "type": self.error_type}
+        if self.ctx is not None:
+            error["ctx"] = self.ctx
+        return error
+
+
+def fast_validate_email(value: str) -> str:
+    """
+    Same result and error as pydantic's EmailStr: domain lowercased, local part
+    kept. Common addresses are checked by one regex, the rest by email-validator.
+    """
+    at = value.rfind("@")
+    if (
+        len(value) <= _MAX_EMAIL_LENGTH
+        and at <= _MAX_LOCAL_PART_LENGTH
+        and _SIMPLE_EMAIL.match(value)
+    ):
+        domain = value[at + 1 :].lower()
+        if domain[domain.rfind(".") + 1 :] not in _SPECIAL_USE_DOMAINS:
+            return value[: at + 1] + domain
+    return validate_email(value)[1]
+
+
+class FastEmailStr(str):
+    """EmailStr with the fast path of fast_validate_email"""
+
+    @classmethod
+    def __modify_schema__(cls, field_schema: Dict[str, Any]) -> None:
+        field_schema.update(type="string", format="email")
+
+    @classmethod
+    def __get_validators__(cls):
+        yield str_validator
+        yield fast_validate_email
+
+
+def _as_str(value: Any) -> str:
+    # pydantic's str fields take numbers too
+    if isinstance(value, str):
+        return value
+    if isinstance(value, (int, float)):
+        return str(value)
+    raise FieldError("str type expected", "type_error.str")
+
+
+def letters_rule(message: str, min_length: int = 0) -> Callable[[Any], str]:
+    def check(value: Any) -> str:
+        value = _as_str(value)
+        if len(value) < min_length:
+            raise FieldError(
+                f"ensure this value has at least {min_length} characters",
+                "value_error.any_str.min_length",
+                {"limit_value": min_length},
+            )
+        if not LETTER_MATCH_PATTERN.match(value):
+            raise FieldError(message, "value_error.letters")
+        return value
+
+    return check
+
+
+def email_rule(value: Any) -> str:
+    try:
+        return fast_validate_email(_as_str(value))
+    except EmailError:
+        raise FieldError("value is not a valid email address", "value_error.email")
+
+
+def uuid_rule(value: Any) -> uuid.UUID:
+    if isinstance(value, uuid.UUID):
+        return value
+    try:
+        return uuid.UUID(_as_str(value))
+    except (ValueError, FieldError):
+        raise FieldError("value is not a valid uuid", "type_error.uuid")
+
+
+class PayloadValidator:
+    """
+    Rules of one payload kind, compiled into a table looked up per field while
+    walking every item once. Errors of all items are collected in the format
+    of FastAPI's 422 responses. Unknown fields are dropped, None is kept for
+    optional fields.
+    """
+
+    def __init__(
+        self,
+        rules: Dict[str, Callable[[Any], Any]],
+        required: Iterable[str] = (),
+    ):
+        self.rules = rules
+        self.required = tuple(required)
+
+    def validate_item(
+        self, item: Any, loc: List, errors: List[dict]
+    ) -> Optional[Dict[str, Any]]:
+        """Cleaned fields of a valid item, None if its errors were added to `errors`"""
+        if not isinstance(item, dict):
+            errors.append(
+                {
+                    "loc": loc,
+                    "msg": "value is not a valid dict",
+                    "type": "type_error.dict",
+                }
+            )
+            return
+        errors_before = len(errors)
+        for field in self.required:
+            if field not in item:
+                errors.append(
+                    {
+                        "loc": [*loc, field],
+                        "msg": "field required",
+                        "type": "value_error.missing",
+                    }
+                )
+        cleaned = {}
+        for field, value in item.items():
+            rule = self.rules.get(field)
+            if rule is None:
+                continue
+            if value is None:
+                if field in self.required:
+                    errors.append(
+                        {
+                            "loc": [*loc, field],
+                            "msg": "none is not an allowed value",
+                            "type": "type_error.none.not_allowed",
+                        }
+                    )
+                cleaned[field] = None
+                continue
+            try:
+                cleaned[field] = rule(value)
+            except FieldError as err:
+                errors.append(err.to_dict([*loc, field]))
+        return cleaned if len(errors) == errors_before else None
+
+    def validate_items(
+        self, items: List[Any], loc: List = ()
+    ) -> Tuple[List[Optional[Dict[str, Any]]], List[dict]]:
+        """Cleaned items and errors of all of them, the items are valid without errors"""
+        errors: List[dict] = []
+        cleaned = [
+            self.validate_item(item, [*loc, index], errors)
+            for index, item in enumerate(items)
+        ]
+        return cleaned, errors
+
+
+bulk_user_update = PayloadValidator(
+    {
+        "user_id": uuid_rule,
+        "name": letters_rule("Name should contains only letters!", min_length=1),
+        "surname": letters_rule("Surname should contains only letters!", min_length=1),
+        "email": email_rule,
+    },
+    required=("user_id",),
+)
@@ -0,0 +1,45 @@
+"""
+Cost of checking an access token: every codec, with and without the verified-token cache.
+
+    python -m benchmarks.bench_jwt_decode --repeat 20000
+"""
+import argparse
+import timeit
+
+import settings
+from security import create_access_token
+from security import decode_access_token
+from security import JWT_CODECS
+from security import set_jwt_codec
+from security import verified_tokens
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--repeat", type=int, default=20_000)
+    args = parser.parse_args()
+
+    print(f"{'codec':<8} {'encode us':>10} {'decode us':>10} {'cached us':>10}")
+    for name, codec_class in JWT_CODECS.items():
+        codec = codec_class(settings.SECRET_KEY, settings.ALGORITHM)
+        set_jwt_codec(codec)
+        token = create_access_token(
+            data={"sub": "student@university.edu", "other_custom_data": [1, 2, 3, 4]}
+        )
+
+        def per_call(fn) -> float:
+            return timeit.timeit(fn, number=args.repeat) / args.repeat * 1e6
+
+        encode = per_call(
+            lambda: create_access_token(data={"sub": "student@university.edu"})
+        )
+        decode = per_call(lambda: codec.decode(token))
+        verified_tokens.clear()
+        cached = per_call(lambda: decode_access_token(token))
+        print(f"{name:<8} {encode:>10.1f} {decode:>10.1f} {cached:>10.1f}")
+
+    set_jwt_codec(None)
+
+
+if __name__ == "__main__":
+    main()
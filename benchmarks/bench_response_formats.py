@@ -0,0 +1,76 @@
+"""
+Payload size and encode CPU of user responses in every format we can send.
+
+    python -m benchmarks.bench_response_formats --users 1 20 100 1000
+"""
+import argparse
+import gzip
+import timeit
+import uuid
+from datetime import datetime
+from datetime import timezone
+
+import brotli
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+import settings
+from api.models import UserChange
+from api.models import UserChangesResponse
+from api.negotiation import MsgPackResponse
+
+
+def make_payload(users: int) -> dict:
+    response = UserChangesResponse(
+        changes=[
+            UserChange(
+                user_id=uuid.uuid4(),
+                name="Nikolai",
+                surname="Sviridov",
+                email=f"student{number}@university.edu",
+                is_active=number % 10 != 0,
+                change_seq=number,
+                updated_at=datetime.now(timezone.utc),
+            )
+            for number in range(users)
+        ],
+        next_cursor=users,
+    )
+    return jsonable_encoder(response)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--users", type=int, nargs="+", default=[1, 20, 100, 1000])
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    formats = {
+        "json": lambda content: JSONResponse(content).body,
+        "msgpack": lambda content: MsgPackResponse(content).body,
+    }
+    compressions = {
+        "": lambda body: body,
+        "+gzip": lambda body: gzip.compress(body, settings.COMPRESSION_GZIP_LEVEL),
+        "+br": lambda body: brotli.compress(
+            body, quality=settings.COMPRESSION_BROTLI_QUALITY
+        ),
+    }
+
+    print(f"{'users':>6} {'format':<14} {'bytes':>9} {'encode us':>10}")
+    for users in args.users:
+        content = make_payload(users)
+        for format_name, render in formats.items():
+            for compression_name, compress in compressions.items():
+
+                def encode():
+                    return compress(render(content))
+
+                size = len(encode())
+                seconds = timeit.timeit(encode, number=args.repeat) / args.repeat
+                name = format_name + compression_name
+                print(f"{users:>6} {name:<14} {size:>9} {seconds * 1e6:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""
+Benchmark of GET /user/search queries on a large users table.
+
+Seeds the table of the given database (use a dedicated one, the table is
+truncated) and times UserDAL.search_users for random partial names.
+
+    python -m benchmarks.bench_user_search --rows 2000000
+"""
+import argparse
+import asyncio
+import random
+import statistics
+import time
+
+import asyncpg
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.orm import sessionmaker
+
+import settings
+from db.dals import UserDAL
+from db.models import Base
+
+SYLLABLES = [
+    "ва", "ни", "ко", "ла", "ми", "ро", "се", "та", "ду", "ле",
+    "ka", "ri", "mo", "na", "se", "to", "vi", "la", "pe", "dr",
+]  # fmt: skip
+
+SEED_QUERY = """
+INSERT INTO users (user_id, name, surname, email, is_active, hashed_password)
+SELECT
+    gen_random_uuid(),
+    initcap(s[1 + i % 20] || s[1 + (i / 20) % 20] || s[1 + (i / 400) % 20]),
+    initcap(s[1 + (i / 7) % 20] || s[1 + (i / 13) % 20] || s[1 + (i / 31) % 20] || 'ов'),
+    'user' || i || '@example.com',
+    i % 10 <> 0,
+    'hashed_password'
+FROM generate_series($1::bigint, $2::bigint) AS i, (SELECT $3::text[] AS s) AS syllables
+"""
+
+
+async def seed(database_url: str, rows: int) -> None:
+    engine = create_async_engine(database_url)
+    async with engine.begin() as connection:
+        await connection.run_sync(Base.metadata.create_all)
+    await engine.dispose()
+
+    connection = await asyncpg.connect(database_url.replace("+asyncpg", ""))
+    try:
+        await connection.execute("TRUNCATE TABLE users;")
+        for start in range(0, rows, 100_000):
+            end = min(start + 100_000, rows) - 1
+            await connection.execute(SEED_QUERY, start, end, SYLLABLES)
+        await connection.execute("ANALYZE users;")
+    finally:
+        await connection.close()
+
+
+async def run(database_url: str, queries: int, limit: int) -> list:
+    engine = create_async_engine(database_url)
+    async_session = sessionmaker(engine, expire_on_commit=False, class_=AsyncSession)
+    timings = []
+    try:
+        for _ in range(queries):
+            text = "".join(random.sample(SYLLABLES, 2))
+            async with async_session() as session:
+                async with session.begin():
+                    started = time.perf_counter()
+                    await UserDAL(session).search_users(text=text, limit=limit)
+                    timings.append((time.perf_counter() - started) * 1000)
+    finally:
+        await engine.dispose()
+    return timings
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--database-url", default=settings.TEST_DATABASE_URL)
+    parser.add_argument("--rows", type=int, default=2_000_000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--limit", type=int, default=20)
+    parser.add_argument("--skip-seed", action="store_true")
+    parser.add_argument("--target-ms", type=float, default=10)
+    args = parser.parse_args()
+
+    if not args.skip_seed:
+        asyncio.run(seed(args.database_url, args.rows))
+    timings = sorted(asyncio.run(run(args.database_url, args.queries, args.limit)))
+
+    p50 = statistics.median(timings)
+    p95 = timings[int(len(timings) * 0.95) - 1]
+    p99 = timings[int(len(timings) * 0.99) - 1]
+    print(f"rows={args.rows} queries={args.queries} limit={args.limit}")
+    print(f"p50={p50:.2f}ms p95={p95:.2f}ms p99={p99:.2f}ms max={timings[-1]:.2f}ms")
+    if p95 > args.target_ms:
+        raise SystemExit(f"p95 is above the {args.target_ms}ms target")
+
+
+if __name__ == "__main__":
+    main()
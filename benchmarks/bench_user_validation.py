@@ -0,0 +1,93 @@
+"""
+Validation of PATCH /user/bulk payloads: one pass of api.validation against
+pydantic models with a validator per field and EmailStr, as bodies were checked before.
+
+    python -m benchmarks.bench_user_validation --items 1000 --repeat 20
+"""
+import argparse
+import timeit
+import uuid
+from typing import List
+from typing import Optional
+
+from fastapi import HTTPException
+from pydantic import BaseModel
+from pydantic import constr
+from pydantic import EmailStr
+from pydantic import validator
+
+from api.models import BulkUpdateBody
+from api.models import BulkUpdateRequest
+from api.validation import bulk_user_update
+from api.validation import LETTER_MATCH_PATTERN
+
+
+class PerFieldUser(BaseModel):
+    user_id: uuid.UUID
+    name: Optional[constr(min_length=1)]
+    surname: Optional[constr(min_length=1)]
+    email: Optional[EmailStr]
+
+    @validator("name")
+    def validator_name(cls, value):
+        if not LETTER_MATCH_PATTERN.match(value):
+            raise HTTPException(
+                status_code=422, detail="Name should contains only letters!"
+            )
+        return value
+
+    @validator("surname")
+    def validator_surname(cls, value):
+        if not LETTER_MATCH_PATTERN.match(value):
+            raise HTTPException(
+                status_code=422, detail="Surname should contains only letters!"
+            )
+        return value
+
+
+class PerFieldRequest(BaseModel):
+    users: List[PerFieldUser]
+
+
+def _payload(items: int) -> dict:
+    return {
+        "users": [
+            {
+                "user_id": str(uuid.uuid4()),
+                "name": "Student",
+                "surname": "Graduate",
+                "email": f"student{number}@University.edu",
+            }
+            for number in range(items)
+        ]
+    }
+
+
+def _bulk_update_request(payload: dict) -> BulkUpdateRequest:
+    """What PATCH /user/bulk does with a body"""
+    body = BulkUpdateBody.parse_obj(payload)
+    cleaned, _ = bulk_user_update.validate_items(body.users, loc=["body", "users"])
+    return BulkUpdateRequest.from_cleaned(cleaned)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--items", type=int, default=1000)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    payload = _payload(args.items)
+    candidates = {
+        "per-field models": lambda: PerFieldRequest.parse_obj(payload),
+        "BulkUpdateRequest": lambda: _bulk_update_request(payload),
+        "single pass only": lambda: bulk_user_update.validate_items(payload["users"]),
+    }
+
+    print(f"{'validation':<20} {'ms per body':>12} {'us per item':>12}")
+    for name, validate in candidates.items():
+        seconds = timeit.timeit(validate, number=args.repeat) / args.repeat
+        print(f"{name:<20} {seconds * 1000:>12.2f} {seconds / args.items * 1e6:>12.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,289 @@
+"""
+Plans of every statement UserDAL issues, on a seeded database, compared with snapshots.
+
+    python -m benchmarks.query_plans capture --users 100000
+    python -m benchmarks.query_plans check
+
+`capture` seeds the database (its users are replaced!), runs every UserDAL
+method in a rolled back transaction, runs EXPLAIN (ANALYZE, BUFFERS) for each
+statement and writes normalized plans and costs to the snapshot file.
+`check` does the same and fails when a table that was read through an index
+is scanned sequentially now, or when estimated cost grew past --cost-threshold.
+"""
+import argparse
+import asyncio
+import inspect
+import json
+import sys
+from dataclasses import dataclass
+from typing import Awaitable
+from typing import Callable
+from typing import Dict
+from typing import List
+from uuid import UUID
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncEngine
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.orm import sessionmaker
+
+import settings
+from db.dals import UserDAL
+from db.models import Base
+from db.query_stats import capture_statements
+from db.query_stats import install_query_hooks
+from db.query_stats import normalize_sql
+
+DEFAULT_SNAPSHOT_PATH = "benchmarks/query_plans.json"
+# runs in its own transaction mode, its plans are not worth a snapshot
+NOT_PLANNED = frozenset(("reconcile_user_stats",))
+INDEX_SCANS = ("Index Scan", "Index Only Scan", "Bitmap Heap Scan")
+
+
+@dataclass
+class Sample:
+    user_ids: List[UUID]
+    emails: List[str]
+    last_change_seq: int
+
+
+def scenarios(sample: Sample) -> Dict[str, Callable[[UserDAL], Awaitable]]:
+    """One call of every public UserDAL method, with seeded values"""
+    user_id, email = sample.user_ids[0], sample.emails[0]
+    return {
+        "create_user": lambda dal: dal.create_user(
+            name="Plan", surname="Probe", email="probe@plan.local", hashed_password="x"
+        ),
+        "create_users": lambda dal: dal.create_users(
+            [
+                dict(
+                    name="Plan",
+                    surname="Probe",
+                    email=f"probe{number}@plan.local",
+                    hashed_password="x",
+                )
+                for number in range(50)
+            ]
+        ),
+        "get_user_by_id": lambda dal: dal.get_user_by_id(user_id),
+        "get_user_by_email": lambda dal: dal.get_user_by_email(email),
+        "get_users_by_ids": lambda dal: dal.get_users_by_ids(sample.user_ids),
+        "get_users_by_emails": lambda dal: dal.get_users_by_emails(sample.emails),
+        # every seeded user is a Student<i>, a term from the seed matches the
+        # whole table; a rare name is what the trigram indexes are there for
+        "search_users": lambda dal: dal.search_users("sviridov", limit=20),
+        "get_user_changes": lambda dal: dal.get_user_changes(
+            since=sample.last_change_seq - 100, limit=100
+        ),
+        "get_user_stats": lambda dal: dal.get_user_stats(),
+        "update_user_by_id": lambda dal: dal.update_user_by_id(user_id, name="Plan"),
+        "delete_user_by_id": lambda dal: dal.delete_user_by_id(user_id),
+        "deactivate_users": lambda dal: dal.deactivate_users(sample.user_ids),
+        "update_users": lambda dal: dal.update_users(
+            {user_id: {"surname": "Plan"} for user_id in sample.user_ids}
+        ),
+        "replace_password_hash": lambda dal: dal.replace_password_hash(
+            user_id, "x", "y"
+        ),
+    }
+
+
+def unplanned_methods() -> List[str]:
+    """Public UserDAL methods without a scenario, they must get one"""
+    methods = {
+        name
+        for name, member in inspect.getmembers(UserDAL, inspect.iscoroutinefunction)
+        if not name.startswith("_")
+    }
+    planned = set(scenarios(Sample([None], [""], 0))) | NOT_PLANNED
+    return sorted(methods - planned)
+
+
+def create_plan_engine(database_url: str, **engine_options) -> AsyncEngine:
+    """Engine whose statements capture_statements() can see"""
+    engine = create_async_engine(database_url, future=True, **engine_options)
+    install_query_hooks(engine.sync_engine, slow_query_ms=float("inf"))
+    return engine
+
+
+async def seed(engine: AsyncEngine, users: int) -> None:
+    async with engine.begin() as connection:
+        await connection.run_sync(Base.metadata.create_all)
+        await connection.execute(text("TRUNCATE TABLE users, user_stats"))
+        await connection.execute(
+            text(
+                """
+                INSERT INTO users (user_id, name, surname, email, is_active, hashed_password)
+                SELECT gen_random_uuid(), 'Student' || i, 'Surname' || i,
+                       'student' || i || '@university.edu', i % 10 <> 0, 'x'
+                FROM generate_series(1, :users) AS i
+                """
+            ),
+            {"users": users},
+        )
+    async with engine.connect() as connection:
+        # fresh statistics, or the planner guesses the table size
+        await connection.execution_options(isolation_level="AUTOCOMMIT")
+        await connection.execute(text("ANALYZE users"))
+
+
+async def _sample(engine: AsyncEngine) -> Sample:
+    async with engine.connect() as connection:
+        rows = (
+            await connection.execute(
+                text("SELECT user_id, email FROM users ORDER BY change_seq LIMIT 50")
+            )
+        ).all()
+        last_change_seq = (
+            await connection.execute(text("SELECT max(change_seq) FROM users"))
+        ).scalar()
+    return Sample(
+        user_ids=[user_id for user_id, _ in rows],
+        emails=[email for _, email in rows],
+        last_change_seq=last_change_seq or 0,
+    )
+
+
+def _plan_lines(plan: dict, depth: int = 0) -> List[str]:
+    line = plan["Node Type"]
+    if "Index Name" in plan:
+        line += f" using {plan['Index Name']}"
+    if "Relation Name" in plan:
+        line += f" on {plan['Relation Name']}"
+    lines = ["  " * depth + line]
+    for child in plan.get("Plans", []):
+        lines += _plan_lines(child, depth + 1)
+    return lines
+
+
+def _table_access(plan: dict, access: Dict[str, str] = None) -> Dict[str, str]:
+    """Table -> index or seq; seq wins when a table is read both ways"""
+    access = {} if access is None else access
+    relation = plan.get("Relation Name")
+    if relation is not None and plan["Node Type"] in INDEX_SCANS:
+        access.setdefault(relation, "index")
+    elif relation is not None and plan["Node Type"] == "Seq Scan":
+        access[relation] = "seq"
+    for child in plan.get("Plans", []):
+        _table_access(child, access)
+    return access
+
+
+async def _explain(engine: AsyncEngine, statement: str, parameters) -> dict:
+    async with engine.connect() as connection:
+        transaction = await connection.begin()
+        try:
+            # a list of one parameter set, or an array parameter reads as many sets
+            result = await connection.exec_driver_sql(
+                "EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) " + statement, [parameters]
+            )
+            explained = result.scalar()
+        finally:
+            # ANALYZE runs the statement, its writes must not stay
+            await transaction.rollback()
+    if isinstance(explained, str):
+        explained = json.loads(explained)
+    plan = explained[0]["Plan"]
+    return {
+        "sql": normalize_sql(statement),
+        "plan": _plan_lines(plan),
+        "access": _table_access(plan),
+        "total_cost": plan["Total Cost"],
+        "actual_ms": plan["Actual Total Time"],
+        "shared_hit_blocks": plan.get("Shared Hit Blocks", 0),
+        "shared_read_blocks": plan.get("Shared Read Blocks", 0),
+    }
+
+
+async def collect_plans(engine: AsyncEngine) -> Dict[str, dict]:
+    """
+    '<method>#<statement number>' -> normalized plan of every UserDAL statement.
+    The engine must come from create_plan_engine.
+    """
+    session_factory = sessionmaker(engine, expire_on_commit=False, class_=AsyncSession)
+    sample = await _sample(engine)
+
+    plans = {}
+    for name, call in scenarios(sample).items():
+        async with session_factory() as session:
+            await session.begin()
+            try:
+                with capture_statements() as statements:
+                    await call(UserDAL(session))
+            finally:
+                await session.rollback()
+        for number, (statement, parameters) in enumerate(statements, start=1):
+            plans[f"{name}#{number}"] = await _explain(engine, statement, parameters)
+    return plans
+
+
+def compare_plans(
+    snapshot: Dict[str, dict], current: Dict[str, dict], cost_threshold: float
+) -> List[str]:
+    """Regressions of `current` against `snapshot`, empty when there are none"""
+    problems = []
+    for key, plan in current.items():
+        expected = snapshot.get(key)
+        if expected is None:
+            problems.append(f"{key}: no snapshot, run capture")
+            continue
+        for table, access in expected["access"].items():
+            if access == "index" and plan["access"].get(table) == "seq":
+                problems.append(f"{key}: {table} is scanned sequentially, not by index")
+        if plan["total_cost"] > expected["total_cost"] * (1 + cost_threshold):
+            problems.append(
+                f"{key}: estimated cost {plan['total_cost']:.1f}"
+                f" > {expected['total_cost']:.1f} by more than {cost_threshold:.0%}"
+            )
+    for key in snapshot.keys() - current.keys():
+        problems.append(f"{key}: statement is gone, run capture")
+    return problems
+
+
+async def main() -> int:
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("command", choices=("capture", "check"))
+    parser.add_argument("--database-url", default=settings.TEST_DATABASE_URL)
+    parser.add_argument("--snapshot", default=DEFAULT_SNAPSHOT_PATH)
+    parser.add_argument(
+        "--users", type=int, default=None, help="default: as in the snapshot or 100000"
+    )
+    parser.add_argument("--cost-threshold", type=float, default=0.5)
+    args = parser.parse_args()
+
+    missing = unplanned_methods()
+    if missing:
+        print(f"UserDAL methods without a scenario: {', '.join(missing)}")
+        return 1
+
+    snapshot = {}
+    if args.command == "check":
+        with open(args.snapshot) as snapshot_file:
+            snapshot = json.load(snapshot_file)
+    users = args.users or snapshot.get("users", 100_000)
+
+    engine = create_plan_engine(args.database_url)
+    try:
+        await seed(engine, users)
+        plans = await collect_plans(engine)
+    finally:
+        await engine.dispose()
+
+    if args.command == "capture":
+        with open(args.snapshot, "w") as snapshot_file:
+            json.dump({"users": users, "plans": plans}, snapshot_file, indent=2)
+        print(f"{len(plans)} plans written to {args.snapshot}")
+        return 0
+
+    problems = compare_plans(snapshot["plans"], plans, args.cost_threshold)
+    for problem in problems:
+        print(problem)
+    print(f"{len(plans)} plans checked, {len(problems)} regressions")
+    return 1 if problems else 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
@@ -0,0 +1,133 @@
+"""
+Replays traffic captured by TRAFFIC_CAPTURE_PATH against a running instance,
+keeping the original arrival times (so the concurrency too), and reports
+latency percentiles per route.
+
+    python -m benchmarks.replay_traffic capture.msgpack --target http://staging:8000 --speed 2
+
+Secrets were redacted on capture: --password is sent instead of redacted
+passwords and --token as the bearer token of requests that had one.
+"""
+import argparse
+import asyncio
+import json
+import time
+from collections import defaultdict
+from typing import Dict
+from typing import List
+from typing import Optional
+from urllib.parse import parse_qsl
+from urllib.parse import urlencode
+
+import httpx
+
+from api.traffic_capture import read_traffic
+from api.traffic_capture import REDACTED
+
+
+def _restore_secrets(entry: dict, password: str) -> Optional[bytes]:
+    body = entry["body"]
+    if not body:
+        return body
+    content_type = entry["headers"].get("content-type", "")
+    if content_type.startswith("application/x-www-form-urlencoded"):
+        fields = [
+            (key, password if key == "password" and value == REDACTED else value)
+            for key, value in parse_qsl(body.decode(), keep_blank_values=True)
+        ]
+        return urlencode(fields).encode()
+    fields = json.loads(body)
+    if not isinstance(fields, dict) or fields.get("password") != REDACTED:
+        return body
+    fields["password"] = password
+    return json.dumps(fields).encode()
+
+
+def percentile(sorted_values: List[float], fraction: float) -> float:
+    index = min(int(len(sorted_values) * fraction), len(sorted_values) - 1)
+    return sorted_values[index]
+
+
+async def replay(
+    entries: List[dict],
+    client: httpx.AsyncClient,
+    speed: float = 1.0,
+    password: str = "password",
+    token: Optional[str] = None,
+) -> Dict[str, dict]:
+    """Per route: replayed latencies, the captured ones and the error count"""
+    results: Dict[str, dict] = defaultdict(
+        lambda: {"latencies": [], "captured": [], "errors": 0}
+    )
+    if not entries:
+        return results
+
+    first_at = entries[0]["time"]
+    replay_started = time.perf_counter()
+
+    async def send(entry: dict) -> None:
+        delay = (entry["time"] - first_at) / speed
+        await asyncio.sleep(max(replay_started + delay - time.perf_counter(), 0))
+
+        headers = dict(entry["headers"])
+        if entry["auth"] and token is not None:
+            headers["authorization"] = f"Bearer {token}"
+        route = results[f"{entry['method']} {entry['path']}"]
+        started = time.perf_counter()
+        try:
+            response = await client.request(
+                entry["method"],
+                entry["path"] + (f"?{entry['query']}" if entry["query"] else ""),
+                content=_restore_secrets(entry, password),
+                headers=headers,
+            )
+            if response.status_code >= 500:
+                route["errors"] += 1
+        except httpx.HTTPError:
+            route["errors"] += 1
+        route["latencies"].append((time.perf_counter() - started) * 1000)
+        route["captured"].append(entry["duration_ms"])
+
+    await asyncio.gather(*(send(entry) for entry in entries))
+    return results
+
+
+def print_report(results: Dict[str, dict]) -> None:
+    print(
+        f"{'route':<28} {'count':>6} {'errors':>6} {'p50 ms':>8} {'p90 ms':>8}"
+        f" {'p99 ms':>8} {'max ms':>8} {'captured p50':>13}"
+    )
+    for route, result in sorted(results.items()):
+        latencies = sorted(result["latencies"])
+        captured = sorted(result["captured"])
+        print(
+            f"{route:<28} {len(latencies):>6} {result['errors']:>6}"
+            f" {percentile(latencies, 0.5):>8.1f} {percentile(latencies, 0.9):>8.1f}"
+            f" {percentile(latencies, 0.99):>8.1f} {latencies[-1]:>8.1f}"
+            f" {percentile(captured, 0.5):>13.1f}"
+        )
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("capture", help="file written by TrafficCaptureMiddleware")
+    parser.add_argument("--target", default="http://127.0.0.1:8000")
+    parser.add_argument(
+        "--speed", type=float, default=1.0, help="2 - twice as fast as captured"
+    )
+    parser.add_argument("--password", default="password")
+    parser.add_argument("--token", default=None)
+    parser.add_argument("--timeout", type=float, default=30)
+    args = parser.parse_args()
+
+    entries = sorted(read_traffic(args.capture), key=lambda entry: entry["time"])
+    limits = httpx.Limits(max_connections=None, max_keepalive_connections=100)
+    async with httpx.AsyncClient(
+        base_url=args.target, timeout=args.timeout, limits=limits
+    ) as client:
+        results = await replay(entries, client, args.speed, args.password, args.token)
+    print_report(results)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
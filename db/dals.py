@@ -1,18 +1,63 @@
+import random
+from typing import Dict
+from typing import List
 from typing import Optional
+from typing import Tuple
 from uuid import UUID
 
 from sqlalchemy import and_
+from sqlalchemy import any_
+from sqlalchemy import bindparam
+from sqlalchemy import cast
+from sqlalchemy import func
+from sqlalchemy import literal_column
+from sqlalchemy import or_
 from sqlalchemy import select
+from sqlalchemy import text
 from sqlalchemy import update
+from sqlalchemy.dialects.postgresql import ARRAY
+from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.ext.asyncio import AsyncSession
 
+import settings
 from .models import User
+from .models import UserStats
+from .notifications import get_notification_bus
 
 ###########################################################
 # BLOCK FOR INTERACTION WITH DATABASE IN BUSINESS CONTEXT #
 ###########################################################
 
 
+# counter slot and advisory lock used only by the reconciliation of user stats
+STATS_RECONCILE_SLOT = -1
+STATS_RECONCILE_LOCK_ID = 7301
+# age of the oldest running transaction that has written users, NULL without
+# one; a writer between its first statement and its xid counts with its snapshot
+USERS_WRITERS_HORIZON_AGE = literal_column(
+    """(
+    SELECT max(age(coalesce(activity.backend_xid, activity.backend_xmin)))
+    FROM pg_locks AS locks JOIN pg_stat_activity AS activity USING (pid)
+    WHERE locks.locktype = 'relation'
+        AND locks.database = (
+            SELECT oid FROM pg_database WHERE datname = current_database()
+        )
+        AND locks.relation = 'users'::regclass
+        AND locks.mode = 'RowExclusiveLock'
+    )"""
+)
+# columns UserDAL.update_users can set
+BULK_UPDATE_FIELDS = ("name", "surname", "email")
+
+
+def _change_marks() -> dict:
+    """Values that move an updated row to the end of the change feed"""
+    return dict(
+        updated_at=func.now(),
+        change_seq=func.nextval(func.pg_get_serial_sequence("users", "change_seq")),
+    )
+
+
 class UserDAL:
     """Data Access Layer for operating user info"""
 
@@ -20,17 +65,50 @@ class UserDAL:
         self.db_session = db_session
 
     async def create_user(
-        self, name: str, surname: str, email: str, hashed_password: str
+        self,
+        name: str,
+        surname: str,
+        email: str,
+        hashed_password: str,
+        user_id: Optional[UUID] = None,
     ) -> User:
         new_user = User(
             name=name, surname=surname, email=email, hashed_password=hashed_password
         )
+        if user_id is not None:
+            # sharded storage picks the id first, it decides the shard
+            new_user.user_id = user_id
         self.db_session.add(new_user)
         await self.db_session.flush()
+        await self._bump_stats(total=1, active=1)
         return new_user
 
-    async def get_user_by_id(self, user_id: UUID) -> Optional[User]:
+    async def create_users(self, rows: List[dict]) -> Dict[UUID, bool]:
+        """
+        Inserts all rows with one statement. Rows with a taken email are skipped,
+        returns is_active of the inserted rows by user_id.
+        """
+        query = (
+            insert(User)
+            .values(rows)
+            .on_conflict_do_nothing(index_elements=[User.email])
+            .returning(User.user_id, User.is_active)
+        )
+        result = await self.db_session.execute(query)
+        created = {user_id: is_active for user_id, is_active in result}
+        if created:
+            await self._bump_stats(
+                total=len(created), active=sum(map(bool, created.values()))
+            )
+        return created
+
+    async def get_user_by_id(
+        self, user_id: UUID, for_update: bool = False
+    ) -> Optional[User]:
+        """`for_update` locks the row until the end of the transaction"""
         query = select(User).where(User.user_id == user_id)
+        if for_update:
+            query = query.with_for_update()
         result = await self.db_session.execute(query)
         user_row = result.fetchone()
         if user_row is not None:
@@ -43,28 +121,250 @@ class UserDAL:
         if user_row is not None:
             return user_row[0]
 
+    async def get_users_by_ids(self, user_ids: List[UUID]) -> List[User]:
+        # one array parameter keeps a single prepared statement for any batch size
+        query = select(User).where(
+            User.user_id
+            == any_(bindparam("user_ids", user_ids, ARRAY(User.user_id.type)))
+        )
+        result = await self.db_session.execute(query)
+        return list(result.scalars())
+
+    async def get_users_by_emails(self, emails: List[str]) -> List[User]:
+        query = select(User).where(
+            User.email == any_(bindparam("emails", emails, ARRAY(User.email.type)))
+        )
+        result = await self.db_session.execute(query)
+        return list(result.scalars())
+
+    async def search_users(
+        self, text: str, limit: int, after: Optional[Tuple[float, UUID]] = None
+    ) -> List[Tuple[User, float]]:
+        """
+        Users whose name, surname or email contain words similar to `text`,
+        best matches first. `after` is the (rank, user_id) of the last row
+        of the previous page.
+        """
+        rank = func.greatest(
+            func.word_similarity(text, User.name),
+            func.word_similarity(text, User.surname),
+            func.word_similarity(text, User.email),
+        )
+        # `column %> text` is the form the trigram GIN indexes can serve
+        query = select(User, rank).where(
+            or_(
+                User.name.op("%>")(text),
+                User.surname.op("%>")(text),
+                User.email.op("%>")(text),
+            )
+        )
+        if after is not None:
+            after_rank, after_user_id = after
+            query = query.where(
+                or_(
+                    rank < after_rank,
+                    and_(rank == after_rank, User.user_id > after_user_id),
+                )
+            )
+
+        query = query.order_by(rank.desc(), User.user_id).limit(limit)
+        result = await self.db_session.execute(query)
+        return [(user, user_rank) for user, user_rank in result]
+
     async def delete_user_by_id(self, user_id: UUID) -> Optional[UUID]:
         query = (
             update(User)
             .where(and_(User.user_id == user_id, User.is_active == True))
-            .values(is_active=False)
+            .values(is_active=False, **_change_marks())
             .returning(User.user_id)
         )
 
         result = await self.db_session.execute(query)
         deleted_user_id_row = result.fetchone()
         if deleted_user_id_row is not None:
+            await self._bump_stats(active=-1)
+            await self._notify_changed(user_id)
             return deleted_user_id_row[0]
 
+    async def get_user_changes(self, since: int, limit: int) -> Tuple[List[User], bool]:
+        """
+        Users changed after the `since` sequence number, in sequence order, and
+        whether the page was stalled. The page ends before the first row written
+        by a transaction that is not older than every running writer of users:
+        such a writer may still commit a lower change_seq, and the cursor must
+        not move past it. Transactions that don't write users never hold it up.
+        """
+        settled = func.age(literal_column("users.xmin")) > func.coalesce(
+            USERS_WRITERS_HORIZON_AGE, 0
+        )
+        query = (
+            select(User, settled)
+            .where(User.change_seq > since)
+            .order_by(User.change_seq)
+            .limit(limit)
+        )
+        result = await self.db_session.execute(query)
+        users = []
+        for user, user_settled in result:
+            if not user_settled:
+                return users, True
+            users.append(user)
+        return users, False
+
+    async def get_user_stats(self) -> Tuple[int, int]:
+        """Total and active users, summed over the counter slots"""
+        query = select(
+            func.coalesce(func.sum(UserStats.total), 0),
+            func.coalesce(func.sum(UserStats.active), 0),
+        )
+        result = await self.db_session.execute(query)
+        total, active = result.one()
+        return int(total), int(active)
+
+    async def reconcile_user_stats(self) -> Optional[Tuple[int, int]]:
+        """
+        Corrects drift of the counters from the users table, returns the applied
+        (total, active) correction or None if another worker is reconciling.
+        Must be the first thing done in its transaction.
+        """
+        # counts and counters come from one snapshot, so their difference is
+        # exactly the drift even while users are being written
+        await self.db_session.execute(
+            text("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ")
+        )
+        locked = await self.db_session.execute(
+            select(func.pg_try_advisory_xact_lock(STATS_RECONCILE_LOCK_ID))
+        )
+        if not locked.scalar():
+            return
+
+        actual = await self.db_session.execute(
+            select(func.count(), func.count().filter(User.is_active == True))
+        )
+        actual_total, actual_active = actual.one()
+        total, active = await self.get_user_stats()
+
+        drift = (actual_total - total, actual_active - active)
+        if drift != (0, 0):
+            # writers never touch this slot, so the update can't conflict with them
+            await self._bump_stats(*drift, slot=STATS_RECONCILE_SLOT)
+        return drift
+
+    async def _bump_stats(
+        self, total: int = 0, active: int = 0, slot: Optional[int] = None
+    ) -> None:
+        if slot is None:
+            slot = random.randrange(settings.USER_STATS_SLOTS)
+        query = (
+            insert(UserStats)
+            .values(slot=slot, total=total, active=active)
+            .on_conflict_do_update(
+                index_elements=[UserStats.slot],
+                set_={
+                    "total": UserStats.total + total,
+                    "active": UserStats.active + active,
+                },
+            )
+        )
+        await self.db_session.execute(query)
+
+    async def deactivate_users(self, user_ids: List[UUID]) -> List[UUID]:
+        """Deactivates the active users of `user_ids` with one statement, returns their ids"""
+        query = (
+            update(User)
+            .where(
+                User.user_id
+                == any_(bindparam("user_ids", user_ids, ARRAY(User.user_id.type))),
+                User.is_active == True,
+            )
+            .values(is_active=False, **_change_marks())
+            .returning(User.user_id)
+            .execution_options(synchronize_session=False)
+        )
+        result = await self.db_session.execute(query)
+        deactivated_user_ids = list(result.scalars())
+        if deactivated_user_ids:
+            await self._bump_stats(active=-len(deactivated_user_ids))
+            await self._notify_changed_many(deactivated_user_ids)
+        return deactivated_user_ids
+
+    async def update_users(self, changes: Dict[UUID, dict]) -> List[UUID]:
+        """
+        Applies the changes of every user with one statement, returns ids of the
+        updated active users. Changes may set name, surname and email, fields
+        absent from a user's changes keep their values.
+        """
+        user_ids = list(changes)
+        # one array parameter per column keeps a single prepared statement;
+        # casts pick the unnest signature
+        patch = (
+            func.unnest(
+                cast(bindparam("user_ids", user_ids), ARRAY(User.user_id.type)),
+                *(
+                    cast(
+                        bindparam(
+                            f"{field}_values",
+                            [changes[user_id].get(field) for user_id in user_ids],
+                        ),
+                        ARRAY(User.__table__.c[field].type),
+                    )
+                    for field in BULK_UPDATE_FIELDS
+                ),
+            )
+            .table_valued("user_id", *BULK_UPDATE_FIELDS)
+            .render_derived()
+        )
+        query = (
+            update(User)
+            .where(User.user_id == patch.c.user_id, User.is_active == True)
+            .values(
+                **{
+                    field: func.coalesce(patch.c[field], User.__table__.c[field])
+                    for field in BULK_UPDATE_FIELDS
+                },
+                **_change_marks(),
+            )
+            .returning(User.user_id)
+            .execution_options(synchronize_session=False)
+        )
+        result = await self.db_session.execute(query)
+        updated_user_ids = list(result.scalars())
+        if updated_user_ids:
+            await self._notify_changed_many(updated_user_ids)
+        return updated_user_ids
+
     async def update_user_by_id(self, user_id: UUID, **kwargs) -> Optional[UUID]:
         query = (
             update(User)
             .where(User.user_id == user_id, User.is_active == True)
-            .values(kwargs)
+            .values(**kwargs, **_change_marks())
             .returning(User.user_id)
         )
 
         result = await self.db_session.execute(query)
         updated_user_id_row = result.fetchone()
         if updated_user_id_row is not None:
+            await self._notify_changed(user_id)
             return updated_user_id_row[0]
+
+    async def replace_password_hash(
+        self, user_id: UUID, old_hash: str, new_hash: str
+    ) -> bool:
+        """Saves a rehashed password unless the password was changed meanwhile"""
+        query = (
+            update(User)
+            .where(User.user_id == user_id, User.hashed_password == old_hash)
+            .values(hashed_password=new_hash)
+            .returning(User.user_id)
+        )
+        result = await self.db_session.execute(query)
+        return result.fetchone() is not None
+
+    async def _notify_changed(self, user_id: UUID) -> None:
+        """Makes every worker drop its cached copies of the user after commit"""
+        if settings.USER_NOTIFICATIONS_ENABLED:
+            await get_notification_bus().publish(self.db_session, user_id)
+
+    async def _notify_changed_many(self, user_ids: List[UUID]) -> None:
+        if settings.USER_NOTIFICATIONS_ENABLED:
+            await get_notification_bus().publish_many(self.db_session, user_ids)
@@ -0,0 +1,224 @@
+import asyncio
+import contextvars
+import json
+import time
+from contextvars import ContextVar
+from logging import getLogger
+from typing import Any
+from typing import Awaitable
+from typing import Coroutine
+from typing import Optional
+
+from sqlalchemy import event
+from sqlalchemy.exc import DBAPIError
+from starlette.datastructures import Headers
+from starlette.types import ASGIApp
+from starlette.types import Message
+from starlette.types import Receive
+from starlette.types import Scope
+from starlette.types import Send
+
+import settings
+
+logger = getLogger(__name__)
+
+######################################
+# BLOCK FOR REQUEST DEADLINES IN SQL #
+######################################
+
+REQUEST_TIMEOUT_HEADER = "x-request-timeout-ms"
+# query_canceled, raised by statement_timeout
+QUERY_CANCELED_SQLSTATE = "57014"
+
+# time.monotonic() by which the current request must be answered
+current_deadline: ContextVar[Optional[float]] = ContextVar(
+    "current_deadline", default=None
+)
+
+
+class DeadlineExceeded(Exception):
+    pass
+
+
+def remaining_ms() -> Optional[int]:
+    """Milliseconds left until the deadline, None without one"""
+    deadline = current_deadline.get()
+    if deadline is None:
+        return
+    return int((deadline - time.monotonic()) * 1000)
+
+
+def create_shared_task(coro: Coroutine) -> asyncio.Task:
+    """
+    Task for work shared by several requests: it runs without the deadline
+    of the request that happened to start it, the waiters keep their own.
+    """
+    context = contextvars.copy_context()
+    context.run(current_deadline.set, None)
+    task = context.run(asyncio.ensure_future, coro)
+    # every waiter may have given up already, don't log the error as lost
+    task.add_done_callback(lambda done: done.cancelled() or done.exception())
+    return task
+
+
+async def wait_shared(shared: Awaitable) -> Any:
+    """Result of shared work, DeadlineExceeded if the current deadline comes first"""
+    timeout_ms = remaining_ms()
+    if timeout_ms is None:
+        return await asyncio.shield(shared)
+    if timeout_ms <= 0:
+        raise DeadlineExceeded()
+    try:
+        # the work goes on for the other waiters
+        return await asyncio.wait_for(asyncio.shield(shared), timeout_ms / 1000)
+    except asyncio.TimeoutError:
+        raise DeadlineExceeded()
+
+
+def install_deadline_hooks(session_class) -> None:
+    """Every transaction of a request gets the time left as statement_timeout"""
+
+    @event.listens_for(session_class, "after_begin")
+    def set_statement_timeout(session, transaction, connection):
+        timeout_ms = remaining_ms()
+        if timeout_ms is None:
+            return
+        if timeout_ms <= 0:
+            raise DeadlineExceeded()
+        # SET does not take bind parameters, the value is an int we computed
+        connection.exec_driver_sql(f"SET LOCAL statement_timeout = {timeout_ms}")
+
+
+def request_budget_ms(scope: Scope) -> int:
+    """
+    Budget of the route from REQUEST_TIMEOUT_MS_BY_ROUTE or REQUEST_TIMEOUT_MS,
+    the client may only make it shorter with the X-Request-Timeout-Ms header.
+    """
+    budget = settings.REQUEST_TIMEOUT_MS_BY_ROUTE.get(
+        f"{scope['method']} {scope['path']}", settings.REQUEST_TIMEOUT_MS
+    )
+    client_budget = Headers(scope=scope).get(REQUEST_TIMEOUT_HEADER)
+    if client_budget is not None:
+        try:
+            client_budget = int(client_budget)
+        except ValueError:
+            client_budget = 0
+        if client_budget > 0:
+            budget = min(budget, client_budget) if budget > 0 else client_budget
+    return budget
+
+
+def _is_deadline_error(exc: BaseException) -> bool:
+    if isinstance(exc, DeadlineExceeded):
+        return True
+    return (
+        isinstance(exc, DBAPIError)
+        and getattr(exc.orig, "sqlstate", None) == QUERY_CANCELED_SQLSTATE
+    )
+
+
+class DeadlineMiddleware:
+    """
+    Runs every request with its budget: past the deadline it is cancelled and
+    answered with 504, when the client disconnects it is cancelled silently.
+    Cancelling the request cancels its query, so the connection goes back to the pool.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        budget_ms = request_budget_ms(scope)
+        timeout = budget_ms / 1000 if budget_ms > 0 else None
+        token = current_deadline.set(
+            time.monotonic() + timeout if timeout is not None else None
+        )
+        response_started = False
+
+        async def tracking_send(message: Message) -> None:
+            nonlocal response_started
+            if message["type"] == "http.response.start":
+                response_started = True
+            await send(message)
+
+        # the request reads its messages from the queue, we watch for disconnect
+        messages: asyncio.Queue = asyncio.Queue()
+
+        async def read_messages() -> None:
+            while True:
+                message = await receive()
+                messages.put_nowait(message)
+                if message["type"] == "http.disconnect":
+                    return
+
+        request = asyncio.create_task(self.app(scope, messages.get, tracking_send))
+        reader = asyncio.create_task(read_messages())
+        current_deadline.reset(token)
+        try:
+            done, _ = await asyncio.wait(
+                {request, reader},
+                timeout=timeout,
+                return_when=asyncio.FIRST_COMPLETED,
+            )
+            if request not in done and reader in done:
+                logger.info(
+                    "Client disconnected, cancelling %s %s",
+                    scope["method"],
+                    scope["path"],
+                )
+                await _cancel(request)
+                return
+            if request not in done:
+                if response_started:
+                    # too late for 504, let the response finish
+                    await request
+                    return
+                logger.warning(
+                    "Deadline of %d ms exceeded: %s %s",
+                    budget_ms,
+                    scope["method"],
+                    scope["path"],
+                )
+                await _cancel(request)
+                await _send_timeout(send)
+                return
+
+            try:
+                request.result()
+            except Exception as exc:
+                if response_started or not _is_deadline_error(exc):
+                    raise
+                await _send_timeout(send)
+        finally:
+            reader.cancel()
+            if not request.done():
+                await _cancel(request)
+
+
+async def _cancel(task: asyncio.Task) -> None:
+    task.cancel()
+    try:
+        await task
+    except asyncio.CancelledError:
+        pass
+    except Exception:
+        logger.warning("Cancelled request failed", exc_info=True)
+
+
+async def _send_timeout(send: Send) -> None:
+    body = json.dumps({"detail": "Request deadline exceeded"}).encode()
+    await send(
+        {
+            "type": "http.response.start",
+            "status": 504,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+            ],
+        }
+    )
+    await send({"type": "http.response.body", "body": body})
@@ -0,0 +1,33 @@
+import asyncio
+from logging import getLogger
+
+from sqlalchemy.orm import sessionmaker
+
+from .dals import UserDAL
+
+logger = getLogger(__name__)
+
+###############################
+# BLOCK WITH PERIODIC DB JOBS #
+###############################
+
+
+async def reconcile_user_stats(session_factory: sessionmaker) -> None:
+    async with session_factory() as session:
+        async with session.begin():
+            drift = await UserDAL(session).reconcile_user_stats()
+
+    if drift is not None and drift != (0, 0):
+        logger.warning("User stats drifted by (total, active) = %s, corrected", drift)
+
+
+async def run_user_stats_reconciliation(
+    session_factory: sessionmaker, interval_seconds: float
+) -> None:
+    """Reconciles the counters right away and then every `interval_seconds`"""
+    while True:
+        try:
+            await reconcile_user_stats(session_factory)
+        except Exception as err:
+            logger.error(err)
+        await asyncio.sleep(interval_seconds)
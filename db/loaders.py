@@ -0,0 +1,124 @@
+import asyncio
+from typing import Any
+from typing import Awaitable
+from typing import Callable
+from typing import Dict
+from typing import Hashable
+from typing import List
+from typing import Optional
+from typing import Set
+from uuid import UUID
+
+from sqlalchemy.orm import sessionmaker
+
+import settings
+from .dals import UserDAL
+from .deadlines import create_shared_task
+from .deadlines import wait_shared
+from .models import User
+from .session import async_session
+
+##########################################################
+# BLOCK FOR BATCHING OF LOOKUPS FROM CONCURRENT REQUESTS #
+##########################################################
+
+
+class BatchLoader:
+    """
+    Collects the keys requested within a short window and loads all of them
+    with one call of `batch_fn`, which returns a dict of the found values.
+    A window of 0 means "until the current event loop tick ends".
+    """
+
+    def __init__(
+        self,
+        batch_fn: Callable[[List[Hashable]], Awaitable[Dict[Hashable, Any]]],
+        max_batch_size: int = 500,
+        max_delay_us: int = 0,
+    ):
+        self._batch_fn = batch_fn
+        self._max_batch_size = max_batch_size
+        self._max_delay_us = max_delay_us
+        self._pending: Dict[Hashable, asyncio.Future] = {}
+        self._dispatch_handle: Optional[asyncio.Handle] = None
+        self._running: Set[asyncio.Task] = set()
+
+    async def load(self, key: Hashable) -> Optional[Any]:
+        future = self._pending.get(key)
+        if future is None:
+            future = asyncio.get_running_loop().create_future()
+            self._pending[key] = future
+            if len(self._pending) >= self._max_batch_size:
+                self._dispatch()
+            elif self._dispatch_handle is None:
+                self._schedule_dispatch()
+
+        # one waiter giving up must not cancel the key for the others
+        return await wait_shared(future)
+
+    def _schedule_dispatch(self) -> None:
+        loop = asyncio.get_running_loop()
+        if self._max_delay_us > 0:
+            self._dispatch_handle = loop.call_later(
+                self._max_delay_us / 1_000_000, self._dispatch
+            )
+        else:
+            self._dispatch_handle = loop.call_soon(self._dispatch)
+
+    def _dispatch(self) -> None:
+        if self._dispatch_handle is not None:
+            self._dispatch_handle.cancel()
+            self._dispatch_handle = None
+
+        batch, self._pending = self._pending, {}
+        if batch:
+            task = create_shared_task(self._run_batch(batch))
+            self._running.add(task)
+            task.add_done_callback(self._running.discard)
+
+    async def _run_batch(self, batch: Dict[Hashable, asyncio.Future]) -> None:
+        try:
+            found = await self._batch_fn(list(batch))
+        except Exception as err:
+            for future in batch.values():
+                if not future.done():
+                    future.set_exception(err)
+                    future.exception()  # waiters may be gone already
+            return
+
+        for key, future in batch.items():
+            if not future.done():
+                future.set_result(found.get(key))
+
+
+class UserLoader:
+    """Batches lookups of single users by id and by email into ANY(...) queries"""
+
+    def __init__(
+        self,
+        session_factory: sessionmaker,
+        max_batch_size: int = 500,
+        max_delay_us: int = 0,
+    ):
+        self._session_factory = session_factory
+        self.by_id = BatchLoader(self._load_by_ids, max_batch_size, max_delay_us)
+        self.by_email = BatchLoader(self._load_by_emails, max_batch_size, max_delay_us)
+
+    async def _load_by_ids(self, user_ids: List[UUID]) -> Dict[UUID, User]:
+        async with self._session_factory() as session:
+            async with session.begin():
+                users = await UserDAL(session).get_users_by_ids(user_ids)
+        return {user.user_id: user for user in users}
+
+    async def _load_by_emails(self, emails: List[str]) -> Dict[str, User]:
+        async with self._session_factory() as session:
+            async with session.begin():
+                users = await UserDAL(session).get_users_by_emails(emails)
+        return {user.email: user for user in users}
+
+
+user_loader = UserLoader(
+    async_session,
+    max_batch_size=settings.USER_LOADER_MAX_BATCH_SIZE,
+    max_delay_us=settings.USER_LOADER_MAX_DELAY_US,
+)
@@ -1,7 +1,14 @@
 import uuid
 
+from sqlalchemy import BigInteger
 from sqlalchemy import Boolean
 from sqlalchemy import Column
+from sqlalchemy import DateTime
+from sqlalchemy import DDL
+from sqlalchemy import event
+from sqlalchemy import func
+from sqlalchemy import Identity
+from sqlalchemy import SmallInteger
 from sqlalchemy import String
 from sqlalchemy.dialects.postgresql import UUID
 from sqlalchemy.orm import declarative_base
@@ -14,6 +21,19 @@ from sqlalchemy.orm import declarative_base
 
 Base = declarative_base()
 
+# GIN indexes that serve UserDAL.search_users, they need the pg_trgm extension
+TRIGRAM_INDEXED_COLUMNS = ("name", "surname", "email")
+
+
+def pg_trgm_available(ddl, target, bind, **kw) -> bool:
+    """Postgres without contrib has no pg_trgm: users work there, search doesn't"""
+    return (
+        bind.exec_driver_sql(
+            "SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm'"
+        ).scalar()
+        is not None
+    )
+
 
 class User(Base):
     __tablename__ = "users"
@@ -24,3 +44,51 @@ class User(Base):
     email = Column(String, nullable=False, unique=True)
     is_active = Column(Boolean(), default=True)
     hashed_password = Column(String, nullable=False)
+    # every UserDAL mutation moves the row to the end of the change feed
+    updated_at = Column(
+        DateTime(timezone=True), nullable=False, server_default=func.now()
+    )
+    change_seq = Column(BigInteger, Identity(), nullable=False, index=True)
+
+
+event.listen(
+    User.__table__,
+    "after_create",
+    DDL("CREATE EXTENSION IF NOT EXISTS pg_trgm").execute_if(
+        callable_=pg_trgm_available
+    ),
+)
+for _column in TRIGRAM_INDEXED_COLUMNS:
+    event.listen(
+        User.__table__,
+        "after_create",
+        DDL(
+            f"CREATE INDEX IF NOT EXISTS ix_users_{_column}_trgm"
+            f" ON users USING gin ({_column} gin_trgm_ops)"
+        ).execute_if(callable_=pg_trgm_available),
+    )
+
+
+class UserStats(Base):
+    """
+    User counters split into slots, the totals are the sums over all slots.
+    Writers bump a random slot, so concurrent registrations don't queue on one row.
+    """
+
+    __tablename__ = "user_stats"
+
+    slot = Column(SmallInteger, primary_key=True)
+    total = Column(BigInteger, nullable=False, default=0)
+    active = Column(BigInteger, nullable=False, default=0)
+
+
+class UserEmailIndex(Base):
+    """
+    Shard of every user by email, kept in one database when users are sharded.
+    Logins find the shard here, and the primary key keeps emails unique across shards.
+    """
+
+    __tablename__ = "user_email_index"
+
+    email = Column(String, primary_key=True)
+    shard = Column(SmallInteger, nullable=False)
@@ -0,0 +1,236 @@
+import asyncio
+from abc import ABC
+from abc import abstractmethod
+from logging import getLogger
+from typing import Callable
+from typing import List
+from typing import Optional
+from typing import Tuple
+from uuid import UUID
+
+import asyncpg
+from sqlalchemy import bindparam
+from sqlalchemy import cast
+from sqlalchemy import event
+from sqlalchemy import func
+from sqlalchemy import select
+from sqlalchemy import Text
+from sqlalchemy.dialects.postgresql import ARRAY
+from sqlalchemy.ext.asyncio import AsyncSession
+
+import settings
+
+logger = getLogger(__name__)
+
+########################################################
+# BLOCK FOR INVALIDATION OF USER CACHES ON ALL WORKERS #
+########################################################
+
+USER_CHANGES_CHANNEL = "user_changes"
+# shows the listener connections in pg_stat_activity
+LISTENER_APPLICATION_NAME = "user_changes_listener"
+
+
+class LocalCaches:
+    """In-process caches that hold user data and must forget it when it changes"""
+
+    def __init__(self):
+        self._caches: List[Tuple[Callable[[UUID], None], Callable[[], None]]] = []
+
+    def register(self, evict: Callable[[UUID], None], clear: Callable[[], None]):
+        self._caches.append((evict, clear))
+
+    def evict(self, user_id: UUID) -> None:
+        for evict, _ in self._caches:
+            evict(user_id)
+
+    def clear(self) -> None:
+        for _, clear in self._caches:
+            clear()
+
+
+user_caches = LocalCaches()
+
+
+class NotificationBus(ABC):
+    """Transport that tells every worker which users were changed"""
+
+    @abstractmethod
+    async def publish(self, session: AsyncSession, user_id: UUID) -> None:
+        """Sent only if the transaction of `session` commits"""
+
+    async def publish_many(self, session: AsyncSession, user_ids: List[UUID]) -> None:
+        for user_id in user_ids:
+            await self.publish(session, user_id)
+
+    @abstractmethod
+    async def listen(
+        self,
+        on_user_changed: Callable[[UUID], None],
+        on_reconnect: Callable[[], None],
+    ) -> None:
+        """
+        Calls `on_user_changed` for every published user until cancelled.
+        `on_reconnect` is called whenever notifications might have been missed.
+        """
+
+
+class PostgresNotificationBus(NotificationBus):
+    """
+    NOTIFY in the writing transaction, reaching the listeners of its database
+    only. Every worker keeps one LISTEN connection to each of `dsns`.
+    """
+
+    def __init__(
+        self,
+        dsns: List[str],
+        channel: str = USER_CHANGES_CHANNEL,
+        keepalive_seconds: float = 10,
+        max_reconnect_seconds: float = 30,
+    ):
+        self._dsns = dsns
+        self._channel = channel
+        self._keepalive_seconds = keepalive_seconds
+        self._max_reconnect_seconds = max_reconnect_seconds
+
+    async def publish(self, session: AsyncSession, user_id: UUID) -> None:
+        # postgres delivers it on commit and drops it on rollback
+        await session.execute(select(func.pg_notify(self._channel, str(user_id))))
+
+    async def publish_many(self, session: AsyncSession, user_ids: List[UUID]) -> None:
+        # one statement for the whole batch
+        changed = (
+            func.unnest(
+                cast(
+                    bindparam("user_ids", [str(user_id) for user_id in user_ids]),
+                    ARRAY(Text),
+                )
+            )
+            .table_valued("user_id")
+            .render_derived()
+        )
+        await session.execute(select(func.pg_notify(self._channel, changed.c.user_id)))
+
+    async def listen(
+        self,
+        on_user_changed: Callable[[UUID], None],
+        on_reconnect: Callable[[], None],
+    ) -> None:
+        await asyncio.gather(
+            *(self._listen_to(dsn, on_user_changed, on_reconnect) for dsn in self._dsns)
+        )
+
+    async def _listen_to(
+        self,
+        dsn: str,
+        on_user_changed: Callable[[UUID], None],
+        on_reconnect: Callable[[], None],
+    ) -> None:
+        reconnect_delay = 0.5
+        while True:
+            try:
+                await self._listen_on_connection(dsn, on_user_changed, on_reconnect)
+                reconnect_delay = 0.5
+            except (
+                OSError,
+                asyncio.TimeoutError,
+                asyncpg.PostgresError,
+                asyncpg.InterfaceError,
+            ) as err:
+                logger.error("User changes listener failed: %s", err)
+            await asyncio.sleep(reconnect_delay)
+            reconnect_delay = min(reconnect_delay * 2, self._max_reconnect_seconds)
+
+    async def _listen_on_connection(
+        self,
+        dsn: str,
+        on_user_changed: Callable[[UUID], None],
+        on_reconnect: Callable[[], None],
+    ) -> None:
+        connection = await asyncpg.connect(
+            dsn, server_settings={"application_name": LISTENER_APPLICATION_NAME}
+        )
+        lost = asyncio.Event()
+        connection.add_termination_listener(lambda _: lost.set())
+        try:
+            await connection.add_listener(
+                self._channel,
+                lambda _, __, ___, payload: _deliver(payload, on_user_changed),
+            )
+            # whatever was published before LISTEN started is lost for us
+            on_reconnect()
+            while not lost.is_set():
+                try:
+                    await asyncio.wait_for(lost.wait(), self._keepalive_seconds)
+                except asyncio.TimeoutError:
+                    # a dead TCP connection is noticed only when we write to it
+                    await asyncio.wait_for(
+                        connection.execute("SELECT 1"), self._keepalive_seconds
+                    )
+            logger.error("User changes listener lost its connection")
+        finally:
+            connection.terminate()
+
+
+class InMemoryNotificationBus(NotificationBus):
+    """Delivers to the listeners of this process only, for tests"""
+
+    def __init__(self):
+        self._listeners: List[Callable[[UUID], None]] = []
+
+    async def publish(self, session: AsyncSession, user_id: UUID) -> None:
+        sync_session = session.sync_session
+        pending = sync_session.info.get("pending_user_notifications")
+        if pending is None:
+            pending = sync_session.info["pending_user_notifications"] = []
+            event.listen(sync_session, "after_commit", self._on_commit)
+            event.listen(sync_session, "after_rollback", self._on_rollback)
+        pending.append(user_id)
+
+    async def listen(
+        self,
+        on_user_changed: Callable[[UUID], None],
+        on_reconnect: Callable[[], None],
+    ) -> None:
+        self._listeners.append(on_user_changed)
+        on_reconnect()
+        try:
+            await asyncio.get_running_loop().create_future()
+        finally:
+            self._listeners.remove(on_user_changed)
+
+    def _on_commit(self, sync_session) -> None:
+        pending = sync_session.info["pending_user_notifications"]
+        sync_session.info["pending_user_notifications"] = []
+        for user_id in pending:
+            for on_user_changed in self._listeners:
+                on_user_changed(user_id)
+
+    def _on_rollback(self, sync_session) -> None:
+        sync_session.info["pending_user_notifications"] = []
+
+
+def _deliver(payload: str, on_user_changed: Callable[[UUID], None]) -> None:
+    try:
+        user_id = UUID(payload)
+    except ValueError:
+        logger.error("Bad payload in %s: %r", USER_CHANGES_CHANNEL, payload)
+        return
+    on_user_changed(user_id)
+
+
+_bus: Optional[NotificationBus] = None
+
+
+def get_notification_bus() -> NotificationBus:
+    global _bus
+    if _bus is None:
+        # sharded users are written, and published, on their shard only
+        urls = settings.USER_SHARD_URLS or [settings.REAL_DATABASE_URL]
+        _bus = PostgresNotificationBus([url.replace("+asyncpg", "") for url in urls])
+    return _bus
+
+
+def set_notification_bus(bus: NotificationBus) -> None:
+    global _bus
+    _bus = bus
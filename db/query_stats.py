@@ -0,0 +1,138 @@
+import re
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+from logging import getLogger
+from typing import Any
+from typing import Iterator
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp
+from starlette.types import Message
+from starlette.types import Receive
+from starlette.types import Scope
+from starlette.types import Send
+
+import settings
+
+logger = getLogger(__name__)
+
+##########################################
+# BLOCK FOR PER-REQUEST QUERY ACCOUNTING #
+##########################################
+
+
+@dataclass
+class QueryStats:
+    queries: int = 0
+    db_seconds: float = 0.0
+
+
+# stats of the request being served, None outside of requests
+current_query_stats: ContextVar[Optional[QueryStats]] = ContextVar(
+    "current_query_stats", default=None
+)
+
+# (statement, parameters) run inside capture_statements(), None outside of it
+captured_statements: ContextVar[Optional[List[Tuple[str, Any]]]] = ContextVar(
+    "captured_statements", default=None
+)
+
+
+@contextmanager
+def capture_statements() -> Iterator[List[Tuple[str, Any]]]:
+    """Collects the SQL run on hooked engines by the code inside the block"""
+    statements = []
+    token = captured_statements.set(statements)
+    try:
+        yield statements
+    finally:
+        captured_statements.reset(token)
+
+
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_LITERAL = re.compile(r"\b\d+(?:\.\d+)?\b")
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_sql(statement: str) -> str:
+    """One-line SQL with literals replaced by `?`, safe to log"""
+    statement = _STRING_LITERAL.sub("?", statement)
+    statement = _NUMBER_LITERAL.sub("?", statement)
+    return _WHITESPACE.sub(" ", statement).strip()
+
+
+def install_query_hooks(sync_engine: Engine, slow_query_ms: float) -> None:
+    """Counts queries and DB time of the current request, logs slow queries"""
+
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, many):
+        conn.info.setdefault("query_started_at", []).append(time.perf_counter())
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, many):
+        elapsed = time.perf_counter() - conn.info["query_started_at"].pop()
+        stats = current_query_stats.get()
+        if stats is not None:
+            stats.queries += 1
+            stats.db_seconds += elapsed
+        statements = captured_statements.get()
+        if statements is not None and not many:
+            statements.append((statement, parameters))
+
+        if elapsed * 1000 >= slow_query_ms:
+            # parameters may hold emails and password hashes, only their number is logged
+            logger.warning(
+                "Slow query %.1f ms: %s [%d parameters redacted]",
+                elapsed * 1000,
+                normalize_sql(statement),
+                len(parameters) if parameters else 0,
+            )
+
+
+class QueryBudgetMiddleware:
+    """
+    Collects QueryStats of every request and flags requests that run more
+    than QUERY_BUDGET queries. With QUERY_STATS_HEADERS the numbers are also
+    sent back in X-Query-Count and Server-Timing.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = QueryStats()
+        token = current_query_stats.set(stats)
+
+        async def send_with_stats(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                if stats.queries > settings.QUERY_BUDGET:
+                    logger.warning(
+                        "Query budget exceeded: %s %s ran %d queries (budget %d)",
+                        scope["method"],
+                        scope["path"],
+                        stats.queries,
+                        settings.QUERY_BUDGET,
+                    )
+                if settings.QUERY_STATS_HEADERS:
+                    headers = MutableHeaders(scope=message)
+                    headers["X-Query-Count"] = str(stats.queries)
+                    headers.append(
+                        "Server-Timing", f"db;dur={stats.db_seconds * 1000:.1f}"
+                    )
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_stats)
+        finally:
+            current_query_stats.reset(token)
@@ -1,10 +1,19 @@
-from typing import Generator
+import asyncio
+from contextlib import asynccontextmanager
+from typing import AsyncIterator
+from typing import Callable
+from typing import Optional
+from uuid import uuid4
 
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.orm import Session
 from sqlalchemy.orm import sessionmaker
 
 import settings
+from .dals import UserDAL
+from .deadlines import install_deadline_hooks
+from .query_stats import install_query_hooks
 
 ##############################################
 # BLOCK FOR COMMON INTERACTION WITH DATABASE #
@@ -12,16 +21,103 @@ import settings
 
 
 # create async engine for interaction with database
-engine = create_async_engine(settings.REAL_DATABASE_URL, future=True, echo=True)
+engine = create_async_engine(
+    settings.REAL_DATABASE_URL,
+    future=True,
+    echo=settings.DB_ECHO,
+    pool_size=settings.DB_POOL_SIZE,
+    max_overflow=settings.DB_MAX_OVERFLOW,
+)
+
+install_query_hooks(engine.sync_engine, slow_query_ms=settings.SLOW_QUERY_MS)
+# sessions of every engine, the tests' one included
+install_deadline_hooks(Session)
 
 # create session for the interaction with database
 async_session = sessionmaker(engine, expire_on_commit=False, class_=AsyncSession)
 
 
-async def get_db() -> Generator:
-    """Dependency for getting async session"""
+class UnitOfWork:
+    """
+    Database work of one request. The session takes a pool connection only
+    when the first query runs. transaction() blocks nested into another one
+    reuse its transaction, and the outermost block commits and gives the
+    connection back as soon as it exits, not when the response is sent.
+    """
+
+    def __init__(self, session_factory: Callable[[], AsyncSession]):
+        self._session_factory = session_factory
+        self._session: Optional[AsyncSession] = None
+        self._depth = 0
+
+    @asynccontextmanager
+    async def transaction(self) -> AsyncIterator[AsyncSession]:
+        if self._session is None:
+            self._session = self._session_factory()
+        session = self._session
+        if self._depth > 0:
+            # an error here fails the outer transaction too
+            self._depth += 1
+            try:
+                yield session
+            finally:
+                self._depth -= 1
+            return
+
+        self._depth = 1
+        try:
+            async with session.begin():
+                yield session
+        finally:
+            self._depth = 0
+            await session.close()
+
+    async def close(self) -> None:
+        if self._session is not None:
+            await self._session.close()
+
+
+async def get_db() -> AsyncIterator[UnitOfWork]:
+    """Dependency for getting the request's unit of work"""
+    unit_of_work = UnitOfWork(async_session)
+    try:
+        yield unit_of_work
+    finally:
+        await unit_of_work.close()
+
+
+async def _prepare_user_statements(session: AsyncSession) -> None:
+    """
+    Runs every UserDAL statement once inside a rolled back transaction,
+    so SQLAlchemy caches the compiled SQL and asyncpg prepares it on the connection.
+    """
+    await session.begin()
+    try:
+        user_dal = UserDAL(session)
+        probe_id = uuid4()
+        await user_dal.create_user(
+            name="warm-up",
+            surname="warm-up",
+            email=f"{probe_id}@warm-up.local",
+            hashed_password="",
+        )
+        await user_dal.get_user_by_id(user_id=probe_id)
+        await user_dal.get_user_by_email(email="")
+        await user_dal.update_user_by_id(user_id=probe_id, name="warm-up")
+        await user_dal.delete_user_by_id(user_id=probe_id)
+    finally:
+        await session.rollback()
+
+
+async def warm_up_pool(connections: int) -> None:
+    """Opens `connections` pool connections at once and prepares statements on each"""
+    # overflow connections are closed on checkin, so warming them is useless
+    connections = min(connections, settings.DB_POOL_SIZE)
+    if connections <= 0:
+        return
+
+    sessions = [async_session() for _ in range(connections)]
     try:
-        session: AsyncSession = async_session()
-        yield session
+        await asyncio.gather(*(_prepare_user_statements(s) for s in sessions))
     finally:
-        await session.close()
+        await asyncio.gather(*(s.close() for s in sessions))
@@ -0,0 +1,330 @@
+import asyncio
+import hashlib
+import heapq
+import itertools
+from collections import defaultdict
+from typing import Awaitable
+from typing import Callable
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Tuple
+from typing import TypeVar
+from uuid import UUID
+from uuid import uuid4
+
+from sqlalchemy import any_
+from sqlalchemy import bindparam
+from sqlalchemy import delete
+from sqlalchemy import select
+from sqlalchemy.dialects.postgresql import ARRAY
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.orm import sessionmaker
+
+import settings
+from .dals import UserDAL
+from .models import User
+from .models import UserEmailIndex
+from .query_stats import install_query_hooks
+
+T = TypeVar("T")
+
+#######################################
+# BLOCK FOR HASH-SHARDED USER STORAGE #
+#######################################
+
+
+def shard_for_user(user_id: UUID, shard_count: int) -> int:
+    """Stable across processes, unlike hash()"""
+    digest = hashlib.blake2b(user_id.bytes, digest_size=8).digest()
+    return int.from_bytes(digest, "big") % shard_count
+
+
+class UserShards:
+    """Engine and session factory of every shard and of the email index"""
+
+    def __init__(self, shard_urls: List[str], index_url: str):
+        self.engines = []
+        self.shard_sessions = [self._session_factory(url) for url in shard_urls]
+        self.index_session = self._session_factory(index_url)
+
+    def _session_factory(self, url: str) -> sessionmaker:
+        # a pool per database, each sized like the pool of the single database
+        engine = create_async_engine(
+            url,
+            future=True,
+            pool_size=settings.DB_POOL_SIZE,
+            max_overflow=settings.DB_MAX_OVERFLOW,
+        )
+        install_query_hooks(engine.sync_engine, slow_query_ms=settings.SLOW_QUERY_MS)
+        self.engines.append(engine)
+        return sessionmaker(engine, expire_on_commit=False, class_=AsyncSession)
+
+    def __len__(self) -> int:
+        return len(self.shard_sessions)
+
+    def shard_of(self, user_id: UUID) -> int:
+        return shard_for_user(user_id, len(self.shard_sessions))
+
+    async def dispose(self) -> None:
+        await asyncio.gather(*(engine.dispose() for engine in self.engines))
+
+
+class ShardedUserDAL:
+    """
+    UserDAL over all shards: point operations go to the shard of the user,
+    listings and batches run on the shards in parallel and are merged.
+    Every shard has its own transaction, there is no transaction across shards.
+    """
+
+    def __init__(self, shards: UserShards):
+        self.shards = shards
+
+    async def _on_shard(self, shard: int, fn: Callable[[UserDAL], Awaitable[T]]) -> T:
+        async with self.shards.shard_sessions[shard]() as session:
+            async with session.begin():
+                return await fn(UserDAL(session))
+
+    async def _on_all_shards(self, fn: Callable[[UserDAL], Awaitable[T]]) -> List[T]:
+        return await asyncio.gather(
+            *(self._on_shard(shard, fn) for shard in range(len(self.shards)))
+        )
+
+    async def create_user(
+        self, name: str, surname: str, email: str, hashed_password: str
+    ) -> User:
+        user_id = uuid4()
+        shard = self.shards.shard_of(user_id)
+        # a taken email fails here with IntegrityError, before the shard is touched
+        await self._claim_email(email, shard)
+        try:
+            return await self._on_shard(
+                shard,
+                lambda user_dal: user_dal.create_user(
+                    name=name,
+                    surname=surname,
+                    email=email,
+                    hashed_password=hashed_password,
+                    user_id=user_id,
+                ),
+            )
+        except BaseException:
+            await self._release_email(email)
+            raise
+
+    async def get_user_by_id(self, user_id: UUID) -> Optional[User]:
+        return await self._on_shard(
+            self.shards.shard_of(user_id),
+            lambda user_dal: user_dal.get_user_by_id(user_id=user_id),
+        )
+
+    async def get_user_by_email(self, email: str) -> Optional[User]:
+        shards = await self._find_shards([email])
+        if email in shards:
+            return await self._on_shard(
+                shards[email], lambda user_dal: user_dal.get_user_by_email(email=email)
+            )
+
+    async def get_users_by_ids(self, user_ids: List[UUID]) -> List[User]:
+        by_shard = defaultdict(list)
+        for user_id in user_ids:
+            by_shard[self.shards.shard_of(user_id)].append(user_id)
+        return await self._gather_users(
+            {
+                shard: lambda user_dal, ids=ids: user_dal.get_users_by_ids(ids)
+                for shard, ids in by_shard.items()
+            }
+        )
+
+    async def get_users_by_emails(self, emails: List[str]) -> List[User]:
+        by_shard = defaultdict(list)
+        for email, shard in (await self._find_shards(emails)).items():
+            by_shard[shard].append(email)
+        return await self._gather_users(
+            {
+                shard: lambda user_dal, emails=emails: user_dal.get_users_by_emails(
+                    emails
+                )
+                for shard, emails in by_shard.items()
+            }
+        )
+
+    async def search_users(
+        self, text: str, limit: int, after: Optional[Tuple[float, UUID]] = None
+    ) -> List[Tuple[User, float]]:
+        # every shard returns its best `limit` rows after the cursor,
+        # the best `limit` of their union are the best overall
+        results = await self._on_all_shards(
+            lambda user_dal: user_dal.search_users(text, limit, after)
+        )
+        found = [row for rows in results for row in rows]
+        found.sort(key=lambda row: (-row[1], row[0].user_id))
+        return found[:limit]
+
+    async def get_user_changes(
+        self, since: List[int], limit: int
+    ) -> Tuple[List[User], List[int], bool]:
+        """
+        Changes after the `since` change_seq of every shard, merged by updated_at,
+        the change_seq every shard has been read up to and whether a shard page
+        was stalled. change_seq is counted per shard, so one number can't be the
+        cursor of all of them.
+        """
+        pages = await asyncio.gather(
+            *(
+                self._on_shard(
+                    shard,
+                    lambda user_dal, since=shard_since: user_dal.get_user_changes(
+                        since=since, limit=limit
+                    ),
+                )
+                for shard, shard_since in enumerate(since)
+            )
+        )
+        read_up_to = list(since)
+        # every shard gives a prefix of its page, so its cursor can't skip rows
+        merged = heapq.merge(
+            *(
+                [(shard, user) for user in users]
+                for shard, (users, _) in enumerate(pages)
+            ),
+            key=lambda change: change[1].updated_at,
+        )
+        users = []
+        for shard, user in itertools.islice(merged, limit):
+            users.append(user)
+            read_up_to[shard] = user.change_seq
+        return users, read_up_to, any(stalled for _, stalled in pages)
+
+    async def get_user_stats(self) -> Tuple[int, int]:
+        stats = await self._on_all_shards(lambda user_dal: user_dal.get_user_stats())
+        return sum(total for total, _ in stats), sum(active for _, active in stats)
+
+    async def delete_user_by_id(self, user_id: UUID) -> Optional[UUID]:
+        # the email stays claimed, as it does in the users table of one database
+        return await self._on_shard(
+            self.shards.shard_of(user_id),
+            lambda user_dal: user_dal.delete_user_by_id(user_id=user_id),
+        )
+
+    async def update_user_by_id(self, user_id: UUID, **kwargs) -> Optional[UUID]:
+        shard = self.shards.shard_of(user_id)
+        new_email = kwargs.get("email")
+        user, old_email, claimed_email = None, None, None
+        try:
+            async with self.shards.shard_sessions[shard]() as session:
+                async with session.begin():
+                    user_dal = UserDAL(session)
+                    if new_email is not None:
+                        # a concurrent email change of the user waits for this one,
+                        # then it sees the email set here and releases that one
+                        user = await user_dal.get_user_by_id(user_id, for_update=True)
+                    if user is not None and user.is_active and user.email != new_email:
+                        # the new email is claimed first, the old one released after commit
+                        await self._claim_email(new_email, shard)
+                        old_email, claimed_email = user.email, new_email
+                    updated_user_id = await user_dal.update_user_by_id(
+                        user_id, **kwargs
+                    )
+        except BaseException:
+            if claimed_email is not None:
+                await self._release_email(claimed_email)
+            raise
+        if claimed_email is not None:
+            await self._release_email(old_email)
+        return updated_user_id
+
+    async def deactivate_users(self, user_ids: List[UUID]) -> List[UUID]:
+        results = await self._on_shards_of(
+            user_ids, lambda user_dal, ids: user_dal.deactivate_users(ids)
+        )
+        return [user_id for user_ids in results for user_id in user_ids]
+
+    async def update_users(self, changes: Dict[UUID, dict]) -> List[UUID]:
+        """
+        Changes of name and surname only: a new email must be claimed in the
+        index, that is what update_user_by_id does.
+        """
+        if any("email" in fields for fields in changes.values()):
+            raise ValueError("Emails of sharded users are changed one by one")
+        results = await self._on_shards_of(
+            list(changes),
+            lambda user_dal, ids: user_dal.update_users(
+                {user_id: changes[user_id] for user_id in ids}
+            ),
+        )
+        return [user_id for user_ids in results for user_id in user_ids]
+
+    async def replace_password_hash(
+        self, user_id: UUID, old_hash: str, new_hash: str
+    ) -> bool:
+        return await self._on_shard(
+            self.shards.shard_of(user_id),
+            lambda user_dal: user_dal.replace_password_hash(
+                user_id, old_hash, new_hash
+            ),
+        )
+
+    async def _on_shards_of(
+        self,
+        user_ids: List[UUID],
+        fn: Callable[[UserDAL, List[UUID]], Awaitable[T]],
+    ) -> List[T]:
+        """Calls `fn` on every shard with the ids kept there, concurrently"""
+        by_shard = defaultdict(list)
+        for user_id in user_ids:
+            by_shard[self.shards.shard_of(user_id)].append(user_id)
+        return await asyncio.gather(
+            *(
+                self._on_shard(shard, lambda user_dal, ids=ids: fn(user_dal, ids))
+                for shard, ids in by_shard.items()
+            )
+        )
+
+    async def _gather_users(
+        self, calls: Dict[int, Callable[[UserDAL], Awaitable[List[User]]]]
+    ) -> List[User]:
+        results = await asyncio.gather(
+            *(self._on_shard(shard, fn) for shard, fn in calls.items())
+        )
+        return [user for users in results for user in users]
+
+    async def _find_shards(self, emails: List[str]) -> Dict[str, int]:
+        query = select(UserEmailIndex.email, UserEmailIndex.shard).where(
+            UserEmailIndex.email
+            == any_(bindparam("emails", emails, ARRAY(UserEmailIndex.email.type)))
+        )
+        async with self.shards.index_session() as session:
+            result = await session.execute(query)
+            return {email: shard for email, shard in result}
+
+    async def _claim_email(self, email: str, shard: int) -> None:
+        async with self.shards.index_session() as session:
+            async with session.begin():
+                session.add(UserEmailIndex(email=email, shard=shard))
+
+    async def _release_email(self, email: str) -> None:
+        async with self.shards.index_session() as session:
+            async with session.begin():
+                await session.execute(
+                    delete(UserEmailIndex).where(UserEmailIndex.email == email)
+                )
+
+
+_sharded_user_dal: Optional[ShardedUserDAL] = None
+
+
+def get_sharded_user_dal() -> Optional[ShardedUserDAL]:
+    """None when users are kept in one database"""
+    global _sharded_user_dal
+    if _sharded_user_dal is None and settings.USER_SHARD_URLS:
+        _sharded_user_dal = ShardedUserDAL(
+            UserShards(settings.USER_SHARD_URLS, settings.USER_EMAIL_INDEX_URL)
+        )
+    return _sharded_user_dal
+
+
+def set_sharded_user_dal(user_dal: Optional[ShardedUserDAL]) -> None:
+    global _sharded_user_dal
+    _sharded_user_dal = user_dal
@@ -0,0 +1,77 @@
+import asyncio
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any
+from typing import Awaitable
+from typing import Callable
+from typing import Dict
+from typing import Hashable
+
+from .deadlines import create_shared_task
+from .deadlines import wait_shared
+
+##############################################
+# BLOCK FOR COALESCING OF CONCURRENT LOOKUPS #
+##############################################
+
+
+@dataclass
+class FlightStats:
+    """Counters of one lookup key"""
+
+    calls: int = 0  # lookups that went to the database
+    shared: int = 0  # lookups that joined a call already in flight
+    errors: int = 0  # calls that ended with an error
+
+
+class SingleFlight:
+    """
+    Concurrent callers with the same key share one in-flight call:
+    its result or its error. Nothing is kept after the call finishes,
+    so the next caller always gets fresh data. The call runs without the
+    deadline of the caller who made it, every caller waits until its own.
+    """
+
+    def __init__(self, max_tracked_keys: int = 10_000):
+        self._in_flight: Dict[Hashable, asyncio.Task] = {}
+        self._stats: "OrderedDict[Hashable, FlightStats]" = OrderedDict()
+        self._max_tracked_keys = max_tracked_keys
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        stats = self._stats_for(key)
+        call = self._in_flight.get(key)
+        if call is None:
+            stats.calls += 1
+            call = self._in_flight[key] = create_shared_task(self._call(key, fn, stats))
+        else:
+            stats.shared += 1
+        # a caller giving up must not cancel the call for the others
+        return await wait_shared(call)
+
+    async def _call(
+        self, key: Hashable, fn: Callable[[], Awaitable[Any]], stats: FlightStats
+    ) -> Any:
+        try:
+            return await fn()
+        except Exception:
+            stats.errors += 1
+            raise
+        finally:
+            del self._in_flight[key]
+
+    def stats(self) -> Dict[Hashable, FlightStats]:
+        return dict(self._stats)
+
+    def _stats_for(self, key: Hashable) -> FlightStats:
+        stats = self._stats.get(key)
+        if stats is None:
+            stats = self._stats[key] = FlightStats()
+            if len(self._stats) > self._max_tracked_keys:
+                self._stats.popitem(last=False)
+        else:
+            self._stats.move_to_end(key)
+        return stats
+
+
+# shared by the user handlers, keys are ("id", user_id) and ("email", email)
+user_lookups = SingleFlight()
@@ -0,0 +1,123 @@
+import asyncio
+import uuid
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Set
+
+from sqlalchemy.orm import sessionmaker
+
+import settings
+from .dals import UserDAL
+from .deadlines import create_shared_task
+from .deadlines import wait_shared
+from .models import User
+from .session import async_session
+
+############################################
+# BLOCK FOR BATCHING OF CONCURRENT INSERTS #
+############################################
+
+
+class UserWriteBatcher:
+    """
+    Buffers concurrent user creations for a few milliseconds and writes them
+    with one multi-row INSERT ... ON CONFLICT DO NOTHING ... RETURNING.
+    Every caller gets its own user or the IntegrityError of its own INSERT.
+    """
+
+    def __init__(
+        self,
+        session_factory: sessionmaker,
+        max_batch_size: int = 200,
+        max_delay_ms: float = 2,
+    ):
+        self._session_factory = session_factory
+        self._max_batch_size = max_batch_size
+        self._max_delay_ms = max_delay_ms
+        self._pending: List[dict] = []
+        self._futures: Dict[uuid.UUID, asyncio.Future] = {}
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+        self._running: Set[asyncio.Task] = set()
+
+    async def create_user(
+        self, name: str, surname: str, email: str, hashed_password: str
+    ) -> User:
+        row = dict(
+            user_id=uuid.uuid4(),
+            name=name,
+            surname=surname,
+            email=email,
+            hashed_password=hashed_password,
+        )
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append(row)
+        self._futures[row["user_id"]] = future
+
+        if len(self._pending) >= self._max_batch_size:
+            self._flush()
+        elif self._flush_handle is None:
+            self._flush_handle = asyncio.get_running_loop().call_later(
+                self._max_delay_ms / 1000, self._flush
+            )
+
+        # the insert is shared, a caller giving up must not cancel it for the others
+        is_active = await wait_shared(future)
+        return User(is_active=is_active, **row)
+
+    def _flush(self) -> None:
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+
+        rows, self._pending = self._pending, []
+        futures, self._futures = self._futures, {}
+        if rows:
+            task = create_shared_task(self._write(rows, futures))
+            self._running.add(task)
+            task.add_done_callback(self._running.discard)
+
+    async def _write(
+        self, rows: List[dict], futures: Dict[uuid.UUID, asyncio.Future]
+    ) -> None:
+        try:
+            async with self._session_factory() as session:
+                async with session.begin():
+                    created = await UserDAL(session).create_users(rows)
+        except Exception as err:
+            for future in futures.values():
+                if not future.done():
+                    future.set_exception(err)
+                    future.exception()  # waiters may be gone already
+            return
+
+        skipped = []
+        for row in rows:
+            future = futures[row["user_id"]]
+            if future.done():
+                continue
+            if row["user_id"] in created:
+                future.set_result(created[row["user_id"]])
+            else:
+                skipped.append(row)
+        # ON CONFLICT skips a row silently, its single INSERT gets the driver's error
+        for row in skipped:
+            await self._write_one(row, futures[row["user_id"]])
+
+    async def _write_one(self, row: dict, future: asyncio.Future) -> None:
+        try:
+            async with self._session_factory() as session:
+                async with session.begin():
+                    user = await UserDAL(session).create_user(**row)
+        except Exception as err:
+            future.set_exception(err)
+            future.exception()
+            return
+        future.set_result(user.is_active)
+
+
+user_write_batcher = UserWriteBatcher(
+    async_session,
+    max_batch_size=settings.USER_WRITE_BATCHER_MAX_BATCH_SIZE,
+    max_delay_ms=settings.USER_WRITE_BATCHER_MAX_DELAY_MS,
+)
@@ -1,5 +1,17 @@
+import asyncio
+import math
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any
+from typing import Callable
+from typing import Optional
+from typing import Tuple
+
 from passlib.context import CryptContext
 
+import settings
+
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
 
@@ -12,6 +24,130 @@ class Hasher:
         """
         return pwd_context.verify(plain_password, hashed_password)
 
+    @staticmethod
+    def verify_and_update(
+        plain_password: str, hashed_password: str
+    ) -> Tuple[bool, Optional[str]]:
+        """
+        Сверяет пароль и, если хэш устарел (needs_update: другая схема
+        или меньшая стоимость), возвращает новый хэш для сохранения в БД.
+        """
+        return pwd_context.verify_and_update(plain_password, hashed_password)
+
     @staticmethod
     def get_password_hash(password: str) -> str:
         return pwd_context.hash(password)
+
+    @staticmethod
+    def warm_up() -> None:
+        """
+        Загружает backend bcrypt заранее (passlib делает это лениво,
+        вместе с самопроверкой backend при первом хэшировании).
+        """
+        pwd_context.handler().get_backend()
+
+    @staticmethod
+    def calibrate() -> dict:
+        """
+        Подбирает стоимость новых хэшей под PASSWORD_HASH_TARGET_MS на этой
+        машине и применяет ее к pwd_context. При логине перехэшируются только
+        хэши другой схемы или со стоимостью ниже общего минимума из настроек.
+        """
+        scheme = settings.PASSWORD_HASH_SCHEME
+        if scheme == "argon2":
+            params = calibrate_argon2(
+                settings.PASSWORD_HASH_TARGET_MS,
+                min_time_cost=settings.ARGON2_MIN_TIME_COST,
+                memory_cost=settings.ARGON2_MEMORY_KIB,
+                parallelism=settings.ARGON2_PARALLELISM,
+            )
+        else:
+            params = calibrate_bcrypt(
+                settings.PASSWORD_HASH_TARGET_MS,
+                min_rounds=settings.BCRYPT_MIN_ROUNDS,
+            )
+        # bcrypt остается в списке, чтобы старые хэши проверялись до перехэширования
+        schemes = [scheme] if scheme == "bcrypt" else [scheme, "bcrypt"]
+        pwd_context.update(schemes=schemes, deprecated="auto", **params)
+        return params
+
+
+# пароль только для замеров, сравнивать его ни с чем не нужно
+_CALIBRATION_PASSWORD = "calibration-password"
+
+
+def _verify_seconds(handler, repeat: int = 3) -> float:
+    """Медиана времени verify для хэша с параметрами handler"""
+    hashed = handler.hash(_CALIBRATION_PASSWORD)
+    timings = []
+    for _ in range(repeat):
+        started_at = time.perf_counter()
+        handler.verify(_CALIBRATION_PASSWORD, hashed)
+        timings.append(time.perf_counter() - started_at)
+    return sorted(timings)[repeat // 2]
+
+
+def calibrate_bcrypt(target_ms: float, min_rounds: int) -> dict:
+    """Каждый round удваивает время, замер делается один раз на min_rounds"""
+    from passlib.hash import bcrypt
+
+    seconds = _verify_seconds(bcrypt.using(rounds=min_rounds))
+    extra_rounds = max(int(math.log2(target_ms / 1000 / seconds)), 0)
+    rounds = min(min_rounds + extra_rounds, bcrypt.max_rounds)
+    # замер у каждого воркера свой: минимум берется из общих настроек, а верхней
+    # границы нет, иначе воркеры перехэшировали бы хэши друг друга
+    return {"bcrypt__default_rounds": rounds, "bcrypt__min_rounds": min_rounds}
+
+
+def calibrate_argon2(
+    target_ms: float, min_time_cost: int, memory_cost: int, parallelism: int
+) -> dict:
+    """Память фиксирована настройками, время растет линейно с time_cost"""
+    # нужен argon2-cffi, без него passlib бросит MissingBackendError
+    from passlib.hash import argon2
+
+    seconds = _verify_seconds(
+        argon2.using(rounds=1, memory_cost=memory_cost, parallelism=parallelism)
+    )
+    time_cost = max(int(target_ms / 1000 / seconds), min_time_cost)
+    return {
+        "argon2__default_rounds": time_cost,
+        "argon2__min_rounds": min_time_cost,
+        "argon2__memory_cost": memory_cost,
+        "argon2__parallelism": parallelism,
+    }
+
+
+class HashingPool:
+    """
+    Потоки для bcrypt, чтобы хэширование не блокировало event loop.
+    Считает задачи в работе, глубина очереди нужна для readiness.
+    """
+
+    def __init__(self, workers: int):
+        self.workers = workers
+        self._executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="hashing"
+        )
+        self._lock = threading.Lock()
+        self._in_flight = 0
+
+    @property
+    def queue_depth(self) -> int:
+        """Задачи, которые ждут свободный поток"""
+        return max(self._in_flight - self.workers, 0)
+
+    async def run(self, fn: Callable[..., Any], *args: Any) -> Any:
+        with self._lock:
+            self._in_flight += 1
+        future = self._executor.submit(fn, *args)
+        # задача считается до конца, даже если запрос уже отменен
+        future.add_done_callback(self._task_done)
+        return await asyncio.wrap_future(future)
+
+    def _task_done(self, _) -> None:
+        with self._lock:
+            self._in_flight -= 1
+
+
+hashing_pool = HashingPool(settings.HASHING_POOL_SIZE)
@@ -0,0 +1,219 @@
+import copy
+import json
+import logging
+import queue
+import re
+import sys
+import threading
+import time
+from collections import OrderedDict
+from contextvars import ContextVar
+from logging.handlers import QueueHandler
+from logging.handlers import QueueListener
+from typing import Hashable
+from typing import Optional
+from typing import Tuple
+from uuid import uuid4
+
+from starlette.datastructures import Headers
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp
+from starlette.types import Message
+from starlette.types import Receive
+from starlette.types import Scope
+from starlette.types import Send
+
+import settings
+
+#######################################
+# BLOCK FOR NON-BLOCKING JSON LOGGING #
+#######################################
+
+REQUEST_ID_HEADER = "x-request-id"
+# ids sent by clients and proxies are logged as is, so only safe ones are taken
+_VALID_REQUEST_ID = re.compile(r"^[A-Za-z0-9._:-]{1,128}$")
+
+# correlation id of the request being served, None outside of requests
+current_request_id: ContextVar[Optional[str]] = ContextVar(
+    "current_request_id", default=None
+)
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line, runs in the listener thread"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        request_id = getattr(record, "request_id", None)
+        if request_id is not None:
+            entry["request_id"] = request_id
+        suppressed = getattr(record, "suppressed", 0)
+        if suppressed:
+            entry["suppressed"] = suppressed
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class RequestIdFilter(logging.Filter):
+    """Copies the correlation id onto the record while still in the request's context"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.request_id = current_request_id.get()
+        return True
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Passes the first `burst` records of every message per `period` seconds,
+    after that one record in `sample_rate`. The next record that passes
+    carries the number of dropped ones in `suppressed`.
+    Messages are told apart by logger, level and format string; for
+    `logger.error(err)` the exception type stands for the format string.
+    """
+
+    def __init__(
+        self,
+        burst: int,
+        period: float,
+        sample_rate: int,
+        max_tracked_messages: int = 1000,
+    ):
+        super().__init__()
+        self.burst = burst
+        self.period = period
+        self.sample_rate = sample_rate
+        self.max_tracked_messages = max_tracked_messages
+        self._lock = threading.Lock()
+        # key -> (window started at, records in window, suppressed since last pass)
+        self._windows: "OrderedDict[Hashable, Tuple[float, int, int]]" = OrderedDict()
+
+    @staticmethod
+    def _key(record: logging.LogRecord) -> Hashable:
+        template = record.msg if isinstance(record.msg, str) else type(record.msg)
+        return record.name, record.levelno, template
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        key = self._key(record)
+        now = time.monotonic()
+        with self._lock:
+            started_at, seen, suppressed = self._windows.pop(key, (now, 0, 0))
+            if now - started_at >= self.period:
+                started_at, seen = now, 0
+            seen += 1
+            passed = seen <= self.burst or (seen - self.burst) % self.sample_rate == 0
+            if passed:
+                record.suppressed, suppressed = suppressed, 0
+            else:
+                suppressed += 1
+            self._windows[key] = (started_at, seen, suppressed)
+            while len(self._windows) > self.max_tracked_messages:
+                self._windows.popitem(last=False)
+        return passed
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    """Drops records when the queue is full instead of waiting for the listener"""
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # only arguments are merged here, JSON is built in the listener thread
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            # tracebacks must be rendered before their frames change
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+_listener: Optional[QueueListener] = None
+_queue_handler: Optional[NonBlockingQueueHandler] = None
+
+
+def setup_logging() -> None:
+    """
+    Root logger writes through a queue: the caller only enqueues the record,
+    a background thread formats and writes it.
+    """
+    global _listener, _queue_handler
+    if _listener is not None:
+        return
+
+    output = logging.StreamHandler(sys.stdout)
+    output.setFormatter(JsonFormatter())
+    log_queue = queue.Queue(maxsize=settings.LOG_QUEUE_SIZE)
+    _queue_handler = NonBlockingQueueHandler(log_queue)
+    _queue_handler.addFilter(RequestIdFilter())
+    _queue_handler.addFilter(
+        RateLimitFilter(
+            burst=settings.LOG_RATE_LIMIT_BURST,
+            period=settings.LOG_RATE_LIMIT_PERIOD_SECONDS,
+            sample_rate=settings.LOG_SAMPLE_RATE,
+        )
+    )
+    _listener = QueueListener(log_queue, output, respect_handler_level=True)
+    _listener.start()
+
+    root = logging.getLogger()
+    root.addHandler(_queue_handler)
+    root.setLevel(settings.LOG_LEVEL)
+
+
+def shutdown_logging() -> None:
+    """Writes out the queued records and detaches the queue handler"""
+    global _listener, _queue_handler
+    if _listener is None:
+        return
+
+    logging.getLogger().removeHandler(_queue_handler)
+    _listener.stop()
+    _listener = _queue_handler = None
+
+
+class RequestIdMiddleware:
+    """
+    Gives every request a correlation id: the client's X-Request-ID if it is
+    sane, a new one otherwise. It is logged with every record of the request
+    and sent back in the X-Request-ID header.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        request_id = Headers(scope=scope).get(REQUEST_ID_HEADER)
+        if request_id is None or not _VALID_REQUEST_ID.match(request_id):
+            request_id = uuid4().hex
+        token = current_request_id.set(request_id)
+
+        async def send_with_request_id(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                MutableHeaders(scope=message)["X-Request-ID"] = request_id
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_request_id)
+        finally:
+            current_request_id.reset(token)
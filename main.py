@@ -1,12 +1,69 @@
+import asyncio
+from logging import getLogger
+
 import uvicorn
 from fastapi import FastAPI
 from fastapi.routing import APIRouter
 
+import settings
+from api.compression import CompressionMiddleware
 from api.handlers import user_router
+from api.health import health_router
+from api.idempotency import IdempotencyMiddleware
+from api.idempotency import InMemoryIdempotencyStore
 from api.login_handler import login_router
+from api.traffic_capture import TrafficCaptureMiddleware
+from api.traffic_capture import TrafficRecorder
+from db.deadlines import DeadlineMiddleware
+from db.jobs import run_user_stats_reconciliation
+from db.notifications import get_notification_bus
+from db.notifications import user_caches
+from db.query_stats import QueryBudgetMiddleware
+from db.session import async_session
+from db.session import engine
+from db.session import warm_up_pool
+from db.sharding import get_sharded_user_dal
+from hashing import Hasher
+from hashing import hashing_pool
+from logging_setup import RequestIdMiddleware
+from logging_setup import setup_logging
+from logging_setup import shutdown_logging
+from security import warm_up_jwt
+
+logger = getLogger(__name__)
 
 # create instance of the app
 app = FastAPI(title="education_platform")
+app.state.ready = False
+app.state.background_tasks = []
+# innermost: a request cancelled on deadline or disconnect holds nothing else
+app.add_middleware(DeadlineMiddleware)
+# added before compression to sit inside it: stored responses are kept uncompressed
+app.add_middleware(
+    IdempotencyMiddleware,
+    store=InMemoryIdempotencyStore(max_keys=settings.IDEMPOTENCY_MAX_KEYS),
+    ttl_seconds=settings.IDEMPOTENCY_TTL_SECONDS,
+    wait_seconds=settings.IDEMPOTENCY_WAIT_SECONDS,
+)
+app.add_middleware(QueryBudgetMiddleware)
+app.add_middleware(
+    CompressionMiddleware,
+    minimum_size=settings.COMPRESSION_MINIMUM_SIZE,
+    gzip_level=settings.COMPRESSION_GZIP_LEVEL,
+    brotli_quality=settings.COMPRESSION_BROTLI_QUALITY,
+)
+traffic_recorder = None
+if settings.TRAFFIC_CAPTURE_PATH:
+    # measures the same latency the client sees, compression included
+    traffic_recorder = TrafficRecorder(settings.TRAFFIC_CAPTURE_PATH)
+    app.add_middleware(
+        TrafficCaptureMiddleware,
+        recorder=traffic_recorder,
+        sample_rate=settings.TRAFFIC_CAPTURE_SAMPLE_RATE,
+        max_body_bytes=settings.TRAFFIC_CAPTURE_MAX_BODY_BYTES,
+    )
+# outermost, so every record of the request carries its id
+app.add_middleware(RequestIdMiddleware)
 
 # create the instance for the routes
 main_api_router = APIRouter()
@@ -14,8 +71,65 @@ main_api_router = APIRouter()
 # set routes to the app instance
 main_api_router.include_router(user_router, prefix="/user", tags=["user"])
 main_api_router.include_router(login_router, prefix="/login", tags=["login"])
+main_api_router.include_router(health_router, prefix="/health", tags=["health"])
 app.include_router(main_api_router)
 
+
+@app.on_event("startup")
+async def startup() -> None:
+    """Warms up connections, statements, hashing and JWT, starts background jobs"""
+    setup_logging()
+    if traffic_recorder is not None:
+        traffic_recorder.start()
+    await warm_up_pool(settings.DB_POOL_WARM_CONNECTIONS)
+    Hasher.warm_up()
+    if settings.PASSWORD_HASH_TARGET_MS > 0:
+        # hashes with the calibrated cost, measured off the event loop
+        params = await hashing_pool.run(Hasher.calibrate)
+        logger.info("Password hashing calibrated: %s", params)
+    warm_up_jwt()
+    if settings.USER_STATS_RECONCILE_SECONDS > 0:
+        sharded_user_dal = get_sharded_user_dal()
+        # every shard keeps the counters of its own users
+        session_factories = (
+            sharded_user_dal.shards.shard_sessions
+            if sharded_user_dal is not None
+            else [async_session]
+        )
+        for session_factory in session_factories:
+            app.state.background_tasks.append(
+                asyncio.create_task(
+                    run_user_stats_reconciliation(
+                        session_factory, settings.USER_STATS_RECONCILE_SECONDS
+                    )
+                )
+            )
+    if settings.USER_NOTIFICATIONS_ENABLED:
+        app.state.background_tasks.append(
+            asyncio.create_task(
+                get_notification_bus().listen(user_caches.evict, user_caches.clear)
+            )
+        )
+    app.state.ready = True
+
+
+@app.on_event("shutdown")
+async def shutdown() -> None:
+    """Stops taking traffic and background jobs, closes every pooled connection"""
+    app.state.ready = False
+    for task in app.state.background_tasks:
+        task.cancel()
+    await asyncio.gather(*app.state.background_tasks, return_exceptions=True)
+    app.state.background_tasks.clear()
+    await engine.dispose()
+    sharded_user_dal = get_sharded_user_dal()
+    if sharded_user_dal is not None:
+        await sharded_user_dal.shards.dispose()
+    if traffic_recorder is not None:
+        traffic_recorder.stop()
+    shutdown_logging()
+
+
 if __name__ == "__main__":
     # run app on the host and port
     uvicorn.run(app, host="0.0.0.0", port=8000)
@@ -1,12 +1,208 @@
+import base64
+import calendar
 import datetime
+import hashlib
+import hmac
+import json
+import threading
+import time
+from abc import ABC
+from abc import abstractmethod
+from collections import OrderedDict
 from datetime import timedelta
 from typing import Optional
+from typing import Tuple
 
 from jose import jwt
+from jose import JWTError
 
 import settings
 
 
+class TokenError(Exception):
+    """Токен не прошел проверку: подпись, формат или срок действия"""
+
+
+class JWTCodec(ABC):
+    """Создание и проверка jwt-токенов, реализацию можно заменить через JWT_CODEC"""
+
+    @abstractmethod
+    def encode(self, claims: dict) -> str:
+        """Подписанный токен с переданными claims"""
+
+    @abstractmethod
+    def decode(self, token: str) -> dict:
+        """Claims проверенного токена, TokenError если токен не прошел проверку"""
+
+
+class JoseJWTCodec(JWTCodec):
+    def __init__(self, secret_key: str, algorithm: str):
+        self.secret_key = secret_key
+        self.algorithm = algorithm
+
+    def encode(self, claims: dict) -> str:
+        return jwt.encode(claims, self.secret_key, self.algorithm)
+
+    def decode(self, token: str) -> dict:
+        try:
+            return jwt.decode(token, self.secret_key, self.algorithm)
+        except JWTError as err:
+            raise TokenError(str(err)) from err
+
+
+def _b64encode(data: bytes) -> bytes:
+    return base64.urlsafe_b64encode(data).rstrip(b"=")
+
+
+def _b64decode(data: bytes) -> bytes:
+    return base64.urlsafe_b64decode(data + b"=" * (-len(data) % 4))
+
+
+class HmacJWTCodec(JWTCodec):
+    """
+    HS256/HS384/HS512 на стандартной библиотеке, без разбора ключей и
+    алгоритмов jose. Токены совместимы с JoseJWTCodec в обе стороны.
+    """
+
+    _DIGESTS = {
+        "HS256": hashlib.sha256,
+        "HS384": hashlib.sha384,
+        "HS512": hashlib.sha512,
+    }
+
+    def __init__(self, secret_key: str, algorithm: str):
+        if algorithm not in self._DIGESTS:
+            raise ValueError(f"HmacJWTCodec does not support {algorithm}")
+        self.secret_key = secret_key.encode()
+        self.algorithm = algorithm
+        self.digest = self._DIGESTS[algorithm]
+        self._header = _b64encode(
+            json.dumps({"alg": algorithm, "typ": "JWT"}, separators=(",", ":")).encode()
+        )
+
+    def _sign(self, signing_input: bytes) -> bytes:
+        return hmac.new(self.secret_key, signing_input, self.digest).digest()
+
+    def encode(self, claims: dict) -> str:
+        claims = {
+            name: calendar.timegm(value.utctimetuple())
+            if isinstance(value, datetime.datetime)
+            else value
+            for name, value in claims.items()
+        }
+        payload = _b64encode(json.dumps(claims, separators=(",", ":")).encode())
+        signing_input = self._header + b"." + payload
+        return (signing_input + b"." + _b64encode(self._sign(signing_input))).decode()
+
+    def decode(self, token: str) -> dict:
+        try:
+            signing_input, _, signature = token.encode().rpartition(b".")
+            header, _, payload = signing_input.partition(b".")
+            # алгоритм задаем мы, а не заголовок токена
+            if json.loads(_b64decode(header)).get("alg") != self.algorithm:
+                raise TokenError("Unexpected algorithm")
+            if not hmac.compare_digest(
+                _b64decode(signature), self._sign(signing_input)
+            ):
+                raise TokenError("Signature verification failed")
+            claims = json.loads(_b64decode(payload))
+        except (ValueError, AttributeError, UnicodeError) as err:
+            raise TokenError("Invalid token") from err
+        if not isinstance(claims, dict):
+            raise TokenError("Invalid payload")
+
+        now = time.time()
+        if "exp" in claims and not (
+            isinstance(claims["exp"], (int, float)) and now < claims["exp"]
+        ):
+            raise TokenError("Signature has expired")
+        if "nbf" in claims and not (
+            isinstance(claims["nbf"], (int, float)) and now >= claims["nbf"]
+        ):
+            raise TokenError("The token is not yet valid")
+        return claims
+
+
+JWT_CODECS = {"jose": JoseJWTCodec, "hmac": HmacJWTCodec}
+
+_jwt_codec: Optional[JWTCodec] = None
+
+
+def get_jwt_codec() -> JWTCodec:
+    global _jwt_codec
+    if _jwt_codec is None:
+        _jwt_codec = JWT_CODECS[settings.JWT_CODEC](
+            settings.SECRET_KEY, settings.ALGORITHM
+        )
+    return _jwt_codec
+
+
+def set_jwt_codec(codec: Optional[JWTCodec]) -> None:
+    global _jwt_codec
+    _jwt_codec = codec
+
+
+class VerifiedTokenCache:
+    """
+    Claims уже проверенных токенов по sha256 токена, до их exp,
+    но не дольше max_ttl (чтобы смена ключа вступала в силу).
+    Самые старые записи вытесняются сверх max_size.
+    """
+
+    def __init__(self, max_size: int, max_ttl: float):
+        self.max_size = max_size
+        self.max_ttl = max_ttl
+        self._lock = threading.Lock()
+        self._claims: "OrderedDict[bytes, Tuple[float, dict]]" = OrderedDict()
+
+    @staticmethod
+    def _key(token: str) -> bytes:
+        return hashlib.sha256(token.encode()).digest()
+
+    def get(self, token: str) -> Optional[dict]:
+        key = self._key(token)
+        with self._lock:
+            expires_at, claims = self._claims.get(key, (0.0, None))
+            if claims is None:
+                return
+            if time.time() >= expires_at:
+                del self._claims[key]
+                return
+            self._claims.move_to_end(key)
+        return dict(claims)
+
+    def put(self, token: str, claims: dict) -> None:
+        expires_at = time.time() + self.max_ttl
+        exp = claims.get("exp")
+        if isinstance(exp, (int, float)):
+            expires_at = min(expires_at, exp)
+        key = self._key(token)
+        with self._lock:
+            self._claims[key] = (expires_at, dict(claims))
+            self._claims.move_to_end(key)
+            while len(self._claims) > self.max_size:
+                self._claims.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._claims.clear()
+
+
+verified_tokens = VerifiedTokenCache(
+    max_size=settings.JWT_CACHE_SIZE, max_ttl=settings.JWT_CACHE_MAX_TTL_SECONDS
+)
+
+
+def decode_access_token(token: str) -> dict:
+    """Claims токена: из кэша проверенных или после полной проверки"""
+    claims = verified_tokens.get(token)
+    if claims is None:
+        claims = get_jwt_codec().decode(token)
+        if settings.JWT_CACHE_SIZE > 0:
+            verified_tokens.put(token, claims)
+    return claims
+
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     """Универсальная функция для создания jwt-токена"""
     to_encode = data.copy()
@@ -18,6 +214,12 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
         )
 
     to_encode.update({"exp": expire})
-    encoded_jwt = jwt.encode(to_encode, settings.SECRET_KEY, settings.ALGORITHM)
+    encoded_jwt = get_jwt_codec().encode(to_encode)
 
     return encoded_jwt
+
+
+def warm_up_jwt() -> None:
+    """Прогоняет создание и проверку токена, чтобы не делать этого в первом запросе"""
+    token = create_access_token(data={"sub": "warm-up"})
+    get_jwt_codec().decode(token)
@@ -11,12 +11,24 @@ from sqlalchemy.orm import sessionmaker
 from starlette.testclient import TestClient
 
 import settings
+from api.health import db_ping_cache
+from db import notifications
+from db.models import Base
+from db.notifications import InMemoryNotificationBus
+from db.notifications import user_caches
+from db.query_stats import install_query_hooks
 from db.session import get_db
+from db.session import UnitOfWork
+from db.sharding import set_sharded_user_dal
+from db.sharding import ShardedUserDAL
+from db.sharding import UserShards
 from main import app
 
 
 CLEAN_TABLES = [
     "users",
+    "user_stats",
+    "user_email_index",
 ]
 
 
@@ -37,6 +49,8 @@ async def run_migrations():
 @pytest.fixture(scope="session")
 async def async_session_test():
     engine = create_async_engine(settings.TEST_DATABASE_URL, future=True, echo=True)
+    # statements of the tests are seen by capture_statements()
+    install_query_hooks(engine.sync_engine, settings.SLOW_QUERY_MS)
     async_session = sessionmaker(engine, expire_on_commit=False, class_=AsyncSession)
     yield async_session
 
@@ -50,34 +64,106 @@ async def clean_tables(async_session_test):
                 await session.execute(f"""TRUNCATE TABLE {table_for_cleaning};""")
 
 
+@pytest.fixture(scope="function", autouse=True)
+def clear_user_caches():
+    """Users cached by an earlier test are gone with the cleaned tables"""
+    user_caches.clear()
+    db_ping_cache.clear()
+
+
 async def _get_test_db():
     try:
         # create async engine for interaction with database
         test_engine = create_async_engine(
             settings.TEST_DATABASE_URL, future=True, echo=True
         )
+        install_query_hooks(test_engine.sync_engine, settings.SLOW_QUERY_MS)
 
         # create session for the interaction with database
         test_async_session = sessionmaker(
             test_engine, expire_on_commit=False, class_=AsyncSession
         )
-        yield test_async_session()
+        yield UnitOfWork(test_async_session)
     finally:
         pass
 
 
 @pytest.fixture(scope="function")
-async def client() -> Generator[TestClient, Any, None]:
+async def client(monkeypatch) -> Generator[TestClient, Any, None]:
     """
     Create a new FastAPI TestClient that uses the `db_session` fixture to override
     the `get_db` dependency that is injected into routes.
     """
 
+    # startup warm-up would connect to the real database, not the test one
+    monkeypatch.setattr(settings, "DB_POOL_WARM_CONNECTIONS", 0)
+    monkeypatch.setattr(settings, "USER_STATS_RECONCILE_SECONDS", 0)
+    monkeypatch.setattr(settings, "QUERY_STATS_HEADERS", True)
+    # calibration takes a few verifies on every startup, tests keep the defaults
+    monkeypatch.setattr(settings, "PASSWORD_HASH_TARGET_MS", 0)
+    monkeypatch.setattr(notifications, "_bus", InMemoryNotificationBus())
     app.dependency_overrides[get_db] = _get_test_db
     with TestClient(app) as client:
         yield client
 
 
+def _asyncpg_dsn(url: str) -> str:
+    return "".join(url.split("+asyncpg"))
+
+
+@pytest.fixture(scope="session")
+async def pg_trgm():
+    """Search needs pg_trgm, its tests are skipped where Postgres has no contrib"""
+    connection = await asyncpg.connect(_asyncpg_dsn(settings.TEST_DATABASE_URL))
+    try:
+        available = await connection.fetchval(
+            "SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm'"
+        )
+        if available is None:
+            pytest.skip("pg_trgm is not available")
+        await connection.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm;")
+    finally:
+        await connection.close()
+
+
+@pytest.fixture(scope="session")
+async def shard_databases():
+    """Databases of TEST_USER_SHARD_URLS next to the test one, with the users schema"""
+    connection = await asyncpg.connect(_asyncpg_dsn(settings.TEST_DATABASE_URL))
+    for url in settings.TEST_USER_SHARD_URLS:
+        database = url.rsplit("/", 1)[1]
+        exists = await connection.fetchval(
+            "SELECT 1 FROM pg_database WHERE datname = $1", database
+        )
+        if not exists:
+            await connection.execute(f'CREATE DATABASE "{database}"')
+    await connection.close()
+
+    for url in settings.TEST_USER_SHARD_URLS:
+        engine = create_async_engine(url, future=True)
+        async with engine.begin() as shard_connection:
+            await shard_connection.run_sync(Base.metadata.create_all)
+        await engine.dispose()
+    return settings.TEST_USER_SHARD_URLS
+
+
+@pytest.fixture(scope="function")
+async def sharded_user_dal(shard_databases):
+    """
+    Users sharded over the shard databases, the email index in the test database.
+    Request it before `client`: the app disposes the shard engines on shutdown.
+    """
+    for url in shard_databases:
+        connection = await asyncpg.connect(_asyncpg_dsn(url))
+        await connection.execute("TRUNCATE TABLE users, user_stats;")
+        await connection.close()
+
+    user_dal = ShardedUserDAL(UserShards(shard_databases, settings.TEST_DATABASE_URL))
+    set_sharded_user_dal(user_dal)
+    yield user_dal
+    set_sharded_user_dal(None)
+
+
 @pytest.fixture(scope="session")
 async def asyncpg_pool():
     pool = await asyncpg.create_pool(
@@ -101,16 +187,36 @@ async def get_user_from_database(asyncpg_pool):
 @pytest.fixture
 async def create_user_in_database(asyncpg_pool):
     async def create_user_in_database(
-        user_id: str, name: str, surname: str, email: str, is_active: bool
+        user_id: str,
+        name: str,
+        surname: str,
+        email: str,
+        is_active: bool,
+        hashed_password: str = "hashed_password",
     ):
         async with asyncpg_pool.acquire() as connection:
             return await connection.execute(
-                """INSERT INTO users VALUES ($1, $2, $3, $4, $5);""",
+                """INSERT INTO users (user_id, name, surname, email, is_active, hashed_password)
+                VALUES ($1, $2, $3, $4, $5, $6);""",
                 user_id,
                 name,
                 surname,
                 email,
                 is_active,
+                hashed_password,
             )
 
     return create_user_in_database
+
+
+@pytest.fixture
+def assert_max_queries():
+    """Checks the number of SQL queries a response was served with"""
+
+    def assert_max_queries(response, max_queries: int):
+        queries = int(response.headers["X-Query-Count"])
+        assert (
+            queries <= max_queries
+        ), f"{queries} queries run, at most {max_queries} expected"
+
+    return assert_max_queries
@@ -0,0 +1,177 @@
+import asyncio
+import time
+import uuid
+
+import pytest
+from sqlalchemy import text
+from sqlalchemy.exc import DBAPIError
+
+import settings
+from db.dals import UserDAL
+from db.deadlines import current_deadline
+from db.deadlines import DeadlineExceeded
+from db.deadlines import DeadlineMiddleware
+from db.deadlines import QUERY_CANCELED_SQLSTATE
+from db.deadlines import request_budget_ms
+from db.loaders import UserLoader
+from db.write_batcher import UserWriteBatcher
+
+
+def _scope(path="/user/", headers=()):
+    return {"type": "http", "method": "GET", "path": path, "headers": list(headers)}
+
+
+def test_request_budget_ms(monkeypatch):
+    monkeypatch.setattr(settings, "REQUEST_TIMEOUT_MS", 1000)
+    monkeypatch.setattr(settings, "REQUEST_TIMEOUT_MS_BY_ROUTE", {"GET /slow": 5000})
+
+    assert request_budget_ms(_scope()) == 1000
+    assert request_budget_ms(_scope("/slow")) == 5000
+    # the client may shorten the budget only
+    assert request_budget_ms(_scope(headers=[(b"x-request-timeout-ms", b"200")])) == 200
+    assert (
+        request_budget_ms(_scope(headers=[(b"x-request-timeout-ms", b"9000")])) == 1000
+    )
+    assert (
+        request_budget_ms(_scope(headers=[(b"x-request-timeout-ms", b"oops")])) == 1000
+    )
+
+
+async def test_statement_timeout_follows_deadline(async_session_test):
+    token = current_deadline.set(time.monotonic() + 0.2)
+    try:
+        async with async_session_test() as session:
+            async with session.begin():
+                timeout = (
+                    await session.execute(text("SHOW statement_timeout"))
+                ).scalar()
+                assert 0 < int(timeout.rstrip("ms")) <= 200
+
+                with pytest.raises(DBAPIError) as exc_info:
+                    await session.execute(text("SELECT pg_sleep(1)"))
+        assert exc_info.value.orig.sqlstate == QUERY_CANCELED_SQLSTATE
+    finally:
+        current_deadline.reset(token)
+
+
+async def test_expired_deadline_does_not_begin(async_session_test):
+    token = current_deadline.set(time.monotonic() - 1)
+    try:
+        async with async_session_test() as session:
+            with pytest.raises(DeadlineExceeded):
+                async with session.begin():
+                    await session.execute(text("SELECT 1"))
+    finally:
+        current_deadline.reset(token)
+
+
+async def _run(app, messages, headers=()):
+    sent = []
+
+    async def receive():
+        return await messages.get()
+
+    async def send(message):
+        sent.append(message)
+
+    await DeadlineMiddleware(app)(_scope(headers=headers), receive, send)
+    return sent
+
+
+async def test_request_cancelled_on_deadline(monkeypatch):
+    monkeypatch.setattr(settings, "REQUEST_TIMEOUT_MS", 50)
+    cancelled = asyncio.Event()
+
+    async def app(scope, receive, send):
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+
+    sent = await _run(app, asyncio.Queue())
+    assert cancelled.is_set()
+    assert sent[0]["status"] == 504
+
+
+async def test_request_cancelled_on_disconnect(monkeypatch):
+    monkeypatch.setattr(settings, "REQUEST_TIMEOUT_MS", 10_000)
+    cancelled = asyncio.Event()
+
+    async def app(scope, receive, send):
+        await receive()
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+
+    messages = asyncio.Queue()
+    messages.put_nowait({"type": "http.request", "body": b"", "more_body": False})
+    messages.put_nowait({"type": "http.disconnect"})
+    started_at = time.monotonic()
+    sent = await _run(app, messages)
+    assert time.monotonic() - started_at < 1
+    assert cancelled.is_set()
+    assert sent == []
+
+
+async def _respond(send, body: str) -> None:
+    await send({"type": "http.response.start", "status": 200, "headers": []})
+    await send({"type": "http.response.body", "body": body.encode()})
+
+
+async def _run_impatient_and_patient(app):
+    """A request with 1 ms starts the shared work, one with the full budget joins it"""
+    return await asyncio.gather(
+        _run(app, asyncio.Queue(), headers=[(b"x-request-timeout-ms", b"1")]),
+        _run(app, asyncio.Queue()),
+    )
+
+
+async def test_batched_lookup_ignores_deadline_of_its_caller(
+    async_session_test, monkeypatch
+):
+    monkeypatch.setattr(settings, "REQUEST_TIMEOUT_MS", 10_000)
+    async with async_session_test() as session:
+        async with session.begin():
+            user = await UserDAL(session).create_user(
+                name="Lenny",
+                surname="Kravec",
+                email="kravec@yandex.ru",
+                hashed_password="hash",
+            )
+    # the batch begins its transaction after the 1 ms are gone
+    loader = UserLoader(async_session_test, max_delay_us=20_000)
+
+    async def app(scope, receive, send):
+        found = await loader.by_id.load(user.user_id)
+        await _respond(send, str(found.user_id))
+
+    impatient, patient = await _run_impatient_and_patient(app)
+    assert impatient[0]["status"] == 504
+    assert patient[0]["status"] == 200
+    assert patient[1]["body"] == str(user.user_id).encode()
+
+
+async def test_batched_insert_ignores_deadline_of_its_caller(
+    async_session_test, get_user_from_database, monkeypatch
+):
+    monkeypatch.setattr(settings, "REQUEST_TIMEOUT_MS", 10_000)
+    batcher = UserWriteBatcher(async_session_test, max_delay_ms=20)
+    emails = iter(["kravec@yandex.ru", "lenny@yandex.ru"])
+
+    async def app(scope, receive, send):
+        created = await batcher.create_user(
+            name="Lenny",
+            surname="Kravec",
+            email=next(emails),
+            hashed_password="hash",
+        )
+        await _respond(send, str(created.user_id))
+
+    impatient, patient = await _run_impatient_and_patient(app)
+    assert impatient[0]["status"] == 504
+    assert patient[0]["status"] == 200
+    user_id = patient[1]["body"].decode()
+    assert len(await get_user_from_database(uuid.UUID(user_id))) == 1
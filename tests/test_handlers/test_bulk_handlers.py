@@ -0,0 +1,258 @@
+import json
+import uuid
+
+import settings
+
+
+async def _create_users(
+    create_user_in_database, count: int, is_active=True, login="kravec"
+):
+    user_ids = [uuid.uuid4() for _ in range(count)]
+    for number, user_id in enumerate(user_ids):
+        await create_user_in_database(
+            user_id, "Lenny", "Kravec", f"{login}{number}@yandex.ru", is_active
+        )
+    return user_ids
+
+
+async def test_bulk_deactivate(
+    client, create_user_in_database, get_user_from_database, assert_max_queries
+):
+    user_ids = await _create_users(create_user_in_database, 3)
+    inactive_user_id = (
+        await _create_users(
+            create_user_in_database, 1, is_active=False, login="inactive"
+        )
+    )[0]
+    missing_user_id = uuid.uuid4()
+
+    request_ids = user_ids + [inactive_user_id, missing_user_id, user_ids[0]]
+    resp = client.post(
+        "/user/bulk-deactivate",
+        data=json.dumps({"user_ids": [str(user_id) for user_id in request_ids]}),
+    )
+    assert resp.status_code == 200
+    assert resp.json()["results"] == [
+        {"user_id": str(user_id), "status": "deactivated"} for user_id in user_ids
+    ] + [
+        {"user_id": str(inactive_user_id), "status": "not_found"},
+        {"user_id": str(missing_user_id), "status": "not_found"},
+    ]
+    # statement_timeout, the update, stats bump and notifications
+    assert_max_queries(resp, 4)
+
+    for user_id in user_ids:
+        users_from_db = await get_user_from_database(user_id)
+        assert users_from_db[0]["is_active"] is False
+
+
+async def test_bulk_deactivate_in_chunks(client, get_user_from_database, monkeypatch):
+    monkeypatch.setattr(settings, "USER_BULK_CHUNK_SIZE", 2)
+    # created through the API, so the stats count them
+    user_ids = []
+    for number in range(5):
+        resp = client.post(
+            "/user/",
+            data=json.dumps(
+                {
+                    "name": "Lenny",
+                    "surname": "Kravec",
+                    "email": f"kravec{number}@yandex.ru",
+                    "password": "password",
+                }
+            ),
+        )
+        assert resp.status_code == 200
+        user_ids.append(resp.json()["user_id"])
+
+    resp = client.post("/user/bulk-deactivate", data=json.dumps({"user_ids": user_ids}))
+    assert resp.status_code == 200
+    assert {result["status"] for result in resp.json()["results"]} == {"deactivated"}
+    for user_id in user_ids:
+        users_from_db = await get_user_from_database(uuid.UUID(user_id))
+        assert users_from_db[0]["is_active"] is False
+
+    resp = client.get("/user/stats")
+    assert resp.json() == {"total": 5, "active": 0, "deactivated": 5}
+
+
+async def test_bulk_deactivate_stops_at_failed_chunk(
+    client, create_user_in_database, get_user_from_database, asyncpg_pool, monkeypatch
+):
+    monkeypatch.setattr(settings, "USER_BULK_CHUNK_SIZE", 2)
+    user_ids = await _create_users(create_user_in_database, 5)
+    # the second chunk fails in the database
+    await asyncpg_pool.execute(
+        f"""
+        CREATE FUNCTION fail_update() RETURNS trigger AS $$
+        BEGIN RAISE EXCEPTION 'no updates of this user'; END $$ LANGUAGE plpgsql;
+        CREATE TRIGGER fail_update BEFORE UPDATE ON users FOR EACH ROW
+        WHEN (OLD.user_id = '{user_ids[2]}') EXECUTE FUNCTION fail_update();
+        """
+    )
+    try:
+        resp = client.post(
+            "/user/bulk-deactivate",
+            data=json.dumps({"user_ids": [str(user_id) for user_id in user_ids]}),
+        )
+    finally:
+        await asyncpg_pool.execute(
+            "DROP TRIGGER fail_update ON users; DROP FUNCTION fail_update();"
+        )
+
+    assert resp.status_code == 200
+    assert [result["status"] for result in resp.json()["results"]] == [
+        "deactivated",
+        "deactivated",
+        "error",
+        "error",
+        "error",
+    ]
+    for user_id, is_active in zip(user_ids, [False, False, True, True, True]):
+        users_from_db = await get_user_from_database(user_id)
+        assert users_from_db[0]["is_active"] is is_active
+
+
+async def test_bulk_update(
+    client, create_user_in_database, get_user_from_database, assert_max_queries
+):
+    user_ids = await _create_users(create_user_in_database, 2)
+    missing_user_id = uuid.uuid4()
+
+    resp = client.patch(
+        "/user/bulk",
+        data=json.dumps(
+            {
+                "users": [
+                    {"user_id": str(user_ids[0]), "name": "Ivan"},
+                    {
+                        "user_id": str(user_ids[1]),
+                        "surname": "Ivanov",
+                        "email": "ivanov@yandex.ru",
+                    },
+                    {"user_id": str(missing_user_id), "name": "Petr"},
+                ]
+            }
+        ),
+    )
+    assert resp.status_code == 200
+    assert resp.json()["results"] == [
+        {"user_id": str(user_ids[0]), "status": "updated"},
+        {"user_id": str(user_ids[1]), "status": "updated"},
+        {"user_id": str(missing_user_id), "status": "not_found"},
+    ]
+    # statement_timeout, the update and notifications
+    assert_max_queries(resp, 3)
+
+    first_user = dict((await get_user_from_database(user_ids[0]))[0])
+    assert (first_user["name"], first_user["surname"], first_user["email"]) == (
+        "Ivan",
+        "Kravec",
+        "kravec0@yandex.ru",
+    )
+    second_user = dict((await get_user_from_database(user_ids[1]))[0])
+    assert (second_user["name"], second_user["surname"], second_user["email"]) == (
+        "Lenny",
+        "Ivanov",
+        "ivanov@yandex.ru",
+    )
+
+
+async def test_bulk_update_merges_items_of_a_user(
+    client, create_user_in_database, get_user_from_database
+):
+    user_id = (await _create_users(create_user_in_database, 1))[0]
+
+    resp = client.patch(
+        "/user/bulk",
+        data=json.dumps(
+            {
+                "users": [
+                    {"user_id": str(user_id), "name": "Ivan", "surname": "Petrov"},
+                    {"user_id": str(user_id), "surname": "Ivanov"},
+                ]
+            }
+        ),
+    )
+    assert resp.status_code == 200
+    assert resp.json()["results"] == [{"user_id": str(user_id), "status": "updated"}]
+    user = dict((await get_user_from_database(user_id))[0])
+    assert (user["name"], user["surname"]) == ("Ivan", "Ivanov")
+
+
+async def test_bulk_update_taken_email(
+    client, create_user_in_database, get_user_from_database
+):
+    user_ids = await _create_users(create_user_in_database, 3)
+
+    resp = client.patch(
+        "/user/bulk",
+        data=json.dumps(
+            {
+                "users": [
+                    {"user_id": str(user_ids[0]), "name": "Ivan"},
+                    {"user_id": str(user_ids[1]), "email": "kravec2@yandex.ru"},
+                ]
+            }
+        ),
+    )
+    assert resp.status_code == 200
+    assert resp.json()["results"] == [
+        {"user_id": str(user_ids[0]), "status": "updated"},
+        {"user_id": str(user_ids[1]), "status": "email_taken"},
+    ]
+    assert (await get_user_from_database(user_ids[0]))[0]["name"] == "Ivan"
+    assert (await get_user_from_database(user_ids[1]))[0][
+        "email"
+    ] == "kravec1@yandex.ru"
+
+
+async def test_bulk_update_validation_error(client):
+    resp = client.patch(
+        "/user/bulk", data=json.dumps({"users": [{"user_id": str(uuid.uuid4())}]})
+    )
+    assert resp.status_code == 422
+
+    user_id = str(uuid.uuid4())
+    resp = client.patch(
+        "/user/bulk",
+        data=json.dumps(
+            {
+                "users": [
+                    {"user_id": user_id, "name": "123"},
+                    {"user_id": user_id, "name": "Ivan"},
+                    {"user_id": "42", "surname": "", "email": "lol"},
+                ]
+            }
+        ),
+    )
+    assert resp.status_code == 422
+    # errors of all items at once
+    assert resp.json() == {
+        "detail": [
+            {
+                "loc": ["body", "users", 0, "name"],
+                "msg": "Name should contains only letters!",
+                "type": "value_error.letters",
+            },
+            {
+                "loc": ["body", "users", 2, "user_id"],
+                "msg": "value is not a valid uuid",
+                "type": "type_error.uuid",
+            },
+            {
+                "loc": ["body", "users", 2, "surname"],
+                "msg": "ensure this value has at least 1 characters",
+                "type": "value_error.any_str.min_length",
+                "ctx": {"limit_value": 1},
+            },
+            {
+                "loc": ["body", "users", 2, "email"],
+                "msg": "value is not a valid email address",
+                "type": "value_error.email",
+            },
+        ]
+    }
+
+    resp = client.post("/user/bulk-deactivate", data=json.dumps({"user_ids": []}))
+    assert resp.status_code == 422
@@ -0,0 +1,137 @@
+import json
+import uuid
+
+
+async def test_get_user_changes(client, create_user_in_database):
+    user_ids = [uuid.uuid4() for _ in range(3)]
+    for number, user_id in enumerate(user_ids):
+        await create_user_in_database(
+            user_id=user_id,
+            name="Ivan",
+            surname="Ivanov",
+            email=f"ivan{number}@kek.com",
+            is_active=True,
+        )
+
+    resp = client.get("/user/changes")
+    assert resp.status_code == 200
+    data_from_resp = resp.json()
+    assert [change["user_id"] for change in data_from_resp["changes"]] == [
+        str(user_id) for user_id in user_ids
+    ]
+    cursor = data_from_resp["next_cursor"]
+    assert cursor == data_from_resp["changes"][-1]["change_seq"]
+
+    # nothing changed since the cursor
+    resp = client.get(f"/user/changes?since={cursor}")
+    assert resp.json() == {
+        "changes": [],
+        "next_cursor": cursor,
+        "next_shard_cursor": None,
+        "stalled": False,
+        "retry_after": None,
+    }
+
+    client.patch(f"/user/?user_id={user_ids[0]}", data=json.dumps({"name": "Petr"}))
+    client.delete(f"/user/?user_id={user_ids[1]}")
+
+    resp = client.get(f"/user/changes?since={cursor}")
+    changes = resp.json()["changes"]
+    assert [change["user_id"] for change in changes] == [
+        str(user_ids[0]),
+        str(user_ids[1]),
+    ]
+    assert changes[0]["name"] == "Petr"
+    assert changes[0]["is_active"] is True
+    assert changes[1]["is_active"] is False
+    assert changes[0]["change_seq"] > cursor
+
+
+async def test_get_user_changes_limit(client, create_user_in_database):
+    for number in range(3):
+        await create_user_in_database(
+            user_id=uuid.uuid4(),
+            name="Ivan",
+            surname="Ivanov",
+            email=f"ivan{number}@kek.com",
+            is_active=True,
+        )
+
+    resp = client.get("/user/changes?limit=2")
+    data_from_resp = resp.json()
+    assert len(data_from_resp["changes"]) == 2
+
+    resp = client.get(f"/user/changes?since={data_from_resp['next_cursor']}")
+    assert len(resp.json()["changes"]) == 1
+
+
+async def test_get_user_changes_waits_for_running_transactions(
+    client, asyncpg_pool, create_user_in_database
+):
+    user_ids = [uuid.uuid4() for _ in range(2)]
+    for number, user_id in enumerate(user_ids):
+        await create_user_in_database(
+            user_id=user_id,
+            name="Ivan",
+            surname="Ivanov",
+            email=f"ivan{number}@kek.com",
+            is_active=True,
+        )
+    cursor = client.get("/user/changes").json()["next_cursor"]
+    touch_user = """
+        UPDATE users
+        SET name = 'Petr', change_seq = nextval(pg_get_serial_sequence('users', 'change_seq'))
+        WHERE user_id = $1
+    """
+
+    async with asyncpg_pool.acquire() as first, asyncpg_pool.acquire() as second:
+        first_transaction = first.transaction()
+        await first_transaction.start()
+        # the first user gets the lower sequence number, but commits last
+        await first.execute(touch_user, user_ids[0])
+        await second.execute(touch_user, user_ids[1])
+
+        resp = client.get(f"/user/changes?since={cursor}")
+        assert resp.json() == {
+            "changes": [],
+            "next_cursor": cursor,
+            "next_shard_cursor": None,
+            "stalled": True,
+            "retry_after": 1,
+        }
+
+        await first_transaction.commit()
+
+    resp = client.get(f"/user/changes?since={cursor}")
+    assert [change["user_id"] for change in resp.json()["changes"]] == [
+        str(user_id) for user_id in user_ids
+    ]
+
+
+async def test_get_user_changes_ignores_transactions_without_users(
+    client, asyncpg_pool, create_user_in_database
+):
+    cursor = client.get("/user/changes").json()["next_cursor"]
+
+    async with asyncpg_pool.acquire() as idle:
+        # an idle in transaction session that holds a transaction id
+        idle_transaction = idle.transaction()
+        await idle_transaction.start()
+        await idle.execute("SELECT pg_current_xact_id()")
+
+        user_id = uuid.uuid4()
+        await create_user_in_database(
+            user_id=user_id,
+            name="Ivan",
+            surname="Ivanov",
+            email="ivan@kek.com",
+            is_active=True,
+        )
+        resp = client.get(f"/user/changes?since={cursor}")
+        data_from_resp = resp.json()
+        assert [change["user_id"] for change in data_from_resp["changes"]] == [
+            str(user_id)
+        ]
+        assert data_from_resp["stalled"] is False
+
+        await idle_transaction.rollback()
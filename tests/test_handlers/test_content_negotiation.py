@@ -0,0 +1,70 @@
+import gzip
+import uuid
+
+import brotli
+import msgpack
+import pytest
+
+
+async def test_get_user_as_msgpack(client, create_user_in_database):
+    user_data = {
+        "user_id": uuid.uuid4(),
+        "name": "Lenny",
+        "surname": "Kravec",
+        "email": "kravec@yandex.ru",
+        "is_active": True,
+    }
+    await create_user_in_database(**user_data)
+
+    resp = client.get(
+        f"/user/?user_id={user_data['user_id']}",
+        headers={"Accept": "application/msgpack"},
+    )
+    assert resp.status_code == 200
+    assert resp.headers["content-type"] == "application/msgpack"
+    assert "Accept" in resp.headers["vary"]
+    assert msgpack.unpackb(resp.content) == {
+        "user_id": str(user_data["user_id"]),
+        "name": "Lenny",
+        "surname": "Kravec",
+        "email": "kravec@yandex.ru",
+        "is_active": True,
+    }
+
+    resp = client.get(
+        f"/user/?user_id={user_data['user_id']}",
+        headers={"Accept": "application/json, application/msgpack;q=0.5"},
+    )
+    assert resp.headers["content-type"] == "application/json"
+    assert resp.json()["name"] == "Lenny"
+
+
+@pytest.mark.parametrize(
+    "encoding, decompress", [("gzip", gzip.decompress), ("br", brotli.decompress)]
+)
+async def test_large_responses_are_compressed(
+    client, create_user_in_database, encoding, decompress
+):
+    for number in range(20):
+        await create_user_in_database(
+            user_id=uuid.uuid4(),
+            name="Ivan",
+            surname="Ivanov",
+            email=f"ivan{number}@kek.com",
+            is_active=True,
+        )
+
+    with client.stream(
+        "GET", "/user/changes", headers={"Accept-Encoding": encoding}
+    ) as resp:
+        assert resp.status_code == 200
+        assert resp.headers["content-encoding"] == encoding
+        raw = b"".join(resp.iter_raw())
+    assert len(raw) < len(decompress(raw))
+    assert b'"ivan19@kek.com"' in decompress(raw)
+
+
+async def test_small_responses_are_not_compressed(client):
+    resp = client.get("/user/stats", headers={"Accept-Encoding": "gzip, br"})
+    assert resp.status_code == 200
+    assert "content-encoding" not in resp.headers
@@ -1,6 +1,14 @@
 import json
 
 import pytest
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import NullPool
+
+import settings
+from api import handlers
+from db.write_batcher import UserWriteBatcher
 
 
 async def test_create_user(client, get_user_from_database):
@@ -60,6 +68,37 @@ async def test_create_user_duplicate_email_error(client, get_user_from_database)
     )
 
 
+async def test_create_user_duplicate_email_error_with_batched_writes(
+    client, monkeypatch
+):
+    monkeypatch.setattr(settings, "USER_WRITE_BATCHER_ENABLED", True)
+    # connections are opened on the loop of the client, none is kept after the test
+    engine = create_async_engine(settings.TEST_DATABASE_URL, poolclass=NullPool)
+    monkeypatch.setattr(
+        handlers,
+        "user_write_batcher",
+        UserWriteBatcher(
+            sessionmaker(engine, expire_on_commit=False, class_=AsyncSession)
+        ),
+    )
+    user_data = {
+        "name": "Lenny",
+        "surname": "Kravec",
+        "email": "kravec@yandex.ru",
+        "password": "password",
+    }
+
+    response = client.post("/user/", data=json.dumps(user_data))
+    assert response.status_code == 200
+
+    response = client.post("/user/", data=json.dumps(user_data))
+    assert response.status_code == 503
+    assert (
+        'duplicate key value violates unique constraint "users_email_key"'
+        in response.json()["detail"]
+    )
+
+
 @pytest.mark.parametrize(
     "user_data_for_creation, expected_status_code, expected_detail",
     [
@@ -0,0 +1,106 @@
+import asyncio
+import json
+import uuid
+
+from api.idempotency import IdempotencyMiddleware
+from api.idempotency import InMemoryIdempotencyStore
+
+
+async def test_create_user_retry_gets_first_response(client, get_user_from_database):
+    user_data = {
+        "name": "Lenny",
+        "surname": "Kravec",
+        "email": "kravec@yandex.ru",
+        "password": "password",
+    }
+    headers = {"Idempotency-Key": str(uuid.uuid4())}
+
+    resp = client.post("/user/", data=json.dumps(user_data), headers=headers)
+    assert resp.status_code == 200
+    assert "idempotent-replayed" not in resp.headers
+
+    retry_resp = client.post("/user/", data=json.dumps(user_data), headers=headers)
+    assert retry_resp.status_code == 200
+    assert retry_resp.headers["idempotent-replayed"] == "true"
+    assert retry_resp.json() == resp.json()
+
+    users_from_db = await get_user_from_database(resp.json()["user_id"])
+    assert len(users_from_db) == 1
+
+    # without the key the same body is a new request
+    resp = client.post("/user/", data=json.dumps(user_data))
+    assert resp.status_code == 503
+
+
+async def test_idempotency_key_reused_with_another_body(client):
+    headers = {"Idempotency-Key": str(uuid.uuid4())}
+    user_data = {
+        "name": "Lenny",
+        "surname": "Kravec",
+        "email": "kravec@yandex.ru",
+        "password": "password",
+    }
+    resp = client.post("/user/", data=json.dumps(user_data), headers=headers)
+    assert resp.status_code == 200
+
+    user_data["email"] = "lenny@yandex.ru"
+    resp = client.post("/user/", data=json.dumps(user_data), headers=headers)
+    assert resp.status_code == 422
+    assert resp.json() == {
+        "detail": "Idempotency-Key was already used with another request"
+    }
+
+
+async def _call(app, headers):
+    messages = []
+
+    async def receive():
+        return {"type": "http.request", "body": b"{}", "more_body": False}
+
+    async def send(message):
+        messages.append(message)
+
+    scope = {
+        "type": "http",
+        "method": "POST",
+        "path": "/user/",
+        "query_string": b"",
+        "headers": headers,
+    }
+    await app(scope, receive, send)
+    return messages
+
+
+async def test_concurrent_duplicates_wait_for_first_request():
+    calls = 0
+
+    async def slow_app(scope, receive, send):
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.05)
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": str(calls).encode()})
+
+    app = IdempotencyMiddleware(slow_app, store=InMemoryIdempotencyStore())
+    headers = [(b"idempotency-key", b"key")]
+    results = await asyncio.gather(*(_call(app, headers) for _ in range(5)))
+
+    assert calls == 1
+    assert [messages[1]["body"] for messages in results] == [b"1"] * 5
+
+
+async def test_failed_request_is_not_stored():
+    statuses = [500, 200]
+
+    async def flaky_app(scope, receive, send):
+        status = statuses.pop(0)
+        await send({"type": "http.response.start", "status": status, "headers": []})
+        await send({"type": "http.response.body", "body": b""})
+
+    app = IdempotencyMiddleware(flaky_app, store=InMemoryIdempotencyStore())
+    headers = [(b"idempotency-key", b"key")]
+
+    assert (await _call(app, headers))[0]["status"] == 500
+    assert (await _call(app, headers))[0]["status"] == 200
+    assert (await _call(app, headers))[0]["status"] == 200
+    assert statuses == []
@@ -0,0 +1,89 @@
+import uuid
+
+import pytest
+from passlib.hash import bcrypt
+
+from hashing import pwd_context
+
+
+@pytest.fixture
+def calibrated_pwd_context():
+    saved = pwd_context.to_dict()
+    pwd_context.update(bcrypt__default_rounds=5, bcrypt__min_rounds=5)
+    yield pwd_context
+    pwd_context.load(saved)
+
+
+async def test_login_rehashes_outdated_hash(
+    client, create_user_in_database, get_user_from_database, calibrated_pwd_context
+):
+    user_id = uuid.uuid4()
+    outdated_hash = bcrypt.using(rounds=4).hash("password")
+    await create_user_in_database(
+        user_id, "Lenny", "Kravec", "lenny@mail.ru", True, outdated_hash
+    )
+
+    resp = client.post(
+        "/login/token", data={"username": "lenny@mail.ru", "password": "wrong"}
+    )
+    assert resp.status_code == 401
+    users = await get_user_from_database(user_id)
+    assert users[0]["hashed_password"] == outdated_hash
+
+    resp = client.post(
+        "/login/token", data={"username": "lenny@mail.ru", "password": "password"}
+    )
+    assert resp.status_code == 200
+    users = await get_user_from_database(user_id)
+    new_hash = users[0]["hashed_password"]
+    assert new_hash.startswith("$2b$05$")
+    assert bcrypt.verify("password", new_hash)
+
+
+# a stronger hash may come from a worker that measured a higher cost
+@pytest.mark.parametrize("rounds", [5, 6])
+async def test_login_keeps_current_hash(
+    client,
+    create_user_in_database,
+    get_user_from_database,
+    calibrated_pwd_context,
+    rounds,
+):
+    user_id = uuid.uuid4()
+    current_hash = bcrypt.using(rounds=rounds).hash("password")
+    await create_user_in_database(
+        user_id, "Lenny", "Kravec", "lenny@mail.ru", True, current_hash
+    )
+
+    resp = client.post(
+        "/login/token", data={"username": "lenny@mail.ru", "password": "password"}
+    )
+    assert resp.status_code == 200
+    users = await get_user_from_database(user_id)
+    assert users[0]["hashed_password"] == current_hash
+
+
+async def test_auth_endpoint_with_token(client, create_user_in_database):
+    await create_user_in_database(
+        uuid.uuid4(),
+        "Lenny",
+        "Kravec",
+        "lenny@mail.ru",
+        True,
+        bcrypt.using(rounds=4).hash("password"),
+    )
+    resp = client.post(
+        "/login/token", data={"username": "lenny@mail.ru", "password": "password"}
+    )
+    headers = {"Authorization": f"Bearer {resp.json()['access_token']}"}
+
+    # the second request takes the verified token from the cache
+    for _ in range(2):
+        resp = client.get("/login/test_auth_endpoint", headers=headers)
+        assert resp.status_code == 200
+        assert resp.json()["current_user"]["email"] == "lenny@mail.ru"
+
+    resp = client.get(
+        "/login/test_auth_endpoint", headers={"Authorization": "Bearer bad.token.x"}
+    )
+    assert resp.status_code == 401
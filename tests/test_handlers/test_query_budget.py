@@ -0,0 +1,59 @@
+import json
+import uuid
+
+from db.query_stats import normalize_sql
+
+
+def test_normalize_sql():
+    statement = """SELECT users.name
+        FROM users WHERE users.email = 'kravec@yandex.ru' AND users.level > 10"""
+    assert (
+        normalize_sql(statement)
+        == "SELECT users.name FROM users WHERE users.email = ? AND users.level > ?"
+    )
+
+
+async def test_query_stats_headers(client, create_user_in_database):
+    user_id = uuid.uuid4()
+    await create_user_in_database(
+        user_id, "Lenny", "Kravec", "kravec@yandex.ru", is_active=True
+    )
+    resp = client.get(f"/user/?user_id={user_id}")
+    assert resp.status_code == 200
+    # the select only: the shared lookup runs without the request deadline
+    assert resp.headers["X-Query-Count"] == "1"
+    assert resp.headers["Server-Timing"].startswith("db;dur=")
+
+
+async def test_user_endpoints_query_budget(client, assert_max_queries):
+    user_data = {
+        "name": "Lenny",
+        "surname": "Kravec",
+        "email": "kravec@yandex.ru",
+        "password": "password",
+    }
+    resp = client.post("/user/", data=json.dumps(user_data))
+    assert resp.status_code == 200
+    # every transaction starts with SET LOCAL statement_timeout
+    # insert and stats bump
+    assert_max_queries(resp, 3)
+    user_id = resp.json()["user_id"]
+
+    resp = client.get(f"/user/?user_id={user_id}")
+    assert_max_queries(resp, 2)
+
+    resp = client.patch(f"/user/?user_id={user_id}", data=json.dumps({"name": "Ivan"}))
+    assert resp.status_code == 200
+    # existence check and update, in one transaction
+    assert_max_queries(resp, 3)
+
+    resp = client.delete(f"/user/?user_id={user_id}")
+    assert resp.status_code == 200
+    # update and stats bump
+    assert_max_queries(resp, 3)
+
+
+async def test_rejected_request_takes_no_connection(client):
+    resp = client.patch(f"/user/?user_id={uuid.uuid4()}", data=json.dumps({}))
+    assert resp.status_code == 422
+    assert resp.headers["X-Query-Count"] == "0"
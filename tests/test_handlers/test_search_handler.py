@@ -0,0 +1,71 @@
+import uuid
+
+
+async def test_search_user_by_partial_name(client, create_user_in_database, pg_trgm):
+    user_data = {
+        "user_id": uuid.uuid4(),
+        "name": "Nikolai",
+        "surname": "Sviridov",
+        "email": "lol@kek.com",
+        "is_active": True,
+    }
+    other_user_data = {
+        "user_id": uuid.uuid4(),
+        "name": "Ivan",
+        "surname": "Ivanov",
+        "email": "ivan@kek.com",
+        "is_active": True,
+    }
+    for data in [user_data, other_user_data]:
+        await create_user_in_database(**data)
+
+    resp = client.get("/user/search?q=Svirid")
+    assert resp.status_code == 200
+    data_from_resp = resp.json()
+    assert len(data_from_resp["users"]) == 1
+    found_user = data_from_resp["users"][0]
+    assert found_user["user_id"] == str(user_data["user_id"])
+    assert found_user["name"] == user_data["name"]
+    assert found_user["surname"] == user_data["surname"]
+    assert found_user["email"] == user_data["email"]
+    assert found_user["is_active"] is True
+    assert data_from_resp["next_cursor"] is None
+
+
+async def test_search_user_pagination(client, create_user_in_database, pg_trgm):
+    user_ids = set()
+    for number in range(5):
+        user_id = uuid.uuid4()
+        user_ids.add(str(user_id))
+        await create_user_in_database(
+            user_id=user_id,
+            name="Ivan",
+            surname="Ivanov",
+            email=f"ivan{number}@kek.com",
+            is_active=True,
+        )
+
+    found_user_ids = []
+    cursor = None
+    for _ in range(3):
+        url = "/user/search?q=Ivanov&limit=2"
+        if cursor is not None:
+            url += f"&cursor={cursor}"
+        resp = client.get(url)
+        assert resp.status_code == 200
+        data_from_resp = resp.json()
+        found_user_ids += [user["user_id"] for user in data_from_resp["users"]]
+        cursor = data_from_resp["next_cursor"]
+
+    assert cursor is None
+    assert len(found_user_ids) == 5
+    assert set(found_user_ids) == user_ids
+
+
+async def test_search_user_validation_error(client):
+    resp = client.get("/user/search?q=Iv")
+    assert resp.status_code == 422
+
+    resp = client.get("/user/search?q=Ivan&cursor=bad")
+    assert resp.status_code == 422
+    assert resp.json() == {"detail": "Invalid search cursor"}
@@ -0,0 +1,203 @@
+import asyncio
+import json
+import uuid
+
+import asyncpg
+
+import settings
+from db.sharding import shard_for_user
+
+
+def _user_data(email, name="Lenny"):
+    return {
+        "name": name,
+        "surname": "Kravec",
+        "email": email,
+        "password": "password",
+    }
+
+
+async def _shard_rows(url, user_id):
+    connection = await asyncpg.connect("".join(url.split("+asyncpg")))
+    try:
+        return await connection.fetch(
+            "SELECT email FROM users WHERE user_id = $1", uuid.UUID(user_id)
+        )
+    finally:
+        await connection.close()
+
+
+def test_shard_for_user_is_stable():
+    user_id = uuid.UUID("6f1c3bd2-4a53-4a4e-9c55-0d4b2a6f8e11")
+    assert shard_for_user(user_id, 2) == shard_for_user(user_id, 2)
+    assert {shard_for_user(uuid.uuid4(), 4) for _ in range(200)} == {0, 1, 2, 3}
+
+
+async def test_users_are_stored_on_their_shard(sharded_user_dal, client):
+    shard_urls = settings.TEST_USER_SHARD_URLS
+    user_ids = []
+    for i in range(6):
+        resp = client.post("/user/", data=json.dumps(_user_data(f"lenny{i}@mail.ru")))
+        assert resp.status_code == 200
+        user_ids.append(resp.json()["user_id"])
+
+    for user_id in user_ids:
+        shard = shard_for_user(uuid.UUID(user_id), len(shard_urls))
+        for url_shard, url in enumerate(shard_urls):
+            rows = await _shard_rows(url, user_id)
+            assert len(rows) == (1 if url_shard == shard else 0)
+
+        resp = client.get(f"/user/?user_id={user_id}")
+        assert resp.status_code == 200
+
+    resp = client.delete(f"/user/?user_id={user_ids[0]}")
+    assert resp.status_code == 200
+    resp = client.get("/user/stats")
+    assert resp.json() == {"total": 6, "active": 5, "deactivated": 1}
+
+
+async def test_sharded_email_is_unique(sharded_user_dal, client):
+    resp = client.post("/user/", data=json.dumps(_user_data("lenny@mail.ru")))
+    assert resp.status_code == 200
+    resp = client.post("/user/", data=json.dumps(_user_data("lenny@mail.ru")))
+    assert resp.status_code == 503
+
+
+async def test_sharded_login_and_email_change(sharded_user_dal, client):
+    resp = client.post("/user/", data=json.dumps(_user_data("lenny@mail.ru")))
+    user_id = resp.json()["user_id"]
+
+    resp = client.post(
+        "/login/token", data={"username": "lenny@mail.ru", "password": "password"}
+    )
+    assert resp.status_code == 200
+
+    resp = client.patch(
+        f"/user/?user_id={user_id}", data=json.dumps({"email": "ivan@mail.ru"})
+    )
+    assert resp.status_code == 200
+    resp = client.post(
+        "/login/token", data={"username": "ivan@mail.ru", "password": "password"}
+    )
+    assert resp.status_code == 200
+    # the old email is free again
+    resp = client.post("/user/", data=json.dumps(_user_data("lenny@mail.ru")))
+    assert resp.status_code == 200
+
+
+async def test_concurrent_email_changes_release_every_old_email(
+    sharded_user_dal, asyncpg_pool
+):
+    try:
+        user = await sharded_user_dal.create_user(
+            name="Lenny",
+            surname="Kravec",
+            email="lenny@mail.ru",
+            hashed_password="hash",
+        )
+        await asyncio.gather(
+            *(
+                sharded_user_dal.update_user_by_id(user.user_id, email=email)
+                for email in ["ivan@mail.ru", "petr@mail.ru", "oleg@mail.ru"]
+            )
+        )
+        email = (await sharded_user_dal.get_user_by_id(user.user_id)).email
+    finally:
+        await sharded_user_dal.shards.dispose()
+
+    # only the email the user ended up with stays claimed
+    async with asyncpg_pool.acquire() as connection:
+        claimed = await connection.fetch("SELECT email FROM user_email_index")
+    assert [row["email"] for row in claimed] == [email]
+
+
+async def test_sharded_search_merges_shards(sharded_user_dal, client, pg_trgm):
+    for i in range(6):
+        client.post("/user/", data=json.dumps(_user_data(f"lenny{i}@mail.ru")))
+
+    resp = client.get("/user/search?q=lenny&limit=4")
+    assert resp.status_code == 200
+    first_page = resp.json()
+    assert len(first_page["users"]) == 4
+
+    resp = client.get(
+        f"/user/search?q=lenny&limit=4&cursor={first_page['next_cursor']}"
+    )
+    second_page = resp.json()
+    assert len(second_page["users"]) == 2
+    emails = {user["email"] for user in first_page["users"] + second_page["users"]}
+    assert emails == {f"lenny{i}@mail.ru" for i in range(6)}
+
+
+async def test_sharded_changes_feed(sharded_user_dal, client):
+    user_ids = []
+    for i in range(6):
+        resp = client.post("/user/", data=json.dumps(_user_data(f"lenny{i}@mail.ru")))
+        user_ids.append(resp.json()["user_id"])
+
+    resp = client.get("/user/changes?limit=4")
+    assert resp.status_code == 200
+    first_page = resp.json()
+    assert len(first_page["changes"]) == 4
+    assert first_page["next_cursor"] is None
+
+    resp = client.get(f"/user/changes?limit=4&cursor={first_page['next_shard_cursor']}")
+    second_page = resp.json()
+    assert len(second_page["changes"]) == 2
+    changed = [
+        change["user_id"] for change in first_page["changes"] + second_page["changes"]
+    ]
+    assert sorted(changed) == sorted(user_ids)
+
+    cursor = second_page["next_shard_cursor"]
+    client.patch(f"/user/?user_id={user_ids[3]}", data=json.dumps({"name": "Petr"}))
+    resp = client.get(f"/user/changes?cursor={cursor}")
+    assert [change["name"] for change in resp.json()["changes"]] == ["Petr"]
+
+    resp = client.get("/user/changes?cursor=oops")
+    assert resp.status_code == 422
+
+
+async def test_bulk_changes_of_sharded_users(sharded_user_dal, client):
+    user_ids = []
+    for i in range(6):
+        resp = client.post("/user/", data=json.dumps(_user_data(f"lenny{i}@mail.ru")))
+        user_ids.append(resp.json()["user_id"])
+
+    resp = client.patch(
+        "/user/bulk",
+        data=json.dumps(
+            {
+                "users": [
+                    {"user_id": user_id, "surname": "Ivanov"} for user_id in user_ids
+                ]
+                + [
+                    {"user_id": user_ids[0], "email": "ivanov@mail.ru"},
+                    {"user_id": user_ids[1], "email": "lenny2@mail.ru"},
+                ]
+            }
+        ),
+    )
+    assert resp.status_code == 200
+    statuses = {
+        result["user_id"]: result["status"] for result in resp.json()["results"]
+    }
+    assert statuses[user_ids[1]] == "email_taken"
+    assert [statuses[user_id] for user_id in user_ids[2:]] == ["updated"] * 4
+
+    resp = client.get(f"/user/?user_id={user_ids[0]}")
+    # the items of a user are merged
+    assert (resp.json()["email"], resp.json()["surname"]) == (
+        "ivanov@mail.ru",
+        "Ivanov",
+    )
+    resp = client.get(f"/user/?user_id={user_ids[2]}")
+    assert resp.json()["surname"] == "Ivanov"
+
+    resp = client.post("/user/bulk-deactivate", data=json.dumps({"user_ids": user_ids}))
+    assert [result["status"] for result in resp.json()["results"]] == [
+        "deactivated"
+    ] * 6
+    for user_id in user_ids:
+        resp = client.get(f"/user/?user_id={user_id}")
+        assert resp.json()["is_active"] is False
@@ -0,0 +1,64 @@
+import json
+import uuid
+
+import settings
+from db.jobs import reconcile_user_stats
+
+
+async def test_get_user_stats(client, monkeypatch):
+    monkeypatch.setattr(settings, "USER_STATS_CACHE_SECONDS", 0)
+    user_ids = []
+    for email in ["kravec@yandex.ru", "lenny@yandex.ru"]:
+        user_data = {
+            "name": "Lenny",
+            "surname": "Kravec",
+            "email": email,
+            "password": "password",
+        }
+        resp = client.post("/user/", data=json.dumps(user_data))
+        assert resp.status_code == 200
+        user_ids.append(resp.json()["user_id"])
+
+    resp = client.delete(f"/user/?user_id={user_ids[0]}")
+    assert resp.status_code == 200
+
+    resp = client.get("/user/stats")
+    assert resp.status_code == 200
+    assert resp.json() == {"total": 2, "active": 1, "deactivated": 1}
+
+
+async def test_user_stats_are_cached(client, monkeypatch):
+    monkeypatch.setattr(settings, "USER_STATS_CACHE_SECONDS", 60)
+    first_resp = client.get("/user/stats")
+    user_data = {
+        "name": "Lenny",
+        "surname": "Kravec",
+        "email": "kravec@yandex.ru",
+        "password": "password",
+    }
+    client.post("/user/", data=json.dumps(user_data))
+
+    resp = client.get("/user/stats")
+    assert resp.json() == first_resp.json()
+
+
+async def test_reconcile_user_stats(
+    client, monkeypatch, async_session_test, create_user_in_database
+):
+    monkeypatch.setattr(settings, "USER_STATS_CACHE_SECONDS", 0)
+    # written around UserDAL, so the counters don't know about these users
+    for number, is_active in enumerate([True, True, False]):
+        await create_user_in_database(
+            user_id=uuid.uuid4(),
+            name="Ivan",
+            surname="Ivanov",
+            email=f"ivan{number}@kek.com",
+            is_active=is_active,
+        )
+    resp = client.get("/user/stats")
+    assert resp.json() == {"total": 0, "active": 0, "deactivated": 0}
+
+    await reconcile_user_stats(async_session_test)
+
+    resp = client.get("/user/stats")
+    assert resp.json() == {"total": 3, "active": 2, "deactivated": 1}
@@ -0,0 +1,49 @@
+import asyncio
+import threading
+
+import pytest
+
+from hashing import calibrate_argon2
+from hashing import calibrate_bcrypt
+from hashing import HashingPool
+
+
+async def test_hashing_pool_queue_depth():
+    pool = HashingPool(workers=1)
+    release = threading.Event()
+
+    tasks = [
+        asyncio.create_task(pool.run(release.wait)),
+        asyncio.create_task(pool.run(release.wait)),
+        asyncio.create_task(pool.run(release.wait)),
+    ]
+    await asyncio.sleep(0.05)
+    # one task runs, two wait for the thread
+    assert pool.queue_depth == 2
+
+    release.set()
+    assert await asyncio.gather(*tasks) == [True, True, True]
+    assert pool.queue_depth == 0
+
+
+def test_calibrate_bcrypt():
+    params = calibrate_bcrypt(target_ms=1, min_rounds=4)
+    # below the floor the floor wins
+    assert params["bcrypt__default_rounds"] == 4
+
+    params = calibrate_bcrypt(target_ms=10_000, min_rounds=4)
+    assert 4 < params["bcrypt__default_rounds"] <= 31
+    # hashes of workers that measured another cost are not rehashed
+    assert params["bcrypt__min_rounds"] == 4
+    assert "bcrypt__max_rounds" not in params
+
+
+def test_calibrate_argon2():
+    pytest.importorskip("argon2")
+    params = calibrate_argon2(
+        target_ms=1, min_time_cost=2, memory_cost=1024, parallelism=1
+    )
+    assert params["argon2__default_rounds"] == 2
+    assert params["argon2__min_rounds"] == 2
+    assert "argon2__max_rounds" not in params
+    assert params["argon2__memory_cost"] == 1024
@@ -0,0 +1,66 @@
+import asyncio
+import uuid
+
+from db.dals import UserDAL
+from db.loaders import BatchLoader
+from db.loaders import UserLoader
+from db.query_stats import capture_statements
+
+
+async def test_keys_of_one_tick_are_loaded_in_one_batch():
+    batches = []
+
+    async def batch_fn(keys):
+        batches.append(sorted(keys))
+        return {key: key * 10 for key in keys if key != 3}
+
+    loader = BatchLoader(batch_fn)
+    results = await asyncio.gather(*(loader.load(key) for key in [1, 2, 3, 2]))
+
+    assert results == [10, 20, None, 20]
+    assert batches == [[1, 2, 3]]
+
+
+async def test_batch_size_limit_splits_batches():
+    batches = []
+
+    async def batch_fn(keys):
+        batches.append(len(keys))
+        return {key: key for key in keys}
+
+    loader = BatchLoader(batch_fn, max_batch_size=2, max_delay_us=1000)
+    await asyncio.gather(*(loader.load(key) for key in range(5)))
+
+    assert batches == [2, 2, 1]
+
+
+async def test_user_loader_uses_one_query(async_session_test):
+    user_ids = []
+    async with async_session_test() as session:
+        async with session.begin():
+            user_dal = UserDAL(session)
+            for number in range(3):
+                user = await user_dal.create_user(
+                    name="Lenny",
+                    surname="Kravec",
+                    email=f"kravec{number}@yandex.ru",
+                    hashed_password="hash",
+                )
+                user_ids.append(user.user_id)
+
+    loader = UserLoader(async_session_test)
+    missing_user_id = uuid.uuid4()
+    with capture_statements() as statements:
+        users = await asyncio.gather(
+            *(loader.by_id.load(user_id) for user_id in user_ids + [missing_user_id]),
+            loader.by_email.load("kravec0@yandex.ru"),
+        )
+
+    # one SELECT for all ids and one for the email
+    assert sorted(statement.split("WHERE ")[-1] for statement, _ in statements) == [
+        "users.email = ANY (%s)",
+        "users.user_id = ANY (%s)",
+    ]
+    assert [user.user_id for user in users[:3]] == user_ids
+    assert users[3] is None
+    assert users[4].user_id == user_ids[0]
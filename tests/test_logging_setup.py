@@ -0,0 +1,58 @@
+import json
+import logging
+import queue
+
+from logging_setup import current_request_id
+from logging_setup import JsonFormatter
+from logging_setup import NonBlockingQueueHandler
+from logging_setup import RateLimitFilter
+from logging_setup import RequestIdFilter
+
+
+def _record(msg, *args, level=logging.ERROR):
+    return logging.LogRecord("api.handlers", level, __file__, 1, msg, args, None)
+
+
+def test_rate_limit_filter_samples_repeated_messages():
+    rate_limit = RateLimitFilter(burst=3, period=60, sample_rate=10)
+    records = [_record(ValueError(f"duplicate key {i}")) for i in range(25)]
+    passed = [record for record in records if rate_limit.filter(record)]
+
+    # 3 of the burst, then every 10th: the 13th and the 23rd
+    assert len(passed) == 5
+    assert passed[3].suppressed == 9
+    assert passed[4].suppressed == 9
+    # other messages have their own budget
+    assert rate_limit.filter(_record("User %s created", "lenny"))
+
+
+def test_json_formatter_with_request_id():
+    token = current_request_id.set("req-1")
+    try:
+        record = _record("User %s not found", "lenny")
+        RequestIdFilter().filter(record)
+    finally:
+        current_request_id.reset(token)
+
+    entry = json.loads(JsonFormatter().format(record))
+    assert entry["message"] == "User lenny not found"
+    assert entry["level"] == "ERROR"
+    assert entry["request_id"] == "req-1"
+
+
+def test_queue_handler_does_not_block_when_full():
+    handler = NonBlockingQueueHandler(queue.Queue(maxsize=2))
+    for i in range(5):
+        handler.handle(_record("message %d", i))
+    assert handler.queue.qsize() == 2
+    assert handler.dropped == 3
+    assert handler.queue.get_nowait().getMessage() == "message 0"
+
+
+async def test_request_id_header(client):
+    resp = client.get("/health/live", headers={"X-Request-ID": "abc-123"})
+    assert resp.headers["X-Request-ID"] == "abc-123"
+
+    resp = client.get("/health/live", headers={"X-Request-ID": "bad id\n"})
+    assert resp.headers["X-Request-ID"] != "bad id\n"
+    assert len(resp.headers["X-Request-ID"]) == 32
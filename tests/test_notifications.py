@@ -0,0 +1,113 @@
+import asyncio
+import uuid
+
+import settings
+from db import notifications
+from db.dals import UserDAL
+from db.notifications import get_notification_bus
+from db.notifications import InMemoryNotificationBus
+from db.notifications import LISTENER_APPLICATION_NAME
+from db.notifications import PostgresNotificationBus
+
+
+async def _create_user(session_factory) -> uuid.UUID:
+    async with session_factory() as session:
+        async with session.begin():
+            user = await UserDAL(session).create_user(
+                name="Lenny",
+                surname="Kravec",
+                email="kravec@yandex.ru",
+                hashed_password="hash",
+            )
+            return user.user_id
+
+
+async def test_in_memory_bus_delivers_only_committed_changes(
+    async_session_test, monkeypatch
+):
+    bus = InMemoryNotificationBus()
+    monkeypatch.setattr(notifications, "_bus", bus)
+    changed, reconnects = [], []
+    listener = asyncio.create_task(
+        bus.listen(changed.append, lambda: reconnects.append(True))
+    )
+    await asyncio.sleep(0)
+    user_id = await _create_user(async_session_test)
+
+    async with async_session_test() as session:
+        await session.begin()
+        await UserDAL(session).update_user_by_id(user_id, name="John")
+        await session.rollback()
+    assert changed == []
+
+    async with async_session_test() as session:
+        async with session.begin():
+            await UserDAL(session).delete_user_by_id(user_id)
+    assert changed == [user_id]
+    assert reconnects == [True]
+
+    listener.cancel()
+
+
+async def test_postgres_bus_evicts_and_flushes_on_reconnect(
+    async_session_test, asyncpg_pool, monkeypatch
+):
+    bus = PostgresNotificationBus(
+        ["".join(settings.TEST_DATABASE_URL.split("+asyncpg"))], keepalive_seconds=0.1
+    )
+    monkeypatch.setattr(notifications, "_bus", bus)
+    changed, reconnected = asyncio.Queue(), asyncio.Queue()
+    listener = asyncio.create_task(
+        bus.listen(changed.put_nowait, lambda: reconnected.put_nowait(True))
+    )
+    await asyncio.wait_for(reconnected.get(), 5)
+    user_id = await _create_user(async_session_test)
+
+    async with async_session_test() as session:
+        async with session.begin():
+            await UserDAL(session).update_user_by_id(user_id, name="John")
+    assert await asyncio.wait_for(changed.get(), 5) == user_id
+
+    async with asyncpg_pool.acquire() as connection:
+        await connection.execute(
+            """SELECT pg_terminate_backend(pid) FROM pg_stat_activity
+            WHERE application_name = $1;""",
+            LISTENER_APPLICATION_NAME,
+        )
+    assert await asyncio.wait_for(reconnected.get(), 10) is True
+
+    listener.cancel()
+
+
+async def test_postgres_bus_listens_on_every_shard(
+    sharded_user_dal, shard_databases, monkeypatch
+):
+    monkeypatch.setattr(settings, "USER_SHARD_URLS", shard_databases)
+    monkeypatch.setattr(notifications, "_bus", None)
+    bus = get_notification_bus()
+    changed, reconnected = asyncio.Queue(), asyncio.Queue()
+    listener = asyncio.create_task(
+        bus.listen(changed.put_nowait, lambda: reconnected.put_nowait(True))
+    )
+    for _ in shard_databases:
+        await asyncio.wait_for(reconnected.get(), 5)
+
+    try:
+        # one user on every shard
+        users, number = {}, 0
+        while len(users) < len(shard_databases):
+            number += 1
+            user = await sharded_user_dal.create_user(
+                name="Lenny",
+                surname="Kravec",
+                email=f"kravec{number}@yandex.ru",
+                hashed_password="hash",
+            )
+            users.setdefault(sharded_user_dal.shards.shard_of(user.user_id), user)
+
+        for user in users.values():
+            await sharded_user_dal.update_user_by_id(user.user_id, name="John")
+            assert await asyncio.wait_for(changed.get(), 5) == user.user_id
+    finally:
+        listener.cancel()
+        await sharded_user_dal.shards.dispose()
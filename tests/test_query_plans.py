@@ -0,0 +1,63 @@
+import settings
+from benchmarks.query_plans import collect_plans
+from benchmarks.query_plans import compare_plans
+from benchmarks.query_plans import create_plan_engine
+from benchmarks.query_plans import seed
+from benchmarks.query_plans import unplanned_methods
+
+
+def _plan(access: dict, total_cost: float) -> dict:
+    return {"sql": "SELECT", "plan": [], "access": access, "total_cost": total_cost}
+
+
+def test_every_user_dal_method_is_planned():
+    assert unplanned_methods() == []
+
+
+def test_compare_plans():
+    snapshot = {
+        "get_user_by_email#1": _plan({"users": "index"}, 8.3),
+        "get_user_stats#1": _plan({"user_stats": "seq"}, 30.0),
+        "delete_user_by_id#1": _plan({"users": "index"}, 8.3),
+    }
+    current = {
+        "get_user_by_email#1": _plan({"users": "seq"}, 120.0),
+        "get_user_stats#1": _plan({"user_stats": "seq"}, 40.0),
+        "create_user#1": _plan({}, 0.1),
+    }
+
+    assert compare_plans(snapshot, current, cost_threshold=0.5) == [
+        "get_user_by_email#1: users is scanned sequentially, not by index",
+        "get_user_by_email#1: estimated cost 120.0 > 8.3 by more than 50%",
+        "create_user#1: no snapshot, run capture",
+        "delete_user_by_id#1: statement is gone, run capture",
+    ]
+    assert compare_plans(snapshot, snapshot, cost_threshold=0) == []
+
+
+async def test_collect_plans_reports_lost_index(pg_trgm):
+    engine = create_plan_engine(settings.TEST_DATABASE_URL)
+    # the planner can't use indexes here, as if they were dropped
+    no_index_engine = create_plan_engine(
+        settings.TEST_DATABASE_URL,
+        connect_args={
+            "server_settings": {"enable_indexscan": "off", "enable_bitmapscan": "off"}
+        },
+    )
+    try:
+        await seed(engine, users=5000)
+        snapshot = await collect_plans(engine)
+        without_indexes = await collect_plans(no_index_engine)
+    finally:
+        await engine.dispose()
+        await no_index_engine.dispose()
+
+    assert snapshot["get_user_by_email#1"]["access"] == {"users": "index"}
+    # one flush for the user, one upsert of the counters
+    assert {"create_user#1", "create_user#2"} <= snapshot.keys()
+    assert compare_plans(snapshot, snapshot, cost_threshold=0) == []
+
+    problems = compare_plans(snapshot, without_indexes, cost_threshold=0.5)
+    assert (
+        "get_user_by_email#1: users is scanned sequentially, not by index" in problems
+    )
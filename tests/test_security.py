@@ -0,0 +1,88 @@
+import time
+from datetime import timedelta
+
+import pytest
+
+import settings
+from security import create_access_token
+from security import decode_access_token
+from security import HmacJWTCodec
+from security import JoseJWTCodec
+from security import set_jwt_codec
+from security import TokenError
+from security import verified_tokens
+from security import VerifiedTokenCache
+
+
+@pytest.fixture
+def codecs():
+    return [
+        JoseJWTCodec(settings.SECRET_KEY, settings.ALGORITHM),
+        HmacJWTCodec(settings.SECRET_KEY, settings.ALGORITHM),
+    ]
+
+
+def test_codecs_read_each_others_tokens(codecs):
+    claims = {"sub": "lenny@mail.ru", "exp": int(time.time()) + 60}
+    for encoder in codecs:
+        for decoder in codecs:
+            assert decoder.decode(encoder.encode(claims)) == claims
+
+
+def test_codecs_reject_bad_tokens(codecs):
+    expired = {"sub": "lenny@mail.ru", "exp": int(time.time()) - 1}
+    other_key = HmacJWTCodec("other_secret_key", settings.ALGORITHM)
+    other_algorithm = HmacJWTCodec(settings.SECRET_KEY, "HS512")
+    for codec in codecs:
+        with pytest.raises(TokenError):
+            codec.decode(codec.encode(expired))
+        with pytest.raises(TokenError):
+            codec.decode(other_key.encode({"sub": "lenny@mail.ru"}))
+        with pytest.raises(TokenError):
+            codec.decode(other_algorithm.encode({"sub": "lenny@mail.ru"}))
+        with pytest.raises(TokenError):
+            codec.decode("not.a.token")
+
+
+class CountingCodec(JoseJWTCodec):
+    decoded = 0
+
+    def decode(self, token):
+        self.decoded += 1
+        return super().decode(token)
+
+
+def test_decode_access_token_uses_cache():
+    codec = CountingCodec(settings.SECRET_KEY, settings.ALGORITHM)
+    set_jwt_codec(codec)
+    verified_tokens.clear()
+    try:
+        token = create_access_token({"sub": "lenny@mail.ru"})
+        for _ in range(3):
+            assert decode_access_token(token)["sub"] == "lenny@mail.ru"
+        assert codec.decoded == 1
+
+        expired = create_access_token(
+            {"sub": "lenny@mail.ru"}, expires_delta=timedelta(seconds=-1)
+        )
+        for _ in range(2):
+            with pytest.raises(TokenError):
+                decode_access_token(expired)
+        assert codec.decoded == 3
+    finally:
+        set_jwt_codec(None)
+        verified_tokens.clear()
+
+
+def test_verified_token_cache_respects_exp_and_size():
+    cache = VerifiedTokenCache(max_size=2, max_ttl=60)
+    cache.put("expired", {"sub": "a", "exp": time.time() - 1})
+    assert cache.get("expired") is None
+
+    for token in ["first", "second", "third"]:
+        cache.put(token, {"sub": token, "exp": time.time() + 60})
+    assert cache.get("first") is None
+    assert cache.get("third") == {
+        "sub": "third",
+        "exp": pytest.approx(time.time() + 60, abs=1),
+    }
@@ -0,0 +1,90 @@
+import asyncio
+import time
+
+import pytest
+
+from db.deadlines import current_deadline
+from db.deadlines import DeadlineExceeded
+from db.single_flight import SingleFlight
+
+
+async def test_concurrent_calls_are_shared():
+    single_flight = SingleFlight()
+    calls = 0
+
+    async def fetch():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.01)
+        return "user"
+
+    results = await asyncio.gather(*(single_flight.do("key", fetch) for _ in range(10)))
+
+    assert results == ["user"] * 10
+    assert calls == 1
+    stats = single_flight.stats()["key"]
+    assert stats.calls == 1
+    assert stats.shared == 9
+
+
+async def test_error_is_shared_and_not_kept():
+    single_flight = SingleFlight()
+
+    async def fail():
+        await asyncio.sleep(0.01)
+        raise ValueError("db is down")
+
+    results = await asyncio.gather(
+        *(single_flight.do("key", fail) for _ in range(3)), return_exceptions=True
+    )
+    assert all(isinstance(result, ValueError) for result in results)
+    assert single_flight.stats()["key"].errors == 1
+
+    async def fetch():
+        return "user"
+
+    assert await single_flight.do("key", fetch) == "user"
+
+
+async def test_call_goes_on_when_its_caller_is_cancelled():
+    single_flight = SingleFlight()
+    started = asyncio.Event()
+    calls = 0
+
+    async def fetch():
+        nonlocal calls
+        calls += 1
+        started.set()
+        await asyncio.sleep(0.05)
+        return "user"
+
+    leader = asyncio.create_task(single_flight.do("key", fetch))
+    await started.wait()
+    follower = asyncio.create_task(single_flight.do("key", fetch))
+    await asyncio.sleep(0)
+    leader.cancel()
+
+    assert await follower == "user"
+    assert calls == 1
+    with pytest.raises(asyncio.CancelledError):
+        await leader
+
+
+async def test_call_runs_without_deadline_of_its_caller():
+    single_flight = SingleFlight()
+
+    async def fetch():
+        await asyncio.sleep(0.05)
+        return current_deadline.get()
+
+    token = current_deadline.set(time.monotonic() + 0.01)
+    try:
+        leader = asyncio.create_task(single_flight.do("key", fetch))
+    finally:
+        current_deadline.reset(token)
+    follower = asyncio.create_task(single_flight.do("key", fetch))
+
+    # the caller runs out of time, the call and the other caller don't
+    with pytest.raises(DeadlineExceeded):
+        await leader
+    assert await follower is None
@@ -0,0 +1,86 @@
+import json
+
+import httpx
+from fastapi import FastAPI
+from fastapi import Request
+from starlette.testclient import TestClient
+
+from api.traffic_capture import read_traffic
+from api.traffic_capture import redact_body
+from api.traffic_capture import redact_query
+from api.traffic_capture import TrafficCaptureMiddleware
+from api.traffic_capture import TrafficRecorder
+from benchmarks.replay_traffic import replay
+
+
+def test_redaction():
+    body = redact_body(
+        b'{"email": "lenny@mail.ru", "password": "secret", "nested": [{"token": "t"}]}',
+        "application/json",
+    )
+    assert json.loads(body) == {
+        "email": "lenny@mail.ru",
+        "password": "***",
+        "nested": [{"token": "***"}],
+    }
+    assert (
+        redact_body(
+            b"username=lenny%40mail.ru&password=secret",
+            "application/x-www-form-urlencoded",
+        )
+        == b"username=lenny%40mail.ru&password=%2A%2A%2A"
+    )
+    assert (
+        redact_query("user_id=1&access_token=abc") == "user_id=1&access_token=%2A%2A%2A"
+    )
+    # can't be redacted, so not kept
+    assert redact_body(b"password=secret", "application/json") is None
+
+
+def _echo_app():
+    app = FastAPI()
+    received = []
+
+    @app.post("/login/token")
+    async def login(request: Request):
+        received.append(dict(await request.form()))
+        return {"ok": True}
+
+    @app.get("/user/")
+    async def get_user(user_id: str, request: Request):
+        received.append({"authorization": request.headers.get("authorization")})
+        return {"user_id": user_id}
+
+    return app, received
+
+
+async def test_capture_and_replay(tmp_path):
+    app, received = _echo_app()
+    recorder = TrafficRecorder(str(tmp_path / "capture.msgpack"))
+    recorder.start()
+    captured_app = TrafficCaptureMiddleware(app, recorder=recorder, sample_rate=1)
+    with TestClient(captured_app) as client:
+        client.post(
+            "/login/token", data={"username": "lenny@mail.ru", "password": "secret"}
+        )
+        client.get("/user/?user_id=42", headers={"Authorization": "Bearer real-token"})
+    recorder.stop()
+
+    entries = list(read_traffic(recorder.path))
+    assert [entry["path"] for entry in entries] == ["/login/token", "/user/"]
+    capture = (tmp_path / "capture.msgpack").read_bytes()
+    assert b"secret" not in capture and b"real-token" not in capture
+    assert entries[1]["auth"] is True
+    assert entries[1]["status"] == 200
+
+    received.clear()
+    async with httpx.AsyncClient(app=app, base_url="http://test") as client:
+        results = await replay(
+            entries, client, speed=100, password="replayed", token="replay-token"
+        )
+    # replayed concurrently, as captured, so the order is not fixed
+    assert len(received) == 2
+    assert {"username": "lenny@mail.ru", "password": "replayed"} in received
+    assert {"authorization": "Bearer replay-token"} in received
+    assert len(results["GET /user/"]["latencies"]) == 1
+    assert results["POST /login/token"]["errors"] == 0
@@ -0,0 +1,94 @@
+import pytest
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.orm import sessionmaker
+
+import settings
+from db import notifications
+from db import session as db_session
+from db.notifications import InMemoryNotificationBus
+from db.session import UnitOfWork
+from db.session import warm_up_pool
+
+
+@pytest.fixture
+async def test_engine():
+    engine = create_async_engine(settings.TEST_DATABASE_URL, future=True)
+    yield engine
+    await engine.dispose()
+
+
+def _unit_of_work(engine) -> UnitOfWork:
+    return UnitOfWork(sessionmaker(engine, expire_on_commit=False, class_=AsyncSession))
+
+
+async def test_connection_is_taken_by_first_query(test_engine):
+    unit_of_work = _unit_of_work(test_engine)
+    async with unit_of_work.transaction():
+        assert test_engine.pool.checkedout() == 0
+        async with unit_of_work.transaction() as session:
+            await session.execute(text("SELECT 1"))
+            assert test_engine.pool.checkedout() == 1
+        # the nested block leaves the connection to the outer one
+        assert test_engine.pool.checkedout() == 1
+    assert test_engine.pool.checkedout() == 0
+    await unit_of_work.close()
+
+
+async def test_nested_transactions_share_one(test_engine):
+    unit_of_work = _unit_of_work(test_engine)
+    async with unit_of_work.transaction() as session:
+        outer = (await session.execute(text("SELECT txid_current()"))).scalar()
+        async with unit_of_work.transaction() as nested_session:
+            nested = (
+                await nested_session.execute(text("SELECT txid_current()"))
+            ).scalar()
+    assert nested_session is session
+    assert nested == outer
+
+    # the next outermost block is a new transaction
+    async with unit_of_work.transaction() as session:
+        following = (await session.execute(text("SELECT txid_current()"))).scalar()
+    assert following != outer
+
+
+async def test_error_in_nested_transaction_rolls_back_all(test_engine):
+    unit_of_work = _unit_of_work(test_engine)
+    with pytest.raises(ValueError):
+        async with unit_of_work.transaction() as session:
+            await session.execute(
+                text(
+                    "INSERT INTO users (user_id, name, surname, email, hashed_password)"
+                    " VALUES (gen_random_uuid(), 'Lenny', 'Kravec', 'uow@mail.ru', '')"
+                )
+            )
+            async with unit_of_work.transaction():
+                raise ValueError()
+
+    async with unit_of_work.transaction() as session:
+        count = (await session.execute(text("SELECT count(*) FROM users"))).scalar()
+    assert count == 0
+
+
+async def test_warm_up_pool_leaves_connections_in_pool(test_engine, monkeypatch):
+    monkeypatch.setattr(settings, "DB_POOL_WARM_CONNECTIONS", 3)
+    monkeypatch.setattr(notifications, "_bus", InMemoryNotificationBus())
+    monkeypatch.setattr(
+        db_session,
+        "async_session",
+        sessionmaker(test_engine, expire_on_commit=False, class_=AsyncSession),
+    )
+
+    await warm_up_pool(settings.DB_POOL_WARM_CONNECTIONS)
+
+    assert test_engine.pool.checkedin() == settings.DB_POOL_WARM_CONNECTIONS
+    assert test_engine.pool.checkedout() == 0
+    # the statements were prepared in rolled back transactions
+    unit_of_work = _unit_of_work(test_engine)
+    async with unit_of_work.transaction() as session:
+        users = (await session.execute(text("SELECT count(*) FROM users"))).scalar()
+        stats = (
+            await session.execute(text("SELECT count(*) FROM user_stats"))
+        ).scalar()
+    assert (users, stats) == (0, 0)
@@ -0,0 +1,86 @@
+import uuid
+
+import pytest
+from pydantic.errors import EmailError
+from pydantic.networks import validate_email
+
+from api.models import BulkUpdateRequest
+from api.models import ShowUser
+from api.validation import bulk_user_update
+from api.validation import fast_validate_email
+
+
+@pytest.mark.parametrize(
+    "value",
+    [
+        "kravec@yandex.ru",
+        "Kravec.Lenny+tag@Mail.Example.COM",
+        "o'neil@university.edu",
+        "student@localhost",
+        "student@univ.test",
+        "student@univ.local",
+        "a" * 65 + "@mail.ru",
+        "student@" + "a" * 250 + ".com",
+        "student..name@mail.ru",
+        "student@mail",
+        "student@-mail.ru",
+        "student@mail.123",
+        "Lenny Kravec <kravec@yandex.ru>",
+        "студент@почта.рф",
+        "lol",
+        "",
+        "@mail.ru",
+    ],
+)
+def test_fast_validate_email_matches_email_str(value):
+    try:
+        expected = validate_email(value)[1]
+    except EmailError:
+        with pytest.raises(EmailError):
+            fast_validate_email(value)
+    else:
+        assert fast_validate_email(value) == expected
+
+
+def test_show_user_email():
+    user = ShowUser(
+        user_id=uuid.uuid4(),
+        name="Lenny",
+        surname="Kravec",
+        email="Kravec@Yandex.RU",
+        is_active=True,
+    )
+    assert user.email == "Kravec@yandex.ru"
+
+
+def test_bulk_user_update_collects_errors_of_all_items():
+    user_id = uuid.uuid4()
+    cleaned, errors = bulk_user_update.validate_items(
+        [
+            {"user_id": str(user_id), "name": "Ivan", "is_active": False},
+            {"name": 42},
+            {"user_id": None, "email": None},
+            "Ivan",
+        ],
+        loc=["users"],
+    )
+    assert cleaned == [{"user_id": user_id, "name": "Ivan"}, None, None, None]
+    assert [(error["loc"], error["type"]) for error in errors] == [
+        (["users", 1, "user_id"], "value_error.missing"),
+        (["users", 1, "name"], "value_error.letters"),
+        (["users", 2, "user_id"], "type_error.none.not_allowed"),
+        (["users", 3], "type_error.dict"),
+    ]
+
+
+def test_bulk_update_request_items():
+    user_id = uuid.uuid4()
+    cleaned, _ = bulk_user_update.validate_items(
+        [{"user_id": str(user_id), "email": "Ivanov@Yandex.ru"}]
+    )
+    body = BulkUpdateRequest.from_cleaned(cleaned)
+    assert body.users[0].user_id == user_id
+    assert body.users[0].dict(exclude_none=True) == {
+        "user_id": user_id,
+        "email": "Ivanov@yandex.ru",
+    }
@@ -0,0 +1,60 @@
+import asyncio
+
+import pytest
+from sqlalchemy.exc import IntegrityError
+
+from db.write_batcher import UserWriteBatcher
+
+
+async def test_concurrent_creations_are_written_together(
+    async_session_test, get_user_from_database
+):
+    batcher = UserWriteBatcher(async_session_test, max_delay_ms=5)
+    users = await asyncio.gather(
+        *(
+            batcher.create_user(
+                name="Lenny",
+                surname="Kravec",
+                email=f"kravec{number}@yandex.ru",
+                hashed_password="hash",
+            )
+            for number in range(5)
+        )
+    )
+
+    assert len({user.user_id for user in users}) == 5
+    for number, user in enumerate(users):
+        assert user.email == f"kravec{number}@yandex.ru"
+        assert user.is_active is True
+        users_from_db = await get_user_from_database(user.user_id)
+        assert len(users_from_db) == 1
+
+
+async def test_duplicate_email_fails_only_its_caller(async_session_test):
+    batcher = UserWriteBatcher(async_session_test, max_delay_ms=5)
+    results = await asyncio.gather(
+        *(
+            batcher.create_user(
+                name="Lenny",
+                surname="Kravec",
+                email=email,
+                hashed_password="hash",
+            )
+            for email in ["kravec@yandex.ru", "lenny@yandex.ru", "kravec@yandex.ru"]
+        ),
+        return_exceptions=True,
+    )
+
+    assert results[0].email == "kravec@yandex.ru"
+    assert results[1].email == "lenny@yandex.ru"
+    # the error of the driver, as for a single INSERT
+    assert isinstance(results[2], IntegrityError)
+    assert 'unique constraint "users_email_key"' in str(results[2])
+
+    with pytest.raises(IntegrityError):
+        await batcher.create_user(
+            name="John",
+            surname="Snow",
+            email="lenny@yandex.ru",
+            hashed_password="hash",
+        )